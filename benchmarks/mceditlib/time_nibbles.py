@@ -0,0 +1,69 @@
+"""
+    time_nibbles
+
+    Compares packing and unpacking a section's four nibble arrays (Data, SkyLight, BlockLight and Add) one
+    array at a time with temporary copies against the kernels in mceditlib.anvil.adapter.
+"""
+from __future__ import absolute_import, division, print_function
+import timeit
+
+import numpy
+
+from mceditlib.anvil.adapter import packNibbleArray, unpackNibbleArray, unpackNibbleArrays
+
+
+def unpackNibbleArrayCopying(dataArray):
+    s = dataArray.shape
+    unpackedData = numpy.empty((s[0], s[1], s[2] * 2), dtype='uint8')
+
+    unpackedData[:, :, ::2] = dataArray
+    unpackedData[:, :, ::2] &= 0xf
+    unpackedData[:, :, 1::2] = dataArray
+    unpackedData[:, :, 1::2] >>= 4
+    return unpackedData
+
+
+def packNibbleArrayCopying(unpackedData):
+    packedData = numpy.array(unpackedData.reshape(16, 16, unpackedData.shape[2] // 2, 2))
+    packedData[..., 1] <<= 4
+    packedData[..., 1] |= packedData[..., 0]
+    return numpy.array(packedData[:, :, :, 1])
+
+
+packedArrays = [numpy.random.randint(0, 256, (16, 16, 8)).astype('uint8') for _ in range(4)]
+unpackedArrays = [numpy.random.randint(0, 16, (16, 16, 16)).astype('uint8') for _ in range(4)]
+
+
+def unpackCopying():
+    return [unpackNibbleArrayCopying(a) for a in packedArrays]
+
+
+def unpackPerArray():
+    return [unpackNibbleArray(a) for a in packedArrays]
+
+
+def unpackFused():
+    return unpackNibbleArrays(packedArrays)
+
+
+def packCopying():
+    return [packNibbleArrayCopying(a) for a in unpackedArrays]
+
+
+def packInPlace():
+    return [packNibbleArray(a) for a in unpackedArrays]
+
+
+assert all((a == b).all() for a, b in zip(unpackCopying(), unpackFused()))
+assert all((a == b).all() for a, b in zip(unpackCopying(), unpackPerArray()))
+assert all((a == b).all() for a, b in zip(packCopying(), packInPlace()))
+assert all((unpackNibbleArray(packNibbleArray(a)) == a).all() for a in unpackedArrays)
+
+number = 20000
+for name, func in [("Unpack (copying)", unpackCopying),
+                   ("Unpack (per array)", unpackPerArray),
+                   ("Unpack (fused)", unpackFused),
+                   ("Pack (copying)", packCopying),
+                   ("Pack (in place)", packInPlace)]:
+    duration = timeit.timeit(func, number=number)
+    print("%s: %.02fus per section" % (name, duration * 1000000 / number))
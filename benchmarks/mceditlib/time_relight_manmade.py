@@ -23,7 +23,7 @@ def do_copy(dim, station, relight):
 def manmade_relight(test):
     world = bench_temp_level("AnvilWorld")
     dim = world.getDimension()
-    stationEditor = WorldEditor("test_files/station.schematic")
+    stationEditor = WorldEditor("test_files/Station.schematic")
     station = stationEditor.getDimension()
 
     startCopy = time.time()
@@ -56,6 +56,24 @@ def manmade_relight(test):
                   % (count, len(positions), t, count / t, 1000 * t / count)
         postCopy()
 
+    if test == "batch" or test == "all":
+        def batchCopy():
+            # Relight every section at once. This touches more sections than a RelightCtx
+            # keeps at once, so it also measures the cost of evicting and reloading sections.
+            start = time.time()
+            indices = numpy.indices((16, 16, 16), numpy.int32)
+            indices.shape = 3, 1, 16*16*16
+            origins = numpy.array(positions, numpy.int32).T[:, :, None] << 4
+            x, y, z = indices + origins
+            print("Relighting all sections at once. Updating %d cells" % x.size)
+            relight.updateLightsByCoord(dim, x, y, z)
+            t = time.time() - start
+
+            print "Relight manmade building (outside copyBlocks, all sections at once): " \
+                  "%d chunk-sections in %.02f seconds (%f sections per second; %dms per section; %d cells per second)" \
+                  % (len(positions), t, len(positions) / t, 1000 * t / len(positions), x.size / t)
+        batchCopy()
+
     if test == "smart" or test == "all":
         def allSections():
             world = bench_temp_level("AnvilWorld")
@@ -270,6 +270,8 @@ class ChunkLoader(QtCore.QObject):
             return
 
         chunkStartTime = time.time()
+        with profiler.context("updatePendingLights"):
+            self.dimension.updatePendingLights()
         try:
             with profiler.context("getChunk"):
                 chunk = self.dimension.getChunk(*cPos)
@@ -6,6 +6,7 @@ import logging
 import math
 import numpy
 from mcedit2.util import profiler
+from mceditlib.blockaccessor import BlockAccessor
 from mceditlib.geometry import Vector, Ray
 from mceditlib.selection import SectionBox, rayIntersectsBox
 from mceditlib import faces
@@ -77,9 +78,10 @@ def rayCast(ray, dimension, maxDistance=100):
     point = advanceToChunk(Ray(point, vector), dimension, maxDistance * 4)
 
     foundAir = False
+    accessor = BlockAccessor(dimension)
 
     for pos, face in _cast(point, vector, maxDistance, 1):
-        ID = dimension.getBlockID(*pos)
+        ID = accessor.getBlockID(*pos)
 
         if ID == 0:  # xxx configurable air blocks?
             foundAir = True
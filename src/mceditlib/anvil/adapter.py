@@ -10,6 +10,8 @@ import re
 import struct
 import traceback
 import collections
+import functools
+import threading
 import weakref
 
 import numpy
@@ -24,11 +26,13 @@ from mceditlib.blocktypes import PCBlockTypeSet, BlockType, VERSION_1_8, VERSION
 from mceditlib.geometry import Vector
 from mceditlib.nbt import NBTFormatError
 from mceditlib.nbtattr import NBTCompoundRef
+from mceditlib.pc.regionfile import RegionFile, decompressChunk, deflate, inflate
 from mceditlib.selection import BoundingBox
 from mceditlib import nbtattr
 from mceditlib.exceptions import PlayerNotFound, ChunkNotPresent, LevelFormatError
 from mceditlib.revisionhistory import RevisionHistory
 from mceditlib.util import exhaust, displayName, WorldInfo
+from mceditlib.util import workers
 
 log = logging.getLogger(__name__)
 
@@ -58,34 +62,56 @@ class SessionLockLost(IOError):
 # --- Helper functions ---
 
 
-def unpackNibbleArray(dataArray):
+def unpackNibbleArray(dataArray, out=None):
+    """
+    Unpack an array of 4-bit values stored two to a byte, low nibble first, along the last axis.
+
+    :param dataArray: Packed array
+    :param out: Array to unpack into, with a last axis twice as long as dataArray's. Allocated if not given.
+    :return: Unpacked array
+    """
     s = dataArray.shape
-    unpackedData = numpy.empty((s[0], s[1], s[2] * 2), dtype='uint8')
+    if out is None:
+        out = numpy.empty(s[:-1] + (s[-1] * 2,), dtype='uint8')
+
+    numpy.bitwise_and(dataArray, 0xf, out=out[..., ::2])
+    numpy.right_shift(dataArray, 4, out=out[..., 1::2])
+    return out
+
 
-    unpackedData[:, :, ::2] = dataArray
-    unpackedData[:, :, ::2] &= 0xf
-    unpackedData[:, :, 1::2] = dataArray
-    unpackedData[:, :, 1::2] >>= 4
-    return unpackedData
+# Both nibbles of each byte value, low nibble first, as the two bytes of a little-endian uint16
+_nibblePairs = numpy.array([(b & 0xf) | (b >> 4) << 8 for b in range(256)], dtype='<u2')
 
 
-def packNibbleArray(unpackedData):
-    packedData = numpy.array(unpackedData.reshape(16, 16, unpackedData.shape[2] // 2, 2))
-    packedData[..., 1] <<= 4
-    packedData[..., 1] |= packedData[..., 0]
-    return numpy.array(packedData[:, :, :, 1])
+def unpackNibbleArrays(dataArrays):
+    """
+    Unpack several packed arrays of the same shape into a single new array in one pass. Element i of the
+    result is the unpacked form of dataArrays[i].
 
+    Each packed byte is replaced by both of its nibbles at once using a table lookup, writing two unpacked
+    values per element of the packed arrays.
+    """
+    s = dataArrays[0].shape
+    out = numpy.empty((len(dataArrays),) + s[:-1] + (s[-1] * 2,), dtype='uint8')
+    numpy.take(_nibblePairs, numpy.stack(dataArrays), out=out.view('<u2'))
+    return out
 
-def deflate(data):
-    # zobj = zlib.compressobj(6,zlib.DEFLATED,-zlib.MAX_WBITS,zlib.DEF_MEM_LEVEL,0)
-    # zdata = zobj.compress(data)
-    # zdata += zobj.flush()
-    # return zdata
-    return zlib.compress(data)
 
+def packNibbleArray(unpackedData, out=None):
+    """
+    Pack an array of 4-bit values two to a byte along the last axis. The reverse of unpackNibbleArray.
+
+    :param unpackedData: Unpacked array
+    :param out: uint8 array to pack into, with a last axis half as long as unpackedData's. Allocated if not given.
+    :return: Packed array
+    """
+    s = unpackedData.shape
+    if out is None:
+        out = numpy.empty(s[:-1] + (s[-1] // 2,), dtype='uint8')
 
-def inflate(data):
-    return zlib.decompress(data)
+    numpy.left_shift(unpackedData[..., 1::2], 4, out=out, casting='unsafe')
+    numpy.bitwise_or(out, unpackedData[..., ::2], out=out, casting='unsafe')
+    return out
 
 
 def sanitizeBlocks(section, blocktypes):
@@ -122,6 +148,8 @@ class AnvilSection(object):
     :ivar Data: Block sub-data [0..15]
     :ivar BlockLight: Light emitted by blocks [0..15]
     :ivar SkyLight: Light emitted by the sun/moon [0..15]
+    :ivar dirty: True if the section changed since `encodedTag` was built
+    :ivar encodedTag: The section's tag as last built for saving, or None if the section was empty
     """
 
     def __init__(self, section_tag=None):
@@ -129,22 +157,29 @@ class AnvilSection(object):
             self._load(section_tag)
         else:
             self._create()
+        self.dirty = True
+        self.encodedTag = None
 
     def _load(self, section_tag):
         self.Y = section_tag.pop("Y").value
         self.Blocks = section_tag.pop("Blocks").value.astype("uint16")
         self.Blocks.shape = 16, 16, 16
 
-        for name in "Data", "SkyLight", "BlockLight":
-            section_array = section_tag.pop(name).value
+        packedTags = [section_tag.pop(name) for name in ("Data", "SkyLight", "BlockLight")]
+        addTag = section_tag.pop("Add", None)
+        if addTag is not None:
+            packedTags.append(addTag)
+
+        packedArrays = []
+        for tag in packedTags:
+            section_array = tag.value
             section_array.shape = 16, 16, 8
-            setattr(self, name, unpackNibbleArray(section_array))
+            packedArrays.append(section_array)
+        unpackedArrays = unpackNibbleArrays(packedArrays)
+        self.Data, self.SkyLight, self.BlockLight = unpackedArrays[:3]
 
-        tag = section_tag.pop("Add", None)
-        if tag is not None:
-            tag.value.shape = 16, 16, 8
-            add = unpackNibbleArray(tag.value)
-            self.Blocks |= numpy.array(add, 'uint16') << 8
+        if len(unpackedArrays) > 3:
+            self.Blocks |= numpy.array(unpackedArrays[3], 'uint16') << 8
 
         self.old_section_tag = section_tag
 
@@ -159,20 +194,42 @@ class AnvilSection(object):
         self.BlockLight = numpy.zeros(shape, 'uint8')
         self.old_section_tag = nbt.TAG_Compound()
 
+    @property
+    def nbytes(self):
+        """
+        Memory used by this section's arrays, in bytes.
+        """
+        return self.Blocks.nbytes + self.Data.nbytes + self.SkyLight.nbytes + self.BlockLight.nbytes
+
+    def isEmpty(self):
+        """
+        Return True if this section has no blocks, no block light and full sky light, and so does not need
+        to be saved.
+        """
+        return (not self.Blocks.any() and
+                not self.BlockLight.any() and
+                (self.SkyLight == 15).all())
+
+    def _blockArrays(self):
+        return self.Blocks, self.Data
+
+    def _packedLight(self, name):
+        return packNibbleArray(getattr(self, name))
+
     def buildNBTTag(self):
         """
         Return a TAG_Compound for saving this section to a chunk.
         """
         section_tag = self.old_section_tag
 
-        Blocks = self.Blocks
-        Data = packNibbleArray(self.Data)
-        BlockLight = packNibbleArray(self.BlockLight)
-        SkyLight = packNibbleArray(self.SkyLight)
+        Blocks, Data = self._blockArrays()
+        Data = packNibbleArray(Data)
+        BlockLight = self._packedLight("BlockLight")
+        SkyLight = self._packedLight("SkyLight")
 
         add = Blocks >> 8
         if add.any():
-            section_tag["Add"] = nbt.TAG_Byte_Array(packNibbleArray(add).astype('uint8'))
+            section_tag["Add"] = nbt.TAG_Byte_Array(packNibbleArray(add))
 
         section_tag['Blocks'] = nbt.TAG_Byte_Array(numpy.array(Blocks, 'uint8'))
         section_tag['Data'] = nbt.TAG_Byte_Array(Data)
@@ -183,6 +240,200 @@ class AnvilSection(object):
         return section_tag
 
 
+def _lightProperty(name):
+    def fget(self):
+        return self._getLight(name)
+
+    def fset(self, value):
+        self._packedLights.pop(name, None)
+        self._lightArrays[name] = value
+
+    return property(fget, fset)
+
+
+class PalettedAnvilSection(AnvilSection):
+    """
+    An AnvilSection that keeps its block IDs and data values as a palette of block states and an array of
+    indices into the palette, and its light arrays packed, or as a single value if the whole array has the
+    same value. Sections with few kinds of blocks take a fraction of the memory of an AnvilSection.
+
+    Blocks, Data, SkyLight and BlockLight are unpacked into ordinary arrays the first time each is accessed,
+    after which they behave as in AnvilSection. Call compact() to pack them again.
+    """
+    SkyLight = _lightProperty("SkyLight")
+    BlockLight = _lightProperty("BlockLight")
+
+    def __init__(self, section_tag=None):
+        self._palette = None  # block states as (ID << 4 | data), or None if Blocks and Data are unpacked
+        self._indices = None  # indices into _palette, nibble packed if the palette has 16 entries or fewer
+        self._Blocks = None
+        self._Data = None
+        self._packedLights = {}  # name -> packed nibble array, or int if the whole array has that value
+        self._lightArrays = {}  # name -> unpacked array
+        super(PalettedAnvilSection, self).__init__(section_tag)
+
+    def _load(self, section_tag):
+        self.Y = section_tag.pop("Y").value
+        Blocks = section_tag.pop("Blocks").value.astype("uint16")
+        Blocks.shape = 16, 16, 16
+
+        tag = section_tag.pop("Add", None)
+        if tag is not None:
+            tag.value.shape = 16, 16, 8
+            Blocks |= numpy.array(unpackNibbleArray(tag.value), 'uint16') << 8
+
+        Data = section_tag.pop("Data").value
+        Data.shape = 16, 16, 8
+        self._Blocks = Blocks
+        self._Data = unpackNibbleArray(Data)
+
+        for name in "SkyLight", "BlockLight":
+            packed = section_tag.pop(name).value
+            packed.shape = 16, 16, 8
+            self._packedLights[name] = _packedValue(packed)
+
+        self.old_section_tag = section_tag
+        self.compact()
+
+    @property
+    def Blocks(self):
+        if self._palette is not None:
+            self._Blocks, self._Data = self._unpackBlockStates()
+            self._palette = self._indices = None
+        return self._Blocks
+
+    @Blocks.setter
+    def Blocks(self, value):
+        self.Data  # unpack Data before replacing Blocks
+        self._Blocks = value
+
+    @property
+    def Data(self):
+        self.Blocks
+        return self._Data
+
+    @Data.setter
+    def Data(self, value):
+        self.Blocks
+        self._Data = value
+
+    def _unpackBlockStates(self):
+        indices = self._indices
+        if len(self._palette) <= 16:
+            indices = unpackNibbleArray(indices)
+        states = self._palette[indices]
+        return states >> 4, (states & 0xf).astype('uint8')
+
+    def _getLight(self, name):
+        array = self._lightArrays.get(name)
+        if array is None:
+            packed = self._packedLights.pop(name)
+            if isinstance(packed, int):
+                array = numpy.empty((16, 16, 16), 'uint8')
+                array[:] = packed
+            else:
+                array = unpackNibbleArray(packed)
+            self._lightArrays[name] = array
+        return array
+
+    def compact(self):
+        """
+        Pack the Blocks, Data, SkyLight and BlockLight arrays again if they were unpacked. Arrays with values
+        that do not fit in a section are left unpacked.
+
+        Changes made through references to the unpacked arrays after calling compact() are lost, so only call
+        this when nothing else refers to them, such as when the chunk is not loaded by a WorldEditor.
+        """
+        if self._palette is None and self._Blocks is not None:
+            Blocks = self._Blocks
+            Data = self._Data
+            if Blocks.max() < 4096 and Data.max() < 16:
+                states = (Blocks.astype('uint16') << 4) | Data
+                palette, indices = numpy.unique(states, return_inverse=True)
+                if len(palette) <= 256:
+                    indices = indices.astype('uint8').reshape(16, 16, 16)
+                    if len(palette) <= 16:
+                        indices = packNibbleArray(indices)
+                    self._palette = palette.astype('uint16')
+                    self._indices = indices
+                    self._Blocks = self._Data = None
+
+        for name, array in self._lightArrays.items():
+            if array.max() < 16:
+                self._packedLights[name] = _packedValue(packNibbleArray(array))
+                del self._lightArrays[name]
+
+    @property
+    def nbytes(self):
+        if self._palette is not None:
+            size = self._palette.nbytes + self._indices.nbytes
+        else:
+            size = self._Blocks.nbytes + self._Data.nbytes
+        for packed in self._packedLights.itervalues():
+            if not isinstance(packed, int):
+                size += packed.nbytes
+        for array in self._lightArrays.itervalues():
+            size += array.nbytes
+        return size
+
+    def isEmpty(self):
+        if self._palette is not None:
+            blocksEmpty = not (self._palette >> 4).any()
+        else:
+            blocksEmpty = not self._Blocks.any()
+        return blocksEmpty and self._lightIs("BlockLight", 0) and self._lightIs("SkyLight", 15)
+
+    def _lightIs(self, name, value):
+        packed = self._packedLights.get(name)
+        if packed is None:
+            return (self._lightArrays[name] == value).all()
+        if isinstance(packed, int):
+            return packed == value
+        return (packed == (value | value << 4)).all()
+
+    def _blockArrays(self):
+        if self._palette is not None:
+            return self._unpackBlockStates()
+        return self._Blocks, self._Data
+
+    def _packedLight(self, name):
+        packed = self._packedLights.get(name)
+        if packed is None:
+            return packNibbleArray(self._lightArrays[name])
+        if isinstance(packed, int):
+            array = numpy.empty((16, 16, 8), 'uint8')
+            array[:] = packed | packed << 4
+            return array
+        return packed
+
+
+def _packedValue(packed):
+    # Return the light value if every nibble in the packed array has the same value, else the array
+    first = packed.flat[0]
+    if (first & 0xf) == (first >> 4) and (packed == first).all():
+        return int(first & 0xf)
+    return packed
+
+
+# Approximate size of a section's arrays while in NBT form: Blocks, plus Data, SkyLight and BlockLight packed
+SECTION_TAG_BYTES = 16 * 16 * 16 * 5 // 2
+
+# Section class used for sections of loaded chunks. See setPalettedSections
+_sectionClass = AnvilSection
+
+
+def setPalettedSections(enabled):
+    """
+    Choose whether the sections of chunks loaded from now on are kept in paletted form, as
+    PalettedAnvilSection, instead of as AnvilSection. Paletted sections use less memory while unused but take
+    longer to load.
+
+    :type enabled: bool
+    """
+    global _sectionClass
+    _sectionClass = PalettedAnvilSection if enabled else AnvilSection
+
+
 class AnvilChunkData(object):
     """ This is the chunk data backing a WorldEditorChunk. Chunk data is retained by the WorldEditor until its
     WorldEditorChunk is no longer used, then it is either cached in memory, discarded, or written to disk according to
@@ -206,8 +457,18 @@ class AnvilChunkData(object):
         self.dimName = dimName
         self.adapter = adapter
         self.rootTag = rootTag
-        self.dirty = False
         self._sections = {}
+        self.dirty = False
+
+        # Section tags that have not been decoded yet, by section Y. Decoded by getSection.
+        self._sectionTags = {}
+        self._sectionClass = _sectionClass
+
+        # Size of the NBT data this chunk was loaded from. Lazily loaded tags keep this data in memory.
+        self.encodedSize = 0
+
+        # Called with this chunk after decoding or creating a section makes it larger
+        self.sizeChanged = None
 
         if create:
             self._create()
@@ -248,8 +509,7 @@ class AnvilChunkData(object):
 
         for sec in self.rootTag["Level"].pop("Sections", []):
             y = sec["Y"].value
-            self._sections[y] = AnvilSection(sec)
-
+            self._sectionTags[y] = sec
 
     def buildNBTTag(self):
         """ does not recalculate any data or light """
@@ -260,14 +520,21 @@ class AnvilChunkData(object):
 
         sections = nbt.TAG_List()
         for _, section in self._sections.iteritems():
-
-            if (not section.Blocks.any() and
-                    not section.BlockLight.any() and
-                    (section.SkyLight == 15).all()):
-                continue
-
-            sanitizeBlocks(section, self.adapter.blocktypes)
-            sections.append(section.buildNBTTag())
+            # Sections are only encoded again if they changed since they were last encoded
+            if section.dirty:
+                if section.isEmpty():
+                    section.encodedTag = None
+                else:
+                    sanitizeBlocks(section, self.adapter.blocktypes)
+                    section.encodedTag = section.buildNBTTag()
+                section.dirty = False
+
+            if section.encodedTag is not None:
+                sections.append(section.encodedTag)
+
+        # Sections that were never decoded are saved as they were loaded.
+        for _, sectionTag in self._sectionTags.iteritems():
+            sections.append(sectionTag)
 
         chunkTag["Level"]["Sections"] = sections
 
@@ -277,8 +544,59 @@ class AnvilChunkData(object):
         log.debug(u"Saved chunk {0}".format(self))
         return chunkTag
 
+    def estimateSize(self):
+        """
+        Estimate the memory used by this chunk's data, in bytes. Counts the section arrays, the undecoded
+        section tags and the NBT data the chunk was loaded from.
+
+        :rtype: int
+        """
+        size = self.encodedSize
+        for section in self._sections.itervalues():
+            size += section.nbytes
+        size += len(self._sectionTags) * SECTION_TAG_BYTES
+        return size
+
+    def compactSections(self):
+        """
+        Pack the arrays of any sections that can be packed, such as PalettedAnvilSection. See
+        PalettedAnvilSection.compact for when this is safe to call.
+        """
+        for section in self._sections.itervalues():
+            compact = getattr(section, "compact", None)
+            if compact is not None:
+                compact()
+
+    @property
+    def dirty(self):
+        return self._dirty
+
+    @dirty.setter
+    def dirty(self, value):
+        """
+        Setting dirty to True marks every section dirty, as any of them may have changed. Use markDirty if only
+        one section changed.
+        """
+        if value:
+            for section in self._sections.itervalues():
+                section.dirty = True
+        self._dirty = value
+
+    def markDirty(self, cy=None):
+        """
+        Mark this chunk dirty after changing section `cy`, or only data outside its sections such as the
+        HeightMap if `cy` is None. Other sections are not encoded again when the chunk is saved.
+
+        :type cy: int | None
+        """
+        if cy is not None:
+            section = self._sections.get(cy)
+            if section is not None:
+                section.dirty = True
+        self._dirty = True
+
     def sectionPositions(self):
-        return self._sections.keys()
+        return self._sections.keys() + self._sectionTags.keys()
 
     def getSection(self, cy, create=False):
         """
@@ -294,13 +612,24 @@ class AnvilChunkData(object):
 
         section = self._sections.get(cy)
         if not section:
-            if not create:
+            sectionTag = self._sectionTags.pop(cy, None)
+            if sectionTag is not None:
+                # Decoding consumes the tag, so decode a copy. Lazily loaded tags are copied without decoding
+                # them. Until the section is changed, it is saved with the tag it was loaded from.
+                section = self._sectionClass(sectionTag.copy())
+                section.encodedTag = sectionTag
+                section.dirty = False
+                self._sections[cy] = section
+            elif not create:
                 return None
             else:
                 section = AnvilSection()
                 section.Y = cy
                 self._sections[cy] = section
 
+            if self.sizeChanged is not None:
+                self.sizeChanged(self)
+
         return section
 
     @property
@@ -342,7 +671,11 @@ class AnvilChunkData(object):
         """True or False. If False, the game will populate the chunk with
         ores and vegetation on next load"""
         self.rootTag["Level"]["TerrainPopulated"].value = val
-        self.dirty = True
+        self.markDirty()
+
+def _writeChunkAsync(revision, key, data):
+    cx, cz, dimName = key
+    revision.writeClosedChunkCompressed(cx, cz, dimName, deflate(data), RegionFile.VERSION_DEFLATE)
 
 # --- World info ---
 
@@ -410,6 +743,12 @@ class AnvilWorldAdapter(object):
     maxHeight = 256
     hasLights = True
 
+    # Number of chunks readChunks may decompress ahead of the chunk it is returning
+    READ_AHEAD = 32
+
+    # Number of chunks writeChunks may compress ahead of the chunk it is writing
+    WRITE_AHEAD = 32
+
     def __init__(self, filename=None, create=False, readonly=False, resume=None):
         """
         Load a Minecraft for PC level (Anvil format) from the given filename. It can point to either
@@ -431,6 +770,12 @@ class AnvilWorldAdapter(object):
         """
         self.lockTime = 0
 
+        # Chunks written by writeChunksAsync that are not yet written to their revision.
+        # Maps (cx, cz, dimName) to the AsyncResult of the write, in the order the writes were started.
+        # Finished writes are removed by the worker pool, so this is guarded by _pendingLock.
+        self._pendingWrites = collections.OrderedDict()
+        self._pendingLock = threading.Lock()
+
         self.EntityRef = PCEntityRef
         self.TileEntityRef = PCTileEntityRef
 
@@ -666,13 +1011,15 @@ class AnvilWorldAdapter(object):
 
     def syncToDisk(self):
         """
-        Write cached items (metadata from level.dat and players in players/ folder) to the current revision.
+        Write cached items (metadata from level.dat and players in players/ folder) to the current revision,
+        and flush the current revision's region files.
         :return:
         :rtype:
         """
         if self.metadata.dirty:
             self.selectedRevision.writeFile("level.dat", self.metadata.metadataTag.save())
             self.metadata.dirty = False
+        self.selectedRevision.flush()
 
     def saveChanges(self):
         exhaust(self.saveChangesIter())
@@ -688,6 +1035,7 @@ class AnvilWorldAdapter(object):
             raise IOError("World is opened read only.")
 
         self.checkSessionLock()
+        self.finishPendingWrites(wait=True)
         index = self.revisionHistory.nodes.index(self.selectedRevision)
         for status in self.revisionHistory.writeAllChangesIter(self.selectedRevision):
             yield status
@@ -695,6 +1043,21 @@ class AnvilWorldAdapter(object):
         self.selectedRevision = self.revisionHistory.nodes[index]
         yield
 
+    def compactRegionFilesIter(self):
+        """
+        Rewrite the world folder's region files to remove the space left unused by earlier edits.
+        Unsaved changes are not affected.
+
+        :return: Progress information as (current, max, status) tuples
+        :rtype: Iterator[(int, int, unicode)]
+        """
+        if self.readonly:
+            raise IOError("World is opened read only.")
+
+        self.checkSessionLock()
+        for status in self.revisionHistory.rootFolder.compactIter():
+            yield status
+
     def close(self):
         """
         Close the world, deleting temporary files and freeing resources. Operations on a closed world are undefined.
@@ -702,8 +1065,8 @@ class AnvilWorldAdapter(object):
         :return:
         :rtype: None
         """
+        self.finishPendingWrites(wait=True)
         self.revisionHistory.close()
-        pass  # do what here???
 
     # --- Undo revisions ---
 
@@ -767,6 +1130,7 @@ class AnvilWorldAdapter(object):
         """
         if index < 0 or index >= len(self.revisionHistory.nodes):
             return None
+        self.finishPendingWrites(wait=True)
         newRevision = self.revisionHistory.getRevision(index)
         changes = self.revisionHistory.getRevisionChanges(self.selectedRevision, newRevision)
         self.selectedRevision = newRevision
@@ -785,6 +1149,7 @@ class AnvilWorldAdapter(object):
             yield ID, node.getRevisionInfo()
 
     def getRevisionChanges(self, oldRevision, newRevision):
+        self.finishPendingWrites(wait=True)
         return self.revisionHistory.getRevisionChanges(oldRevision, newRevision)
 
     # --- Session lock ---
@@ -911,11 +1276,11 @@ class AnvilWorldAdapter(object):
         :return:
         :rtype: AnvilChunkData
         """
+        self._finishPendingWrite((cx, cz, dimName))
+        self.finishPendingWrites()
         try:
             data = self.selectedRevision.readChunkBytes(cx, cz, dimName)
-            chunkTag = nbt.load(buf=data)
-            log.debug("_getChunkData: Chunk %s loaded (%s bytes)", (cx, cz), len(data))
-            chunkData = AnvilChunkData(self, cx, cz, dimName, chunkTag)
+            chunkData = self._loadChunkData(cx, cz, dimName, data)
         except ChunkNotPresent:
             raise
         except (KeyError, IndexError, zlib.error, UnicodeError) as e:  # Missing nbt keys, lists too short, decompression failure, unknown NBT tags
@@ -923,15 +1288,162 @@ class AnvilWorldAdapter(object):
 
         return chunkData
 
+    def readChunks(self, chunkPositions, dimName):
+        """
+        Return an iterator of AnvilChunkData for the chunks at the given positions in the given dimension, in
+        the same order as the positions. Positions with no chunk present are skipped.
+
+        Chunks that cannot be read or decoded are also skipped, so that one damaged chunk does not prevent
+        reading the others. `readChunk` raises the error for them.
+
+        Chunks are read from disk on the calling thread and decompressed by the shared worker pool, up to
+        READ_AHEAD chunks ahead of the chunk being returned.
+
+        :type chunkPositions: Iterable[(int, int)]
+        :type dimName: str
+        :return:
+        :rtype: Iterator[AnvilChunkData]
+        """
+        pool = workers.getWorkerPool()
+        pending = collections.deque()
+
+        def _finish(cx, cz, result):
+            try:
+                data = result.get() if pool is not None else decompressChunk(*result)
+                return self._loadChunkData(cx, cz, dimName, data)
+            except (KeyError, IndexError, zlib.error, UnicodeError, LevelFormatError) as e:
+                log.warn("readChunks: Skipping chunk %s: %r", (cx, cz), e)
+                return None
+
+        for cx, cz in chunkPositions:
+            self._finishPendingWrite((cx, cz, dimName))
+            try:
+                compressed = self.selectedRevision.readChunkCompressed(cx, cz, dimName)
+            except ChunkNotPresent:
+                continue
+            except LevelFormatError as e:
+                log.warn("readChunks: Skipping chunk %s: %r", (cx, cz), e)
+                continue
+
+            if pool is not None:
+                pending.append((cx, cz, pool.apply_async(decompressChunk, compressed)))
+            else:
+                pending.append((cx, cz, compressed))
+
+            if len(pending) > self.READ_AHEAD:
+                chunkData = _finish(*pending.popleft())
+                if chunkData is not None:
+                    yield chunkData
+
+        while pending:
+            chunkData = _finish(*pending.popleft())
+            if chunkData is not None:
+                yield chunkData
+
+    def _loadChunkData(self, cx, cz, dimName, data):
+        chunkTag = nbt.load(buf=data, lazy=True)
+        log.debug("_getChunkData: Chunk %s loaded (%s bytes)", (cx, cz), len(data))
+        chunkData = AnvilChunkData(self, cx, cz, dimName, chunkTag)
+        chunkData.encodedSize = len(data)
+        return chunkData
+
     def writeChunk(self, chunk):
         """
         Write the given AnvilChunkData to the current revision.
 
         :type chunk: mceditlib.anvil.adapter.AnvilChunkData
         """
+        self._finishPendingWrite((chunk.cx, chunk.cz, chunk.dimName))
         tag = chunk.buildNBTTag()
         self.selectedRevision.writeChunkBytes(chunk.cx, chunk.cz, chunk.dimName, tag.save(compressed=False))
 
+    def writeChunks(self, chunks):
+        """
+        Write each of the given AnvilChunkData to the current revision. Returns an iterator that yields each
+        chunk after it is written.
+
+        Chunks are serialized on the calling thread and compressed by the shared worker pool, up to
+        WRITE_AHEAD chunks ahead of the chunk being written. Chunks are written on the calling thread, in the
+        same order they were given.
+
+        :type chunks: Iterable[AnvilChunkData]
+        :rtype: Iterator[AnvilChunkData]
+        """
+        pool = workers.getWorkerPool()
+        pending = collections.deque()
+
+        def _finish(chunk, result):
+            data = result.get() if pool is not None else result
+            self.selectedRevision.writeChunkCompressed(chunk.cx, chunk.cz, chunk.dimName,
+                                                       data, RegionFile.VERSION_DEFLATE)
+            return chunk
+
+        for chunk in chunks:
+            self._finishPendingWrite((chunk.cx, chunk.cz, chunk.dimName))
+            data = chunk.buildNBTTag().save(compressed=False)
+            if pool is not None:
+                pending.append((chunk, pool.apply_async(deflate, (data,))))
+            else:
+                pending.append((chunk, deflate(data)))
+
+            if len(pending) > self.WRITE_AHEAD:
+                yield _finish(*pending.popleft())
+
+        while pending:
+            yield _finish(*pending.popleft())
+
+    def writeChunksAsync(self, chunks):
+        """
+        Start writing each of the given AnvilChunkData to the current revision in the background, and return
+        without waiting for them to be written. The current revision may be closed before the writes are
+        finished; they are still written to it.
+
+        Each chunk is serialized on the calling thread, since building its tags holds the GIL, so it may be
+        edited again right away. The data is compressed by the shared worker pool and written to the revision
+        by the worker as soon as it is compressed. Reading a chunk that is still being written waits for its
+        write to finish.
+
+        :type chunks: Iterable[AnvilChunkData]
+        """
+        pool = workers.getWorkerPool()
+        revision = self.selectedRevision
+        for chunk in chunks:
+            key = chunk.cx, chunk.cz, chunk.dimName
+            self._finishPendingWrite(key)
+            data = chunk.buildNBTTag().save(compressed=False)
+            # Only revision folders may be written from other threads; the world folder's region files may not.
+            if pool is None or revision is self.revisionHistory.rootNode:
+                revision.writeChunkCompressed(chunk.cx, chunk.cz, chunk.dimName,
+                                              deflate(data), RegionFile.VERSION_DEFLATE)
+            else:
+                with self._pendingLock:
+                    self._pendingWrites[key] = pool.apply_async(_writeChunkAsync, (revision, key, data),
+                                                                callback=functools.partial(self._pendingWriteDone, key))
+
+    def _pendingWriteDone(self, key, _):
+        # Called by the worker pool after the chunk is written. Failed writes are left in _pendingWrites,
+        # so their errors are raised by the next finishPendingWrites.
+        with self._pendingLock:
+            self._pendingWrites.pop(key, None)
+
+    def finishPendingWrites(self, wait=False):
+        """
+        Raise the error of any failed write started by writeChunksAsync. If `wait` is True, also wait for all
+        pending chunks to be written.
+
+        :type wait: bool
+        """
+        with self._pendingLock:
+            keys = [key for key, result in self._pendingWrites.iteritems() if wait or result.ready()]
+        for key in keys:
+            self._finishPendingWrite(key)
+
+    def _finishPendingWrite(self, key):
+        with self._pendingLock:
+            result = self._pendingWrites.pop(key, None)
+        if result is not None:
+            result.get()
+
     def createChunk(self, cx, cz, dimName):
         """
         Create a new empty chunk at the given position in the given dimension.
@@ -942,6 +1454,7 @@ class AnvilWorldAdapter(object):
         :return:
         :rtype: AnvilChunkData
         """
+        self._finishPendingWrite((cx, cz, dimName))
         if self.selectedRevision.containsChunk(cx, cz, dimName):
             raise ValueError("Chunk %s already exists in dim %r" % ((cx, cz), dimName))
         chunk = AnvilChunkData(self, cx, cz, dimName, create=True)
@@ -956,6 +1469,7 @@ class AnvilWorldAdapter(object):
         :type cz: int
         :type dimName: str
         """
+        self._finishPendingWrite((cx, cz, dimName))
         self.selectedRevision.deleteChunk(cx, cz, dimName)
 
     # --- Players ---
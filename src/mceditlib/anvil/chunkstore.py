@@ -0,0 +1,255 @@
+"""
+    chunkstore
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import bisect
+from collections import defaultdict
+import hashlib
+import logging
+import threading
+
+from mceditlib.anvil.worldfolder import AnvilWorldFolder
+from mceditlib.exceptions import ChunkNotPresent
+from mceditlib.pc.regionfile import RegionFile, decompressChunk, deflate
+
+log = logging.getLogger(__name__)
+
+
+class ChunkStore(object):
+    """
+    Content-addressed storage for compressed chunk data, shared by all revisions of a RevisionHistory.
+
+    Each distinct chunk payload is written to the store's file once and is identified by its SHA-1 hash and
+    compression format. Storing a payload that is already present only adds a reference to it, so chunks that
+    are saved without changes, or copied between revisions by writeAllChanges, take no additional space.
+    Payloads are reference counted, and the space used by a payload is reused once all references to it are
+    released. Adjacent free space is merged, and free space at the end of the file is truncated.
+
+    The store may be used from several threads, so that revisions may be written in the background.
+    """
+
+    def __init__(self, filename):
+        """
+
+        :param filename: Path of the file to store chunk data in. The file is overwritten if it exists.
+        :type filename: unicode
+        """
+        self.filename = filename
+        self._file = open(filename, "w+b")
+        self._entries = {}  # key -> [offset, length, refcount]
+        self._freeExtents = []  # sorted list of (length, offset)
+        self._freeOffsets = []  # sorted list of the offsets in _freeExtents
+        self._freeLengths = {}  # offset -> length of each free extent
+        self._fileSize = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "ChunkStore(%r)" % self.filename
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def storedBytes(self):
+        """
+        Total size of all payloads in the store.
+
+        :rtype: int
+        """
+        return sum(entry[1] for entry in self._entries.itervalues())
+
+    def store(self, data, fmt):
+        """
+        Add a reference to the given compressed chunk data, writing it to the store's file if it is not already
+        present. Returns the key used to read or release the data.
+
+        :param data: Compressed chunk data
+        :type data: bytes | buffer
+        :param fmt: Compression format, either RegionFile.VERSION_GZIP or RegionFile.VERSION_DEFLATE
+        :type fmt: int
+        :return: Key identifying the data
+        :rtype: (bytes, int)
+        """
+        key = hashlib.sha1(data).digest(), fmt
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[2] += 1
+                return key
+
+            length = len(data)
+            offset = self._allocate(length)
+            self._file.seek(offset)
+            self._file.write(data)
+            self._entries[key] = [offset, length, 1]
+            return key
+
+    def read(self, key):
+        """
+        Read the compressed chunk data for the given key. Returns a (data, fmt) tuple as returned by
+        RegionFile.readChunkCompressed.
+
+        :type key: (bytes, int)
+        :rtype: (bytes, int)
+        """
+        with self._lock:
+            offset, length, refcount = self._entries[key]
+            self._file.seek(offset)
+            return self._file.read(length), key[1]
+
+    def release(self, key):
+        """
+        Remove a reference to the data for the given key. When no references remain, the space used by the
+        data is reused for later payloads.
+
+        :type key: (bytes, int)
+        """
+        with self._lock:
+            entry = self._entries[key]
+            entry[2] -= 1
+            if entry[2] == 0:
+                del self._entries[key]
+                self._free(entry[0], entry[1])
+
+    def _free(self, offset, length):
+        # Merge with the free extents before and after this one
+        i = bisect.bisect_left(self._freeOffsets, offset)
+        if i > 0:
+            prevOffset = self._freeOffsets[i - 1]
+            prevLength = self._freeLengths[prevOffset]
+            if prevOffset + prevLength == offset:
+                self._removeFree(prevOffset)
+                offset, length = prevOffset, prevLength + length
+        nextOffset = offset + length
+        if nextOffset in self._freeLengths:
+            length += self._freeLengths[nextOffset]
+            self._removeFree(nextOffset)
+
+        if offset + length == self._fileSize:
+            self._fileSize = offset
+            self._file.truncate(offset)
+        else:
+            self._addFree(offset, length)
+
+    def _addFree(self, offset, length):
+        bisect.insort(self._freeExtents, (length, offset))
+        bisect.insort(self._freeOffsets, offset)
+        self._freeLengths[offset] = length
+
+    def _removeFree(self, offset):
+        length = self._freeLengths.pop(offset)
+        del self._freeExtents[bisect.bisect_left(self._freeExtents, (length, offset))]
+        del self._freeOffsets[bisect.bisect_left(self._freeOffsets, offset)]
+
+    def _allocate(self, length):
+        # Best fit: the smallest free extent that is large enough.
+        i = bisect.bisect_left(self._freeExtents, (length, -1))
+        if i < len(self._freeExtents):
+            extentLength, offset = self._freeExtents[i]
+            self._removeFree(offset)
+            if extentLength > length:
+                self._addFree(offset + length, extentLength - length)
+            return offset
+
+        offset = self._fileSize
+        self._fileSize += length
+        return offset
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._entries = {}
+            self._freeExtents = []
+            self._freeOffsets = []
+            self._freeLengths = {}
+
+
+class ChunkStoreWorldFolder(AnvilWorldFolder):
+    """
+    A world folder that keeps its chunks in a ChunkStore instead of in region files. All other files are
+    stored in the folder as usual.
+
+    Used for the partial folders of a RevisionHistory. Closing the folder releases its references to
+    chunk data in the store, so the folder must not be used after it is closed.
+    """
+
+    def __init__(self, filename, chunkStore, create=False):
+        """
+
+        :type filename: unicode
+        :type chunkStore: ChunkStore
+        :type create: bool
+        """
+        super(ChunkStoreWorldFolder, self).__init__(filename, create)
+        self.chunkStore = chunkStore
+        self._chunkKeys = defaultdict(dict)  # dimName -> {(cx, cz): key}
+
+    def __repr__(self):
+        return "ChunkStoreWorldFolder(%r)" % self.filename
+
+    def listDimensions(self):
+        return iter(self._dimensionNames | set(self._chunkKeys))
+
+    def compactIter(self):
+        yield 0, 0, "Done"
+
+    def flush(self):
+        self.chunkStore.flush()
+
+    def close(self):
+        for chunkKeys in self._chunkKeys.itervalues():
+            for key in chunkKeys.itervalues():
+                self.chunkStore.release(key)
+        self._chunkKeys.clear()
+
+    # --- Chunks and chunk listing ---
+
+    def chunkCount(self, dimName):
+        return len(self._chunkKeys.get(dimName, ()))
+
+    def chunkPositions(self, dimName):
+        return iter(list(self._chunkKeys.get(dimName, ())))
+
+    def containsChunk(self, cx, cz, dimName):
+        return (cx, cz) in self._chunkKeys.get(dimName, ())
+
+    def deleteChunk(self, cx, cz, dimName):
+        chunkKeys = self._chunkKeys.get(dimName)
+        if chunkKeys is None:
+            return
+        key = chunkKeys.pop((cx, cz), None)
+        if key is not None:
+            self.chunkStore.release(key)
+        if not chunkKeys:
+            del self._chunkKeys[dimName]
+
+    def readChunkBytes(self, cx, cz, dimName):
+        data, fmt = self.readChunkCompressed(cx, cz, dimName)
+        return decompressChunk(data, fmt)
+
+    def readChunkCompressed(self, cx, cz, dimName):
+        key = self._chunkKeys.get(dimName, {}).get((cx, cz))
+        if key is None:
+            raise ChunkNotPresent((cx, cz))
+        return self.chunkStore.read(key)
+
+    def writeChunkBytes(self, cx, cz, dimName, data):
+        self.writeChunkCompressed(cx, cz, dimName, deflate(data), RegionFile.VERSION_DEFLATE)
+
+    def writeChunkCompressed(self, cx, cz, dimName, data, fmt):
+        chunkKeys = self._chunkKeys[dimName]
+        # Store the new data before releasing the old, in case they are the same.
+        key = self.chunkStore.store(data, fmt)
+        oldKey = chunkKeys.get((cx, cz))
+        chunkKeys[cx, cz] = key
+        if oldKey is not None:
+            self.chunkStore.release(oldKey)
@@ -283,7 +283,11 @@ class PCEntityRefBase(object):
     @dirty.setter
     def dirty(self, value):
         if self.chunk:
-            self.chunk.dirty = value
+            if value and hasattr(self.chunk, "entitiesChanged"):
+                # Only the chunk's entities changed, so its sections are not encoded again
+                self.chunk.entitiesChanged("Entities")
+            else:
+                self.chunk.dirty = value
 
     @property
     def blockTypes(self):
@@ -505,7 +509,11 @@ class PCTileEntityRefBase(object):
     @dirty.setter
     def dirty(self, value):
         if self.chunk:
-            self.chunk.dirty = value
+            if value and hasattr(self.chunk, "entitiesChanged"):
+                # Only the chunk's tile entities changed, so its sections are not encoded again
+                self.chunk.entitiesChanged("TileEntities")
+            else:
+                self.chunk.dirty = value
 
     @property
     def blockTypes(self):
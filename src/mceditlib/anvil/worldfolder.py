@@ -13,11 +13,13 @@ import os
 
 
 class AnvilWorldFolder(object):
-    def __init__(self, filename, create=False, readonly=False):
+    def __init__(self, filename, create=False, readonly=False, fsync=False):
         '''
 
         :type filename: str or unicode
         :type create: bool
+        :param fsync: If True, region files are synced to the disk each time they are flushed.
+        :type fsync: bool
         '''
         if not os.path.exists(filename):
             if create:
@@ -30,6 +32,7 @@ class AnvilWorldFolder(object):
 
         self.filename = filename
         self.readonly = readonly
+        self.fsync = fsync
         self.regionFiles = {}
         self._dimensionNames = set(self._findDimensions())
         self._regionPositionsByDim = defaultdict(set)
@@ -160,19 +163,54 @@ class AnvilWorldFolder(object):
             self._dimensionNames.add(dimName)
             self._regionPositionsByDim[dimName].add((rx, rz))
         try:
-            regionFile = RegionFile(path, self.readonly)
+            regionFile = RegionFile(path, self.readonly, self.fsync)
         except Exception:
             log.exception("Failed to open region file.")
             return None
         self.regionFiles[rx, rz, dimName] = regionFile
         return regionFile
 
+    def compactIter(self):
+        """
+        Compact all region files in all dimensions, removing unused sectors and storing each region's chunks
+        contiguously in chunk grid order.
+
+        :return: Progress information as (current, max, status) tuples
+        :rtype: Iterator[(int, int, unicode)]
+        """
+        if self.readonly:
+            raise IOError("World folder is opened read only.")
+
+        regionKeys = [(rx, rz, dimName)
+                      for dimName in self._dimensionNames
+                      for rx, rz in self._regionPositionsByDim[dimName]]
+        sectorsRemoved = 0
+        for i, (rx, rz, dimName) in enumerate(regionKeys):
+            yield i, len(regionKeys), "Compacting region files"
+            regionFile = self.getRegionFile(rx, rz, dimName)
+            if regionFile is None:
+                continue
+            sectorsRemoved += regionFile.compact()
+
+        log.info("Compacted %d region files, removed %d sectors (%d bytes)",
+                 len(regionKeys), sectorsRemoved, sectorsRemoved * RegionFile.SECTOR_BYTES)
+        yield len(regionKeys), len(regionKeys), "Done"
+
     def getRegionForChunk(self, cx, cz, dimName):
         rx = cx >> 5
         rz = cz >> 5
         return self.getRegionFile(rx, rz, dimName)
 
+    def flush(self):
+        """
+        Write any pending changes to the region files' offset tables and flush their file handles.
+        """
+        for regionFile in self.regionFiles.itervalues():
+            regionFile.flush()
+
     def close(self):
+        for regionFile in self.regionFiles.itervalues():
+            regionFile.close()
         self.regionFiles = {}
 
     # --- Chunks and chunk listing ---
@@ -216,6 +254,7 @@ class AnvilWorldFolder(object):
                 log.info(u"Removing empty region file {0}".format(filename))
                 self._regionPositionsByDim[dimName].remove((rx, rz))
                 del self.regionFiles[rx, rz, dimName]
+                regionFile.close()
                 os.unlink(regionFile.path)
 
     def containsChunk(self, cx, cz, dimName):
@@ -234,6 +273,7 @@ class AnvilWorldFolder(object):
             rf.deleteChunk(cx & 0x1f, cz & 0x1f)
             if rf.chunkCount == 0:
                 del self.regionFiles[rx, rz, dimName]
+                rf.close()
                 os.unlink(rf.path)
 
     def readChunkBytes(self, cx, cz, dimName):
@@ -241,9 +281,21 @@ class AnvilWorldFolder(object):
             raise ChunkNotPresent((cx, cz))
         return self.getRegionForChunk(cx, cz, dimName).readChunkBytes(cx, cz)
 
+    def readChunkCompressed(self, cx, cz, dimName):
+        """
+        Read a chunk's data without decompressing it. Returns a (data, fmt) tuple as returned by
+        RegionFile.readChunkCompressed.
+        """
+        if not self.containsChunk(cx, cz, dimName):
+            raise ChunkNotPresent((cx, cz))
+        return self.getRegionForChunk(cx, cz, dimName).readChunkCompressed(cx, cz)
+
     def writeChunkBytes(self, cx, cz, dimName, data):
         self.getRegionForChunk(cx, cz, dimName).writeChunkBytes(cx, cz, data)
 
+    def writeChunkCompressed(self, cx, cz, dimName, data, fmt):
+        self.getRegionForChunk(cx, cz, dimName).writeChunkCompressed(cx, cz, data, fmt)
+
     def copyChunkFrom(self, sourceFolder, cx, cz, dimName):
         """
         Copy chunk from another source folder without decompression
@@ -12,6 +12,7 @@ import numpy
 import mceditlib.blocktypes as blocktypes
 from mceditlib import relight
 from mceditlib.selection import BoundingBox, SectionBox
+from mceditlib.util import markChunkDirty
 
 log = logging.getLogger(__name__)
 
@@ -170,6 +171,7 @@ def copyBlocksIter(destDim, sourceDim, sourceSelection, destinationPoint,
                     # Write blocks
                     destSection.Blocks[destSlices][sourceMaskSliced] = convertedSourceBlocksMasked
                     destSection.Data[destSlices][sourceMaskSliced] = convertedSourceDataMasked
+                    markChunkDirty(destChunk, destCy)
 
                     if updateLights:
                         # Find coordinates of lighting updates
@@ -197,8 +199,6 @@ def copyBlocksIter(destDim, sourceDim, sourceSelection, destinationPoint,
                                 #          oldBrightness.shape)
                                 relight.updateLightsByCoord(destDim, changedX, changedY, changedZ)
 
-                destChunk.dirty = True
-
         # Copy biomes
         if sourceBiomes is not None:
             bx, bz = sourceBiomeMask.nonzero()
@@ -243,16 +243,15 @@ def copyBlocksIter(destDim, sourceDim, sourceSelection, destinationPoint,
 
         startTime = time.time()
 
-        for i in range(len(allChangedX)):
-            x = allChangedX[i]
-            y = allChangedY[i]
-            z = allChangedZ[i]
-            if len(x) == 0:
-                continue
-            relight.updateLightsByCoord(destDim, x, y, z)
-            yield (i, len(allChangedX), "Updating lights...")
-            log.info("Updated section %d/%d (%d cells) (%d,%d,%d)",
-                     i, len(allChangedX), len(x), x[0]>>4, y[0]>>4, z[0]>>4)
+        # One call, so the relight method sees every changed cell at once. Large copies may
+        # then be relit in parallel tiles.
+        i = len(allChangedX)
+        if i:
+            yield (0, 1, "Updating lights...")
+            relight.updateLightsByCoord(destDim,
+                                        numpy.concatenate(allChangedX),
+                                        numpy.concatenate(allChangedY),
+                                        numpy.concatenate(allChangedZ))
 
         i = i or 1
         duration = time.time() - startTime
@@ -0,0 +1,138 @@
+"""
+    blockaccessor
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import logging
+
+from mceditlib.blocktypes import BlockType
+from mceditlib.util import markChunkDirty
+
+log = logging.getLogger(__name__)
+
+
+class BlockAccessor(object):
+    """
+    Reads and changes single blocks of a dimension. Remembers the chunk and sections of the last position
+    accessed, so loops that visit nearby positions one at a time skip the chunk and section lookups done by
+    WorldEditorDimension.getBlockID and friends.
+
+    The accessor keeps the current chunk loaded. It does not notice chunks that are created, deleted or
+    replaced after it looked them up (for example, by undo or by changing revisions), so create a new
+    accessor after such changes.
+
+    Returned values and default values are the same as for the WorldEditorDimension methods with the same
+    names.
+
+    Any dimension with containsChunk, getChunk and blocktypes can be used.
+
+    :type dimension: mceditlib.worldeditor.WorldEditorDimension
+    """
+
+    def __init__(self, dimension):
+        self.dimension = dimension
+        self.blocktypes = dimension.blocktypes
+        self._cx = self._cz = None
+        self._chunk = None
+        self._sections = {}
+
+    def _getSection(self, x, y, z, create=False):
+        cx = x >> 4
+        cz = z >> 4
+        if cx != self._cx or cz != self._cz:
+            self._cx = cx
+            self._cz = cz
+            self._sections = {}
+            if self.dimension.containsChunk(cx, cz):
+                self._chunk = self.dimension.getChunk(cx, cz)
+            else:
+                self._chunk = None
+
+        if self._chunk is None:
+            return None
+
+        cy = y >> 4
+        section = self._sections.get(cy)
+        if section is None:
+            section = self._chunk.getSection(cy, create)
+            if section is not None:
+                self._sections[cy] = section
+        return section
+
+    # --- Blocks ---
+
+    def getBlock(self, x, y, z):
+        section = self._getSection(x, y, z)
+        if section is None:
+            return self.blocktypes[0, 0]
+        index = y & 0xf, z & 0xf, x & 0xf
+        return self.blocktypes[section.Blocks[index], section.Data[index]]
+
+    def setBlock(self, x, y, z, blocktype):
+        if not isinstance(blocktype, BlockType):
+            blocktype = self.blocktypes[blocktype]
+        section = self._getSection(x, y, z, create=True)
+        if section is None:
+            return
+        index = y & 0xf, z & 0xf, x & 0xf
+        section.Blocks[index] = blocktype.ID
+        section.Data[index] = blocktype.meta
+        markChunkDirty(self._chunk, y >> 4)
+
+    def getBlockID(self, x, y, z, default=0):
+        section = self._getSection(x, y, z)
+        if section is None:
+            return default
+        return section.Blocks[y & 0xf, z & 0xf, x & 0xf]
+
+    def setBlockID(self, x, y, z, value):
+        section = self._getSection(x, y, z, create=True)
+        if section is None:
+            return
+        section.Blocks[y & 0xf, z & 0xf, x & 0xf] = value
+        markChunkDirty(self._chunk, y >> 4)
+
+    def getBlockData(self, x, y, z, default=0):
+        section = self._getSection(x, y, z)
+        if section is None:
+            return default
+        return section.Data[y & 0xf, z & 0xf, x & 0xf]
+
+    def setBlockData(self, x, y, z, value):
+        section = self._getSection(x, y, z, create=True)
+        if section is None:
+            return
+        section.Data[y & 0xf, z & 0xf, x & 0xf] = value
+        markChunkDirty(self._chunk, y >> 4)
+
+    # --- Light ---
+
+    def getLight(self, arrayName, x, y, z, default=0):
+        section = self._getSection(x, y, z)
+        if section is None:
+            return default
+        array = getattr(section, arrayName)
+        if array is None:
+            return default
+        return array[y & 0xf, z & 0xf, x & 0xf]
+
+    def setLight(self, arrayName, x, y, z, value):
+        section = self._getSection(x, y, z, create=True)
+        if section is None:
+            return
+        array = getattr(section, arrayName)
+        if array is None:
+            return
+        array[y & 0xf, z & 0xf, x & 0xf] = value
+        markChunkDirty(self._chunk, y >> 4)
+
+    def getBlockLight(self, x, y, z, default=0):
+        return self.getLight("BlockLight", x, y, z, default)
+
+    def setBlockLight(self, x, y, z, value):
+        self.setLight("BlockLight", x, y, z, value)
+
+    def getSkyLight(self, x, y, z, default=0):
+        return self.getLight("SkyLight", x, y, z, default)
+
+    def setSkyLight(self, x, y, z, value):
+        self.setLight("SkyLight", x, y, z, value)
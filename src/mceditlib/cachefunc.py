@@ -1,7 +1,6 @@
 # From http://code.activestate.com/recipes/498245/
 import collections
 import functools
-from itertools import ifilterfalse
 from heapq import nsmallest
 from operator import itemgetter
 
@@ -29,7 +28,7 @@ class lru_cache_object(object):
 
     Amended to accept two callbacks: should_decache and will_decache.
 
-    should_decache is called with the result that is about to decache and should return True or False.
+    should_decache is called with the key of the result that is about to decache and should return True or False.
     will_decache is called with the result that is about to decache.
 
     Also provides an explicit decache function. Call it to decache a result with the given key.
@@ -37,24 +36,55 @@ class lru_cache_object(object):
 
     Also acts as an iterator over cached results, and can be checked if a key is in the cache with `key in cache`
 
-    """
+    Optionally limits the total size of the cached results instead of, or as well as, their number. Pass
+    a `sizeof` function that returns the size of a result in bytes, and the budget as `maxbytes`. Results
+    are measured when they are added to the cache. Call `resize` with a result's arguments to measure it again
+    after it grows or shrinks. The number of results evicted is stored in f.evictions and the total size of
+    the cached results in f.currentBytes.
 
-    def __init__(self, user_function, maxsize=100):
+    Results are kept in an OrderedDict in order of use, least recently used first, so lookups, stores,
+    decaches and evictions take constant time.
+    """
 
-        self.maxqueue = maxsize * 10
+    def __init__(self, user_function, maxsize=100, maxbytes=None, sizeof=None):
         self.maxsize = maxsize
-        self.cache = {}                   # mapping of args to results
-        self.queue = collections.deque()  # order that keys have been used
-        self.refcount = Counter()         # times each key is in the queue
-        self.sentinel = object()          # marker for looping around the queue
-        self.kwd_mark = object()          # separate positional and keyword args
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.sizes = {}                          # mapping of args to result sizes, if sizeof is given
+        self.currentBytes = 0
+        self.cache = collections.OrderedDict()   # mapping of args to results, least recently used first
+        self.sentinel = object()                 # marker for cache.pop
+        self.kwd_mark = object()                 # separate positional and keyword args
         self.user_function = user_function
 
-        self.hits = self.misses = 0
+        self.hits = self.misses = self.evictions = 0
 
     def setCacheLimit(self, size):
         self.maxsize = size
-        self.maxqueue = size * 10
+
+    def setByteLimit(self, maxbytes):
+        self.maxbytes = maxbytes
+
+    def _overLimit(self):
+        if self.maxsize is not None and len(self.cache) > self.maxsize:
+            return True
+        if self.maxbytes is not None and self.currentBytes > self.maxbytes:
+            return True
+        return False
+
+    def _setResult(self, key, result):
+        # (re)insert at the most recently used end
+        self.cache.pop(key, None)
+        self.cache[key] = result
+        if self.sizeof is not None:
+            size = self.sizeof(result)
+            self.currentBytes += size - self.sizes.get(key, 0)
+            self.sizes[key] = size
+
+    def _removeResult(self, key):
+        del self.cache[key]
+        if self.sizeof is not None:
+            self.currentBytes -= self.sizes.pop(key)
 
     def __call__(self, *args, **kwds):
         # cache key records both positional and keyword args
@@ -62,70 +92,54 @@ class lru_cache_object(object):
         if kwds:
             key += (self.kwd_mark,) + tuple(sorted(kwds.items()))
 
-        # record recent use of this key
-        self.queue.append(key)
-        self.refcount[key] += 1
-
-        # get cache entry or compute if not found
-
-        result = self.cache.get(key, self.sentinel)
+        # get cache entry and record recent use, or compute if not found
+        result = self.cache.pop(key, self.sentinel)
         if result is not self.sentinel:
+            self.cache[key] = result
             self.hits += 1
-        else:
-            try:
-                # exception thrown by user_function shouldn't leave cache, queue, and refcount inconsistent
-                result = self.user_function(*args, **kwds)
-            except:
-                self.queue.pop()
-                self.refcount[key] -= 1
-                raise
+            return result
 
-            self.cache[key] = result
-            self.misses += 1
+        result = self.user_function(*args, **kwds)
+        self._setResult(key, result)
+        self.misses += 1
 
-            # purge least recently used cache entry
-            if len(self.cache) > self.maxsize:
-                cannot_decache = []
-                while len(self.queue):
-                    # find a key with zero refcount
-                    stale_key = self.queue.popleft()
-                    self.refcount[stale_key] -= 1
-                    while self.refcount[stale_key]:
-                        stale_key = self.queue.popleft()
-                        self.refcount[stale_key] -= 1
-
-                    # attempt to evict the result from cache
-                    if self.should_decache is None or self.should_decache(stale_key):
-                        # allowed
-                        if self.will_decache is not None:
-                            self.will_decache(self.cache[stale_key])
-                        del self.cache[stale_key], self.refcount[stale_key]
-                        break
-                    else:
-                        # denied
-                        self.refcount[stale_key] += 1
-                        cannot_decache.append(stale_key)
-
-                # Put these at the back of the queue - should_decache=False is counted as a hit
-                self.queue.extend(cannot_decache)
-
-        # periodically compact the queue by eliminating duplicate keys
-        # while preserving order of most recent access
-        if len(self.queue) > self.maxqueue:
-            self.refcount.clear()
-            self.queue.appendleft(self.sentinel)
-            for key in ifilterfalse(self.refcount.__contains__,
-                                    iter(self.queue.pop, self.sentinel)):
-                self.queue.appendleft(key)
-                self.refcount[key] = 1
+        # purge least recently used cache entries
+        while self._overLimit():
+            if not self._purge():
+                break
 
         return result
 
+    def _purge(self):
+        """
+        Evict the least recently used result that should_decache allows to be evicted. Returns False if no
+        result could be evicted.
+        """
+        cannot_decache = []
+        stale_key = self.sentinel
+        for key in self.cache:
+            if self.should_decache is None or self.should_decache(key):
+                stale_key = key
+                break
+            cannot_decache.append(key)
+
+        if stale_key is not self.sentinel:
+            if self.will_decache is not None:
+                self.will_decache(self.cache[stale_key])
+            self._removeResult(stale_key)
+            self.evictions += 1
+
+        # Move these to the most recently used end - should_decache=False is counted as a hit
+        for key in cannot_decache:
+            self.cache[key] = self.cache.pop(key)
+
+        return stale_key is not self.sentinel
+
     def clear(self):
         self.cache.clear()
-        self.queue.clear()
-        self.refcount.clear()
-        self.hits = self.misses = 0
+        self.sizes.clear()
+        self.currentBytes = 0
+        self.hits = self.misses = self.evictions = 0
 
     def decache(self, *args, **kwds):
         key = args
@@ -133,18 +147,38 @@ class lru_cache_object(object):
             key += (self.kwd_mark,) + tuple(sorted(kwds.items()))
         if key not in self.cache:
             return
-        del self.cache[key], self.refcount[key]
+        self._removeResult(key)
+
+    def resize(self, *args, **kwds):
+        """
+        Measure the result with the given arguments again, then evict results if the cache is now over its
+        limits. Does nothing if the result is not cached or the cache has no `sizeof` function.
+        """
+        if self.sizeof is None:
+            return
+        key = args
+        if kwds:
+            key += (self.kwd_mark,) + tuple(sorted(kwds.items()))
+        result = self.cache.get(key, self.sentinel)
+        if result is self.sentinel:
+            return
+        size = self.sizeof(result)
+        self.currentBytes += size - self.sizes[key]
+        self.sizes[key] = size
 
-        # Remove all occurences of key from queue
-        self.queue = collections.deque(s for s in self.queue if s != key)
+        while self._overLimit():
+            if not self._purge():
+                break
 
     def store(self, result, *args, **kwds):
         key = args
         if kwds:
             key += (self.kwd_mark,) + tuple(sorted(kwds.items()))
-        self.cache[key] = result
-        self.refcount[key] += 1
-        self.queue.append(key)
+        self._setResult(key, result)
+
+        while self._overLimit():
+            if not self._purge():
+                break
 
     def __contains__(self, key, **kwds):
         if kwds:
@@ -152,7 +186,8 @@ class lru_cache_object(object):
         return key in self.cache
 
     def __iter__(self):
-        return iter(self.cache)
+        # Iterate over a copy, since looking up a result reorders the cache
+        return iter(list(self.cache))
 
     def __len__(self):
         return len(self.cache)
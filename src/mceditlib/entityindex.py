@@ -0,0 +1,133 @@
+"""
+    entityindex
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import logging
+
+import numpy
+
+from mceditlib.selection import BoundingBox
+
+log = logging.getLogger(__name__)
+
+
+def _entityID(tag):
+    if "id" in tag:
+        return tag["id"].value
+    return None
+
+
+def _entityPosition(tag):
+    if "Pos" in tag:
+        return tuple(t.value for t in tag["Pos"])
+    return 0, 0, 0
+
+
+def _tileEntityPosition(tag):
+    return tuple(tag[k].value if k in tag else 0 for k in "xyz")
+
+
+_positionReaders = {
+    "Entities": _entityPosition,
+    "TileEntities": _tileEntityPosition,
+}
+
+
+class EntityIndex(object):
+    """
+    Positions and IDs of the entities or tile entities of one chunk, in the same order as the chunk's list, kept
+    in arrays so they can be searched without creating refs for every entity.
+
+    The arrays are built from the chunk's list of tags when they are first used, reading only the "id" and
+    position tags of each entity. Changes made to the list afterward must also be made to the index using
+    `append` and `remove`.
+
+    :ivar positions: Array of entity positions, with shape (N, 3)
+    :ivar ids: Array of entity IDs as found in their "id" tags, with shape (N,)
+    """
+
+    def __init__(self, tags, attrName):
+        """
+        :param tags: The chunk's Entities or TileEntities list
+        :type tags: mceditlib.nbt.TAG_List
+        :param attrName: "Entities" or "TileEntities"
+        :type attrName: str
+        """
+        self.tags = tags
+        self._readPosition = _positionReaders[attrName]
+        self._positions = None
+        self._ids = None
+
+    @property
+    def built(self):
+        return self._ids is not None
+
+    def _build(self):
+        tags = list(self.tags)
+        self._positions = numpy.array([self._readPosition(tag) for tag in tags], dtype='f8').reshape(len(tags), 3)
+        self._ids = numpy.empty(len(tags), dtype=object)
+        self._ids[:] = [_entityID(tag) for tag in tags]
+
+    @property
+    def positions(self):
+        if self._positions is None:
+            self._build()
+        return self._positions
+
+    @property
+    def ids(self):
+        if self._ids is None:
+            self._build()
+        return self._ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, tag):
+        """
+        Record a tag that was appended to the list. Does nothing if the arrays are not built yet, as they
+        will be built from the list as it is then.
+        """
+        if not self.built:
+            return
+        self._positions = numpy.vstack([self._positions, [self._readPosition(tag)]])
+        ids = numpy.empty(len(self._ids) + 1, dtype=object)
+        ids[:-1] = self._ids
+        ids[-1] = _entityID(tag)
+        self._ids = ids
+
+    def remove(self, i):
+        """
+        Record that the tag at index `i` was removed from the list.
+        """
+        if not self.built:
+            return
+        self._positions = numpy.delete(self._positions, i, axis=0)
+        self._ids = numpy.delete(self._ids, i)
+
+    def indexesIn(self, selection, id=None):
+        """
+        Return the list indexes of the entities that may be within the given selection, and whose ID is `id`
+        if given. For a BoundingBox the result is exact. Other selections return every entity with a matching
+        ID, and the caller must test each entity's position.
+
+        :type selection: mceditlib.selection.SelectionBox
+        :type id: unicode | None
+        :rtype: numpy.ndarray
+        """
+        mask = numpy.ones(len(self.ids), dtype=bool)
+        if isinstance(selection, BoundingBox):
+            x, y, z = self.positions.T
+            mask &= selection.contains_coords(x, y, z)
+        if id is not None:
+            mask &= self.ids == id
+        return mask.nonzero()[0]
+
+    def indexesAt(self, pos):
+        """
+        Return the list indexes of the entities at exactly the given position.
+
+        :type pos: (float, float, float)
+        :rtype: numpy.ndarray
+        """
+        return (self.positions == tuple(pos)).all(axis=1).nonzero()[0]
@@ -2,6 +2,7 @@ import numpy
 from mceditlib import relight
 from mceditlib.blocktypes import BlockType
 from mceditlib.fakechunklevel import GetBlocksResult
+from mceditlib.util import markChunkDirty
 
 import logging
 
@@ -33,40 +34,52 @@ def decodeChunkPos(cPos):
 
 
 
+def bucket_indexes(keys):
+    """
+    Group the elements of the 1-d array `keys` by value using a single stable sort. Return an array of the distinct
+    keys in sorted order and a list of arrays of the indexes of the elements having each key, in their original
+    order.
+
+    :type keys: ndarray
+    :return: (keys, indexes)
+    """
+    if not len(keys):
+        return keys, []
+
+    order = numpy.argsort(keys, kind='mergesort')
+    sortedKeys = keys[order]
+    starts = numpy.flatnonzero(sortedKeys[1:] != sortedKeys[:-1]) + 1
+    return sortedKeys[numpy.concatenate(([0], starts))], numpy.split(order, starts)
+
+
 def coords_by_chunk(x, y, z):
     """
     Split the x, y, and z coordinate arrays according to chunk location. Return an iterator over tuples of the chunk's
     cx and cz coordinates and arrays of the x y z coordinates located in that chunk.
 
-    Performance note: Implicitly sorts the elements of an intermediate array. May perform better when input arrays are
-    short.
+    Performance note: Sorts the chunk positions once, so the cost grows with N log N for N coordinates no matter how
+    many chunks they span.
 
     :param x: Array of x coordinates
     :param y: Array of y coordinates
     :param z: Array of z coordinates
-    :return: iterator over (cx, cz, x, y, z) tuples, where x, y, and z are arrays and cx and cz are integers
+    :return: iterator over (cx, cz, x, y, z, mask) tuples, where x, y, and z are arrays, cx and cz are integers,
+        and mask is a tuple of index arrays selecting the coordinates in that chunk from the (broadcasted) input arrays
     """
 
-    cPos = chunkPosArray(x, z)
-    x = x & 0xf
-    z = z & 0xf
-
     x, y, z = numpy.broadcast_arrays(x, y, z)
+    shape = x.shape
 
-    elements, inverse = numpy.unique(cPos, return_inverse=True)
-    view = decodeChunkPos(elements)
-    cxs, czs = view[..., 0], view[..., 1]
+    cPos = chunkPosArray(x, z).ravel()
+    x = (x & 0xf).ravel()
+    y = y.ravel()
+    z = (z & 0xf).ravel()
 
-    for index, cx in numpy.ndenumerate(cxs):
-        cz = czs[index]
-
-        localMask = inverse == index
-        localMask.shape = x.shape
-        localX = x[localMask]
-        localY = y[localMask]
-        localZ = z[localMask]
+    elements, indexes = bucket_indexes(cPos)
+    view = decodeChunkPos(elements)
 
-        yield (cx, cz, localX, localY, localZ, localMask)
+    for (cx, cz), index in zip(view, indexes):
+        yield (cx, cz, x[index], y[index], z[index], numpy.unravel_index(index, shape))
 
 
 def getBlocks(world, x, y, z,
@@ -171,15 +184,14 @@ def getChunkBlocks(chunk, x, y, z,
     if hasattr(chunk, 'Biomes') and return_Biomes:
         result.Biomes[:] = chunk.Biomes[x, z]
 
-    for cy in chunk.sectionPositions():
+    cys, indexes = bucket_indexes((y >> 4).ravel())
+    for cy, index in zip(cys, indexes):
+        cy = int(cy)
         section = chunk.getSection(cy)
         if section is None:
             continue
 
-        sectionMask = (y >> 4) == cy
-        if not sectionMask.any():
-            continue
-
+        sectionMask = numpy.unravel_index(index, y.shape)
         sx = x[sectionMask]
         sy = y[sectionMask]
         sz = z[sectionMask]
@@ -354,7 +366,6 @@ def setBlocks(dimension, x, y, z,
                        maskArray(BlockLight, mask),
                        maskArray(SkyLight, mask),
                        maskArray(Biomes, mask))
-        chunk.dirty = True
 
     if updateLights:
         relight.updateLightsByCoord(dimension, x, y, z)
@@ -372,17 +383,15 @@ def setChunkBlocks(chunk, x, y, z,
     Chunk must have a `world` attribute and `getSection` function.
     """
 
-    for cy in chunk.sectionPositions():
+    cys, indexes = bucket_indexes((y >> 4).ravel())
+    for cy, index in zip(cys, indexes):
+        cy = int(cy)
         section = chunk.getSection(cy)
         if section is None:
             continue
 
-        sectionMask = (y >> 4 == cy)
-
+        sectionMask = numpy.unravel_index(index, y.shape)
         sx = x[sectionMask]
-        if not len(sx):
-            continue
-
         sy = y[sectionMask]
         sz = z[sectionMask]
         sx &= 0xf
@@ -394,9 +403,11 @@ def setChunkBlocks(chunk, x, y, z,
                          maskArray(Data, sectionMask),
                          maskArray(BlockLight, sectionMask),
                          maskArray(SkyLight, sectionMask))
+        markChunkDirty(chunk, cy)
 
     if Biomes is not None and hasattr(chunk, 'Biomes'):
         chunk.Biomes[x & 0xf, z & 0xf] = Biomes
+        markChunkDirty(chunk)
 
 
 
@@ -357,11 +357,16 @@ cdef class TAG_String(TAG_Value):
 
 
 cdef class _TAG_List(TAG_Value):
-    cdef public list value
+    cdef list _value
     cdef public char list_type
 
+    # When loaded lazily, the encoded value is kept in _raw[_raw_start:_raw_end] until it is first accessed.
+    cdef bytes _raw
+    cdef size_t _raw_start
+    cdef size_t _raw_end
+
     def __init__(self, value=None, name="", list_type=_ID_BYTE):
-        self.value = []
+        self._value = []
         self.name = name
         self.list_type = list_type
         self.tagID = _ID_LIST
@@ -377,11 +382,35 @@ cdef class _TAG_List(TAG_Value):
                                                           tag_classes[self.list_type],
                                                           len(self))
 
+    property value:
+        def __get__(self):
+            if self._raw is not None:
+                self._decode()
+            return self._value
+
+        def __set__(self, value):
+            self._raw = None
+            self._value = value
+
+    cdef int _decode(self) except -1:
+        cdef load_ctx ctx = lazy_ctx(self._raw, self._raw_start, self._raw_end)
+        cdef list value = []
+        read(ctx, 1)
+        load_list_items(ctx, self.list_type, value)
+        self._value = value
+        self._raw = None
+        return 0
+
     def check_tag(self, value):
         if value.tagID != self.list_type:
             raise TypeError("Invalid type %s for TAG_List(%s)" % (value.__class__, tag_classes[self.list_type]))
 
     def copy(self):
+        cdef _TAG_List lazy_tag
+        if self._raw is not None:
+            lazy_tag = TAG_List(name=self._name, list_type=self.list_type)
+            lazy_tag._raw, lazy_tag._raw_start, lazy_tag._raw_end = self._raw, self._raw_start, self._raw_end
+            return lazy_tag
         return TAG_List([tag.copy() for tag in self.value], self.name)
 
     # --- collection methods ---
@@ -418,11 +447,15 @@ cdef class _TAG_List(TAG_Value):
         cdef char list_type = self.list_type
         cdef TAG_Value tag
 
+        if self._raw is not None:
+            save_raw(self._raw, self._raw_start, self._raw_end, buf)
+            return
+
         save_tag_id(list_type, buf)
-        save_int(<int>len(self.value), buf)
+        save_int(<int>len(self._value), buf)
 
         cdef TAG_Value subtag
-        for subtag in self.value:
+        for subtag in self._value:
             if subtag.tagID != list_type:
                 raise ValueError("Asked to save TAG_List with different types! Found %s and %s" % (subtag.tagID,
                                                                                                    list_type))
@@ -441,7 +474,12 @@ class TAG_List(_TAG_List, collections.MutableSequence):
 
 
 cdef class _TAG_Compound(TAG_Value):
-    cdef public object value
+    cdef object _value
+
+    # When loaded lazily, the encoded value is kept in _raw[_raw_start:_raw_end] until it is first accessed.
+    cdef bytes _raw
+    cdef size_t _raw_start
+    cdef size_t _raw_end
 
     def __init__(self, value=None, name=None):
         if name is None:
@@ -449,11 +487,34 @@ cdef class _TAG_Compound(TAG_Value):
                 name = u""
             ELSE:
                 name = ""
-        self.value = value or []
+        self._value = value or []
         self.name = name
         self.tagID = _ID_COMPOUND
 
+    property value:
+        def __get__(self):
+            if self._raw is not None:
+                self._decode()
+            return self._value
+
+        def __set__(self, value):
+            self._raw = None
+            self._value = value
+
+    cdef int _decode(self) except -1:
+        cdef load_ctx ctx = lazy_ctx(self._raw, self._raw_start, self._raw_end)
+        cdef list value = []
+        load_compound_items(ctx, value)
+        self._value = value
+        self._raw = None
+        return 0
+
     def copy(self):
+        cdef _TAG_Compound lazy_tag
+        if self._raw is not None:
+            lazy_tag = TAG_Compound(name=self._name)
+            lazy_tag._raw, lazy_tag._raw_start, lazy_tag._raw_end = self._raw, self._raw_start, self._raw_end
+            return lazy_tag
         return TAG_Compound([tag.copy() for tag in self.value], self.name)
 
     # --- collection methods ---
@@ -503,7 +564,11 @@ cdef class _TAG_Compound(TAG_Value):
 
     cdef void save_value(self, buf):
         cdef TAG_Value subtag
-        for subtag in self.value:
+        if self._raw is not None:
+            save_raw(self._raw, self._raw_start, self._raw_end, buf)
+            return
+
+        for subtag in self._value:
             save_tag_id(subtag.tagID, buf)
             save_tag_name(subtag, buf)
             save_tag_value(subtag, buf)
@@ -553,16 +618,22 @@ cdef void swab(void * vbuf, int nbytes):
 # --- NBT Loading ---
 #
 
-def load(filename="", buf=None):
+def load(filename="", buf=None, lazy=False):
     """
     Load an NBT tree from a file and return the root TAG_Compound. The root tag is the only tag that can have a name
     itself without being inside a TAG_Compound.
     If filename is given, loads NBT data from that file. If buf is given, loads NBT data from the bytes or filehandle.
 
+    If lazy is True, TAG_Lists and TAG_Compounds below the root tag only record where their data is in the buffer,
+    and are decoded the first time their contents are accessed. Tags that are never accessed are saved by copying
+    their original data.
+
     :param filename: Filename to load data from
     :type filename: basestring
     :param buf: File-like object to load data from
     :type buf: file-like object | bytes
+    :param lazy: Decode lists and compounds when they are first accessed
+    :type lazy: bool
     :return: Structured NBT data
     :rtype: TAG_Compound
     """
@@ -573,11 +644,15 @@ def load(filename="", buf=None):
         buf = buf.read()
 
     buf = try_gunzip(buf)
+    if lazy and not isinstance(buf, bytes):
+        buf = bytes(buf)
 
     cdef load_ctx ctx = load_ctx()
     ctx.offset = 1
     ctx.buffer = buf
     ctx.size = len(buf)
+    ctx.lazy = lazy
+    ctx.data = buf
 
     if len(buf) < 1:
         raise NBTFormatError("NBT Stream too short!")
@@ -600,6 +675,18 @@ cdef class load_ctx:
     cdef size_t offset
     cdef char * buffer
     cdef size_t size
+    cdef bint lazy
+    cdef object data  # Keeps `buffer` alive while lazily loaded tags refer to it
+
+
+cdef load_ctx lazy_ctx(bytes data, size_t start, size_t end):
+    cdef load_ctx ctx = load_ctx()
+    ctx.data = data
+    ctx.buffer = data
+    ctx.offset = start
+    ctx.size = end
+    ctx.lazy = True
+    return ctx
 
 IF UNICODE_CACHE:
     cdef dict u_cache = dict()
@@ -673,17 +760,20 @@ cdef TAG_Double load_double(load_ctx ctx):
 
 
 cdef load_compound(load_ctx ctx):
-    cdef char tagID
     cdef _TAG_Compound root_tag = TAG_Compound()
-    cdef TAG_Value tag
+    load_compound_items(ctx, root_tag._value)
+    return root_tag
+
+
+cdef int load_compound_items(load_ctx ctx, list items) except -1:
+    cdef char tagID
     while True:
         tagID = read(ctx, 1)[0]
         if tagID == _ID_END:
             break
         else:
-            root_tag.value.append(load_named(ctx, tagID))
-
-    return root_tag
+            PyList_Append(items, load_named(ctx, tagID))
+    return 0
 
 
 cdef load_named(load_ctx ctx, char tagID):
@@ -695,18 +785,92 @@ cdef load_named(load_ctx ctx, char tagID):
 
 cdef load_list(load_ctx ctx):
     cdef char list_type = read(ctx, 1)[0]
+    cdef _TAG_List tag = TAG_List(list_type=list_type)
+    load_list_items(ctx, list_type, tag._value)
+    return tag
+
+
+cdef int load_list_items(load_ctx ctx, char list_type, list items) except -1:
     cdef int * ptr = <int *> read(ctx, 4)
     cdef int length = ptr[0]
     swab(&length, 4)
 
-    cdef _TAG_List tag = TAG_List(list_type=list_type)
-    cdef list val = tag.value
     cdef int i
     for i in range(length):
-        PyList_Append(val, load_tag(list_type, ctx))
+        PyList_Append(items, load_tag(list_type, ctx))
+    return 0
+
+
+# --- Lazy loading ---
+
+cdef load_lazy_list(load_ctx ctx):
+    cdef size_t start = ctx.offset
+    cdef char list_type = read(ctx, 1)[0]
+    ctx.offset = start
+    skip_tag(_ID_LIST, ctx)
+
+    cdef _TAG_List tag = TAG_List(list_type=list_type)
+    tag._raw, tag._raw_start, tag._raw_end = ctx.data, start, ctx.offset
+    return tag
+
+
+cdef load_lazy_compound(load_ctx ctx):
+    cdef size_t start = ctx.offset
+    skip_tag(_ID_COMPOUND, ctx)
 
+    cdef _TAG_Compound tag = TAG_Compound()
+    tag._raw, tag._raw_start, tag._raw_end = ctx.data, start, ctx.offset
     return tag
 
+
+cdef int skip_tag(char tagID, load_ctx ctx) except -1:
+    """
+    Advance past the value of a tag with the given ID without decoding it.
+    """
+    cdef char subtagID
+    cdef int length
+    cdef unsigned short name_length
+    cdef int i
+
+    if tagID == _ID_BYTE:
+        read(ctx, 1)
+    elif tagID == _ID_SHORT:
+        read(ctx, 2)
+    elif tagID == _ID_INT or tagID == _ID_FLOAT:
+        read(ctx, 4)
+    elif tagID == _ID_LONG or tagID == _ID_DOUBLE:
+        read(ctx, 8)
+    elif tagID == _ID_STRING:
+        name_length = (<unsigned short *> read(ctx, 2))[0]
+        swab(&name_length, 2)
+        read(ctx, name_length)
+    elif tagID == _ID_BYTE_ARRAY or tagID == _ID_INT_ARRAY or tagID == _ID_LONG_ARRAY:
+        length = (<int *> read(ctx, 4))[0]
+        swab(&length, 4)
+        if tagID == _ID_INT_ARRAY:
+            length *= 4
+        elif tagID == _ID_LONG_ARRAY:
+            length *= 8
+        read(ctx, length)
+    elif tagID == _ID_LIST:
+        subtagID = read(ctx, 1)[0]
+        length = (<int *> read(ctx, 4))[0]
+        swab(&length, 4)
+        for i in range(length):
+            skip_tag(subtagID, ctx)
+    elif tagID == _ID_COMPOUND:
+        while True:
+            subtagID = read(ctx, 1)[0]
+            if subtagID == _ID_END:
+                break
+            name_length = (<unsigned short *> read(ctx, 2))[0]
+            swab(&name_length, 2)
+            read(ctx, name_length)
+            skip_tag(subtagID, ctx)
+    else:
+        raise NBTFormatError("Unknown tag ID %d (offset 0x%x)" % (tagID, ctx.offset))
+    return 0
+
 cdef unicode load_string(load_ctx ctx):
     cdef unsigned short * ptr = <unsigned short *> read(ctx, 2)
     cdef unsigned short length = ptr[0]
@@ -802,9 +966,13 @@ cdef load_tag(char tagID, load_ctx ctx):
         return TAG_String(load_string(ctx))
 
     if tagID == _ID_LIST:
+        if ctx.lazy:
+            return load_lazy_list(ctx)
         return load_list(ctx)
 
     if tagID == _ID_COMPOUND:
+        if ctx.lazy:
+            return load_lazy_compound(ctx)
         return load_compound(ctx)
 
     if tagID == _ID_INT_ARRAY:
@@ -855,6 +1023,11 @@ cdef void save_string(bytes value, object buf):
     cwrite(buf, s, len(value))
 
 
+cdef void save_raw(bytes data, size_t start, size_t end, object buf):
+    cdef char * s = data
+    cwrite(buf, s + start, end - start)
+
+
 cdef void save_array(object value, object buf, char size):
     value = value.tostring()
     cdef char * s = value
@@ -5,7 +5,9 @@
     and *.mca* (Minecraft Anvil Region) files
 """
 from __future__ import absolute_import, division
+import collections
 import logging
+import mmap
 import os
 import struct
 import zlib
@@ -30,21 +32,79 @@ def region_debug(msg, *args, **kwargs):
 __author__ = 'Rio'
 
 
+# zlib compression level used when writing chunks, from 1 (fastest) to 9 (smallest). Set it with
+# setCompressionLevel.
+_compressionLevel = 2
+
+
+def setCompressionLevel(level):
+    global _compressionLevel
+    if not 0 <= level <= 9:
+        raise ValueError("Compression level must be between 0 and 9, got %r" % level)
+    _compressionLevel = level
+
+
 def deflate(data):
-    return zlib.compress(data, 2)
+    return zlib.compress(data, _compressionLevel)
 
 
 def inflate(data):
     return zlib.decompress(data)
 
+
+def _bufferSlice(data, start, end):
+    """
+    Return a read-only view of data[start:end] without copying it.
+    """
+    try:
+        return buffer(data, start, end - start)
+    except NameError:
+        return memoryview(data)[start:end]
+
+# Maximum number of RegionFiles that may hold an open file handle at once. When this is exceeded, the least
+# recently used RegionFile is flushed and its handle closed. It will be reopened the next time it is accessed.
+MAX_OPEN_FILES = 64
+
+_openRegionFiles = collections.OrderedDict()
+
+
+def _touchOpenFile(regionFile):
+    _openRegionFiles.pop(regionFile, None)
+    _openRegionFiles[regionFile] = True
+    while len(_openRegionFiles) > MAX_OPEN_FILES:
+        staleFile, _ = _openRegionFiles.popitem(last=False)
+        staleFile.close()
+
+
 class RegionFile(object):
+    """
+    Holds the region file open between reads and writes, and keeps the offset and timestamp tables in memory.
+    Changes to the tables are written to the file only when `flush` or `close` is called. Sectors released by
+    moving or deleting a chunk are not reused until then, since the tables in the file may still point to them.
+
+    Region files opened read-only are memory-mapped instead. The offset and timestamp tables are views of the
+    mapping, and `readChunkCompressed` returns views of the mapping without copying the chunk data. Mapped files
+    count toward MAX_OPEN_FILES like open file handles. When closed, the tables are copied out of the mapping,
+    and the file is mapped again on the next read.
+
+    :ivar fsync: If True, `flush` also calls `os.fsync` to ensure the file is written to the disk.
+    """
     SECTOR_BYTES = 4096
     CHUNK_HEADER_SIZE = 5
     VERSION_GZIP = 1
     VERSION_DEFLATE = 2
 
-    def __init__(self, path, readonly=False):
+    def __init__(self, path, readonly=False, fsync=False):
         self.path = path
+        self.readonly = readonly
+        self.fsync = fsync
+        self._file = None
+        self._mapping = None
+        # True if chunks are read through the memory mapping
+        self._mapped = False
+        self._headerDirty = False
+        # (start, count) of sectors released since the tables were last written
+        self._releasedSectors = []
         newFile = False
         if not os.path.exists(path):
             if readonly:
@@ -74,34 +134,31 @@ class RegionFile(object):
                         filesize = self.SECTOR_BYTES * 2
                         f.truncate(filesize)
 
-                f.seek(0)
-                offsetsData = f.read(self.SECTOR_BYTES)
-                modTimesData = f.read(self.SECTOR_BYTES)
-
-                self.offsets = numpy.fromstring(offsetsData, dtype='>u4')
-                self.modTimes = numpy.fromstring(modTimesData, dtype='>u4')
-
-            self.freeSectors = [True] * (filesize // self.SECTOR_BYTES)
-            self.freeSectors[0:2] = False, False
+                if readonly and filesize >= self.SECTOR_BYTES * 2:
+                    self._mapped = True
+                    mapping = self._getMapping()
+                    self.offsets = numpy.frombuffer(mapping, dtype='>u4',
+                                                    count=self.SECTOR_BYTES//4)
+                    self.modTimes = numpy.frombuffer(mapping, dtype='>u4',
+                                                     count=self.SECTOR_BYTES//4, offset=self.SECTOR_BYTES)
+                else:
+                    f.seek(0)
+                    offsetsData = f.read(self.SECTOR_BYTES)
+                    modTimesData = f.read(self.SECTOR_BYTES)
+
+                    self.offsets = numpy.fromstring(offsetsData, dtype='>u4')
+                    self.modTimes = numpy.fromstring(modTimesData, dtype='>u4')
+
+            sectorCount = filesize // self.SECTOR_BYTES
+            if newFile:
+                self.freeSectors = numpy.ones(sectorCount, dtype=bool)
+                self.freeSectors[0:2] = False
 
             if not newFile:
-                needsRepair = False
-
-                # Populate freeSectors table
-                for offset in self.offsets:
-                    sector = offset >> 8
-                    count = offset & 0xff
-
-                    for i in xrange(sector, sector + count):
-                        if i >= len(self.freeSectors):
-                            log.warn("Region file offset table points to sector %d (past the end of the file)", i)
-                            needsRepair = True
-                            break
-                        if self.freeSectors[i] is False:
-                            needsRepair = True
-                        self.freeSectors[i] = False
+                self.freeSectors, needsRepair = self._scanFreeSectors(sectorCount)
 
                 if needsRepair:
+                    self._detachMapping()
                     self.repair()
 
                 region_debug("Found region file %s with %d/%d sectors used and %d chunks present",
@@ -112,9 +169,119 @@ class RegionFile(object):
     def __repr__(self):
         return "%s(\"%s\")" % (self.__class__.__name__, self.path)
 
+    # --- File handle ---
+
+    def _openFile(self):
+        if self._file is None:
+            self._file = open(self.path, "rb" if self.readonly else "rb+")
+        return self._file
+
+    def _getFile(self):
+        f = self._openFile()
+        _touchOpenFile(self)
+        return f
+
+    def _getMapping(self):
+        if self._mapping is None:
+            with open(self.path, "rb") as f:
+                self._mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _touchOpenFile(self)
+        return self._mapping
+
+    def flush(self):
+        """
+        Write the offset and timestamp tables if they were changed, and flush the file handle.
+        """
+        if self._file is None and not self._headerDirty:
+            return
+        self._flushFile(self._getFile())
+
+    def _flushFile(self, f):
+        if self._headerDirty and not self.readonly:
+            f.seek(0)
+            f.write(self.offsets.tostring())
+            f.write(self.modTimes.tostring())
+            self._headerDirty = False
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+        for start, count in self._releasedSectors:
+            self.freeSectors[start:start + count] = True
+        self._releasedSectors = []
+
+    def close(self):
+        """
+        Flush all changes and close the file handle. The RegionFile may still be used afterward, and will reopen
+        the file as needed.
+        """
+        if self._mapping is not None:
+            self._detachMapping()
+            # Views returned by readChunkCompressed keep the mapping alive, so it is not closed outright.
+            # It is unmapped and its file descriptor closed once the last of them is released.
+            self._mapping = None
+            _openRegionFiles.pop(self, None)
+        if self._file is None and not self._headerDirty:
+            return
+        # Not _getFile, which would put this file back in _openRegionFiles while it is being closed
+        _openRegionFiles.pop(self, None)
+        self._flushFile(self._openFile())
+        self._file.close()
+        self._file = None
+
+    def _detachMapping(self):
+        # Copy the offset and timestamp tables out of the mapping so they remain valid
+        # and writable when the mapping is closed.
+        if self._mapping is not None:
+            self.offsets = numpy.array(self.offsets)
+            self.modTimes = numpy.array(self.modTimes)
+
+    def _scanFreeSectors(self, sectorCount):
+        """
+        Build the free sector table from the offset table.
+
+        Returns a boolean array with one element per sector that is True for each unused sector, and a flag
+        that is True if any chunk overlaps another chunk or the header, or extends past the end of the file.
+        """
+        offsets = self.offsets[self.offsets != 0]
+        starts = (offsets >> 8).astype(numpy.int64)
+        ends = starts + (offsets & 0xff)
+
+        pastEnd = ends > sectorCount
+        if pastEnd.any():
+            log.warn("Region file offset table points to sector %d (past the end of the file)", ends[pastEnd].max() - 1)
+        needsRepair = pastEnd.any()
+
+        # Count the chunks using each sector. The header counts as a chunk using sectors 0 and 1.
+        starts = numpy.append(numpy.minimum(starts, sectorCount), 0)
+        ends = numpy.append(numpy.minimum(ends, sectorCount), 2)
+        usage = numpy.cumsum(numpy.bincount(starts, minlength=sectorCount + 1)
+                             - numpy.bincount(ends, minlength=sectorCount + 1))[:sectorCount]
+
+        if (usage > 1).any():
+            needsRepair = True
+
+        return usage == 0, needsRepair
+
+    def _findFreeSectors(self, sectorsNeeded):
+        """
+        Find the smallest run of free sectors that can hold the given number of sectors and return the number
+        of its first sector, or None if no run is large enough.
+        """
+        free = numpy.concatenate(([False], self.freeSectors, [False]))
+        edges = numpy.flatnonzero(free[1:] != free[:-1])
+        runStarts = edges[::2]
+        runLengths = edges[1::2] - runStarts
+
+        candidates = numpy.flatnonzero(runLengths >= sectorsNeeded)
+        if len(candidates) == 0:
+            return None
+
+        best = candidates[runLengths[candidates].argmin()]
+        return int(runStarts[best])
+
     @property
     def usedSectors(self):
-        return len(self.freeSectors) - sum(self.freeSectors)
+        return len(self.freeSectors) - numpy.count_nonzero(self.freeSectors)
 
     @property
     def sectorCount(self):
@@ -140,8 +307,8 @@ class RegionFile(object):
         """
 
         lostAndFound = {}
-        _freeSectors = [True] * len(self.freeSectors)
-        _freeSectors[0] = _freeSectors[1] = False
+        _freeSectors = numpy.ones(len(self.freeSectors), dtype=bool)
+        _freeSectors[0:2] = False
         deleted = 0
         recovered = 0
         log.info("Beginning repairs on {file} ({chunks} chunks)".format(file=os.path.basename(self.path), chunks=sum(self.offsets > 0)))
@@ -164,10 +331,9 @@ class RegionFile(object):
                     zPos = lev["zPos"].value & 0x1f
                     overlaps = False
 
-                    for i in xrange(sectorStart, sectorStart + sectorCount):
-                        if _freeSectors[i] is False:
-                            overlaps = True
-                        _freeSectors[i] = False
+                    if not _freeSectors[sectorStart:sectorStart + sectorCount].all():
+                        overlaps = True
+                    _freeSectors[sectorStart:sectorStart + sectorCount] = False
 
                     if xPos != cx or zPos != cz:
                         lostAndFound[xPos, zPos] = data
@@ -181,6 +347,8 @@ class RegionFile(object):
                     self._setOffset(cx, cz, 0)
                     deleted += 1
 
+        self.freeSectors, _ = self._scanFreeSectors(len(self.freeSectors))
+
         for cPos, foundData in lostAndFound.iteritems():
             cx, cz = cPos
             if self._getOffset(cx, cz) == 0:
@@ -193,6 +361,9 @@ class RegionFile(object):
     def readChunkCompressed(self, cx, cz):
         """
         Read a chunk and return its compression type and the compressed data as a (data, fmt) tuple
+
+        If the region file is memory-mapped, `data` is a read-only buffer that keeps the mapping open until it is
+        released.
         """
         cx &= 0x1f
         cz &= 0x1f
@@ -208,9 +379,12 @@ class RegionFile(object):
         if sectorStart + numSectors > len(self.freeSectors):
             raise ChunkNotPresent((cx, cz))
 
-        with open(self.path, "rb") as f:
-            f.seek(sectorStart * self.SECTOR_BYTES)
-            data = f.read(numSectors * self.SECTOR_BYTES)
+        if self._mapped:
+            return self._readMappedChunk(cx, cz, sectorStart, numSectors)
+
+        f = self._getFile()
+        f.seek(sectorStart * self.SECTOR_BYTES)
+        data = f.read(numSectors * self.SECTOR_BYTES)
         if len(data) < 5:
             raise RegionFormatError("Chunk %s data is only %d bytes long (expected 5)" % ((cx, cz), len(data)))
 
@@ -218,9 +392,21 @@ class RegionFile(object):
 
         length = struct.unpack_from(">I", data)[0]
         fmt = struct.unpack_from("B", data, 4)[0]
-        data = data[5:length + 5]
+        # length includes the format byte
+        data = data[5:length + 4]
         return data, fmt
 
+    def _readMappedChunk(self, cx, cz, sectorStart, numSectors):
+        mapping = self._getMapping()
+        start = sectorStart * self.SECTOR_BYTES
+        end = min(start + numSectors * self.SECTOR_BYTES, len(mapping))
+        if end - start < 5:
+            raise RegionFormatError("Chunk %s data is only %d bytes long (expected 5)" % ((cx, cz), end - start))
+
+        length, fmt = struct.unpack_from(">IB", mapping, start)
+        end = min(end, start + length + 4)
+        return _bufferSlice(mapping, start + 5, end), fmt
+
     def readChunkBytes(self, cx, cz):
         """
 
@@ -234,12 +420,7 @@ class RegionFile(object):
         data, fmt = self.readChunkCompressed(cx, cz)
         if data is None:
             return None
-        if fmt == self.VERSION_GZIP:
-            return nbt.gunzip(data)
-        if fmt == self.VERSION_DEFLATE:
-            return inflate(data)
-
-        raise RegionFormatError("Unknown compress format: {0}".format(fmt))
+        return decompressChunk(data, fmt)
 
     def writeChunkBytes(self, cx, cz, uncompressedData):
         data = deflate(uncompressedData)
@@ -251,7 +432,7 @@ class RegionFile(object):
         offset = self._getOffset(cx, cz)
         sectorNumber = offset >> 8
         sectorsAllocated = offset & 0xff
-        sectorsNeeded = (len(data) + self.CHUNK_HEADER_SIZE) // self.SECTOR_BYTES + 1
+        sectorsNeeded = self._sectorsNeeded(data)
         if sectorsNeeded >= 256:
             err = RegionFormatError("Cannot save chunk %s with compressed length %s (exceeds 1 megabyte)" %
                                     ((cx, cz), len(data)))
@@ -263,37 +444,18 @@ class RegionFile(object):
         else:
             # we need to allocate new sectors
 
-            # mark the sectors previously used for this chunk as free
-            for i in xrange(sectorNumber, sectorNumber + sectorsAllocated):
-                self.freeSectors[i] = True
-
-            runLength = 0
-            runStart = 0
-            try:
-                runStart = self.freeSectors.index(True)
-
-                for i in range(runStart, len(self.freeSectors)):
-                    if runLength:
-                        if self.freeSectors[i]:
-                            runLength += 1
-                        else:
-                            runLength = 0
-                    elif self.freeSectors[i]:
-                        runStart = i
-                        runLength = 1
-
-                    if runLength >= sectorsNeeded:
-                        break
-            except ValueError:
-                pass
+            # the sectors previously used for this chunk become free once the new offset is written
+            self._releaseSectors(sectorNumber, sectorsAllocated)
+
+            runStart = self._findFreeSectors(sectorsNeeded)
 
             # we found a free space large enough
-            if runLength >= sectorsNeeded:
+            if runStart is not None:
                 region_debug("REGION SAVE {0},{1}, reusing {2}b".format(cx, cz, len(data)))
                 sectorNumber = runStart
                 self._setOffset(cx, cz, sectorNumber << 8 | sectorsNeeded)
                 self.writeSector(sectorNumber, data, format)
-                self.freeSectors[sectorNumber:sectorNumber + sectorsNeeded] = [False] * sectorsNeeded
+                self.freeSectors[sectorNumber:sectorNumber + sectorsNeeded] = False
 
             else:
                 # no free space large enough found -- we need to grow the
@@ -301,33 +463,93 @@ class RegionFile(object):
 
                 region_debug("REGION SAVE {0},{1}, growing by {2}b".format(cx, cz, len(data)))
 
-                with open(self.path, "rb+") as f:
-                    f.seek(0, 2)
-                    filesize = f.tell()
+                f = self._getFile()
+                f.seek(0, 2)
+                filesize = f.tell()
 
-                    sectorNumber = len(self.freeSectors)
+                sectorNumber = len(self.freeSectors)
 
-                    assert sectorNumber * self.SECTOR_BYTES == filesize
+                assert sectorNumber * self.SECTOR_BYTES == filesize
 
-                    filesize += sectorsNeeded * self.SECTOR_BYTES
-                    f.truncate(filesize)
+                filesize += sectorsNeeded * self.SECTOR_BYTES
+                f.truncate(filesize)
 
-                self.freeSectors += [False] * sectorsNeeded
+                self.freeSectors = numpy.append(self.freeSectors, numpy.zeros(sectorsNeeded, dtype=bool))
 
                 self._setOffset(cx, cz, sectorNumber << 8 | sectorsNeeded)
                 self.writeSector(sectorNumber, data, format)
 
         self.setTimestamp(cx, cz)
 
+    def _sectorsNeeded(self, data):
+        return (len(data) + self.CHUNK_HEADER_SIZE) // self.SECTOR_BYTES + 1
+
+    def compact(self):
+        """
+        Rewrite the region file with its chunks stored contiguously and in the same order as the chunk grid,
+        removing all unused sectors.
+
+        The compacted file is written to a temporary file which then replaces the region file.
+
+        :return: The number of sectors removed from the file
+        :rtype: int
+        """
+        if self.readonly:
+            raise IOError("Region file is opened read only.")
+
+        oldSectorCount = self.sectorCount
+        offsets = numpy.zeros(self.SECTOR_BYTES//4, dtype='>u4')
+        modTimes = numpy.array(self.modTimes)
+
+        tempPath = os.path.join(os.path.dirname(self.path), "##MCEDIT.COMPACT.%s" % os.path.basename(self.path))
+        with open(tempPath, "wb") as f:
+            sectorNumber = 2
+            for index in numpy.flatnonzero(self.offsets):
+                cx = index & 0x1f
+                cz = index >> 5
+                try:
+                    data, fmt = self.readChunkCompressed(cx, cz)
+                except (ChunkNotPresent, RegionFormatError) as e:
+                    log.warn("Dropping unreadable chunk %s from %s while compacting: %r",
+                             (cx, cz), os.path.basename(self.path), e)
+                    continue
+
+                sectorsNeeded = self._sectorsNeeded(data)
+                f.seek(sectorNumber * self.SECTOR_BYTES)
+                f.write(struct.pack(">IB", len(data) + 1, fmt))
+                f.write(data)
+                offsets[index] = sectorNumber << 8 | sectorsNeeded
+                sectorNumber += sectorsNeeded
+
+            f.truncate(sectorNumber * self.SECTOR_BYTES)
+            f.seek(0)
+            f.write(offsets.tostring())
+            f.write(modTimes.tostring())
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.close()
+        if os.name == "nt":
+            # os.rename can't replace an existing file on Windows
+            os.unlink(self.path)
+        os.rename(tempPath, self.path)
+
+        self.offsets = offsets
+        self.modTimes = modTimes
+        self.freeSectors = numpy.zeros(sectorNumber, dtype=bool)
+        self._releasedSectors = []
+
+        region_debug("Compacted region file %s from %d to %d sectors",
+                     os.path.basename(self.path), oldSectorCount, sectorNumber)
+        return oldSectorCount - sectorNumber
+
     def writeSector(self, sectorNumber, data, format):
-        with open(self.path, "rb+") as f:
-            region_debug("REGION: Writing sector {0}".format(sectorNumber))
+        f = self._getFile()
+        region_debug("REGION: Writing sector {0}".format(sectorNumber))
 
-            f.seek(sectorNumber * self.SECTOR_BYTES)
-            f.write(struct.pack(">I", len(data) + 1))  # // chunk length
-            f.write(struct.pack("B", format))  # // chunk version number
-            f.write(data)  # // chunk data
-            # f.flush()
+        f.seek(sectorNumber * self.SECTOR_BYTES)
+        f.write(struct.pack(">IB", len(data) + 1, format))  # // chunk length and version number
+        f.write(data)  # // chunk data
 
     def containsChunk(self, cx, cz):
         return self._getOffset(cx, cz) != 0
@@ -341,19 +563,21 @@ class RegionFile(object):
         cx &= 0x1f
         cz &= 0x1f
         self.offsets[cx + cz * 32] = offset
-        with open(self.path, "rb+") as f:
-            f.seek(0)
-            f.write(self.offsets.tostring())
+        self._headerDirty = True
 
     def deleteChunk(self, cx, cz):
         offset = self._getOffset(cx, cz)
         sectorNumber = offset >> 8
         sectorsAllocated = offset & 0xff
-        for i in range(sectorNumber, sectorNumber + sectorsAllocated):
-            self.freeSectors[i] = True
+        self._releaseSectors(sectorNumber, sectorsAllocated)
 
         self._setOffset(cx, cz, 0)
 
+    def _releaseSectors(self, sectorNumber, count):
+        # Keep the sectors reserved until the offset table no longer pointing to them has been written.
+        if count:
+            self._releasedSectors.append((sectorNumber, count))
+
     def getTimestamp(self, cx, cz):
         cx &= 0x1f
         cz &= 0x1f
@@ -366,6 +590,22 @@ class RegionFile(object):
         cx &= 0x1f
         cz &= 0x1f
         self.modTimes[cx + cz * 32] = timestamp
-        with open(self.path, "rb+") as f:
-            f.seek(self.SECTOR_BYTES)
-            f.write(self.modTimes.tostring())
+        self._headerDirty = True
+
+
+def decompressChunk(data, fmt):
+    """
+    Decompress chunk data returned by `RegionFile.readChunkCompressed`. Decompressing deflated data
+    releases the GIL, so this may be called from worker threads.
+
+    :param data: Compressed chunk data
+    :param fmt: Compression format, either RegionFile.VERSION_GZIP or RegionFile.VERSION_DEFLATE
+    :return: Uncompressed chunk data
+    :rtype: bytes
+    """
+    if fmt == RegionFile.VERSION_GZIP:
+        return nbt.gunzip(bytes(data))
+    if fmt == RegionFile.VERSION_DEFLATE:
+        return inflate(data)
+
+    raise RegionFormatError("Unknown compress format: {0}".format(fmt))
@@ -4,9 +4,18 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 import logging
 
+import numpy
+
+from mceditlib.util import workers
+
 log = logging.getLogger(__name__)
 
-updateLightsByCoord = updateLightsInSelection = NotImplemented
+updateLightsInSelection = NotImplemented
+_updateLightsByCoord = NotImplemented
+
+# Updates for more than this many cells recompute whole chunks on the worker pool instead, if it has
+# more than one thread. See setTiledThreshold.
+_tiledThreshold = 1 << 20
 
 
 def setMethod(name):
@@ -22,11 +31,62 @@ def setMethod(name):
     if name == "sections":
         from mceditlib.relight import with_sections
         setModule(with_sections)
+    if name == "chunks":
+        from mceditlib.relight import with_chunks
+        setModule(with_chunks)
 
 
 def setModule(mod):
-    global updateLightsByCoord, updateLightsInSelection
-    updateLightsByCoord = mod.updateLightsByCoord
+    global _updateLightsByCoord, updateLightsInSelection
+    _updateLightsByCoord = mod.updateLightsByCoord
     updateLightsInSelection = mod.updateLightsInSelection
 
+
+def setTiledThreshold(count):
+    """
+    Set the number of cells above which updateLightsByCoord recomputes the lighting of every chunk near the
+    cells, split into tiles that are lit in parallel by the shared worker pool. This only happens if the pool
+    has more than one thread. Pass None to always use the selected method. The default is 1 << 20 cells.
+
+    :type count: int | None
+    """
+    global _tiledThreshold
+    _tiledThreshold = count
+
+
+def getTiledThreshold():
+    return _tiledThreshold
+
+
+def updateLightsByCoord(dim, x, y, z):
+    """
+    Update the lighting of the given cells, and of any cells whose lighting depends on them. If the
+    dimension is deferring lighting updates, the cells are only recorded, to be updated later.
+
+    :type dim: mceditlib.worldeditor.WorldEditorDimension
+    :type x: numpy.ndarray
+    :type y: numpy.ndarray
+    :type z: numpy.ndarray
+    """
+    if getattr(dim, "deferLighting", False):
+        dim.addPendingLights(x, y, z)
+    else:
+        updateLightsNow(dim, x, y, z)
+
+
+def updateLightsNow(dim, x, y, z):
+    """
+    Like updateLightsByCoord, but never defers the update.
+
+    :type dim: mceditlib.worldeditor.WorldEditorDimension
+    :type x: numpy.ndarray
+    :type y: numpy.ndarray
+    :type z: numpy.ndarray
+    """
+    if _tiledThreshold is not None and numpy.size(x) > _tiledThreshold and workers.getWorkerCount() > 1:
+        from mceditlib.relight import with_chunks
+        with_chunks.updateLightsByCoord(dim, x, y, z)
+    else:
+        _updateLightsByCoord(dim, x, y, z)
+
 setMethod("cython")
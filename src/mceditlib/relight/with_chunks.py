@@ -0,0 +1,280 @@
+"""
+    with_chunks
+
+    Recomputes the lighting of whole chunks from their blocks, ignoring the light values they had before.
+
+    The chunks are gathered into tiles of up to TILE_CHUNKS by TILE_CHUNKS chunks. Each tile is copied, along
+    with a border one chunk wide, into one set of arrays. Light travels at most 14 blocks, so the border holds
+    every light source that can reach a chunk in the tile - the whole 3x3 neighborhood of each chunk.
+
+    Sky light starts at 15 in every cell above the column's highest opaque block, found by accumulating the
+    opacity of each column from the top down. Block light starts at the brightness of each block. Both are then
+    spread through the tile one step at a time until they stop changing, using the same rules as with_cython:
+    moving into a cell costs its opacity, and at least 1.
+
+    Chunks that are not present are treated as opaque and dark. Sections that are not present are treated as
+    air, and are created if their light would differ from that of a missing section.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import collections
+import logging
+
+import numpy
+
+from mceditlib import multi_block
+from mceditlib.util import markChunkDirty, workers
+
+log = logging.getLogger(__name__)
+
+TILE_CHUNKS = 4
+
+# Light travels at most this many blocks from its source
+LIGHT_RADIUS = 15
+
+
+def updateLightsByCoord(dim, x, y, z):
+    """
+    Recompute the lighting of every chunk within LIGHT_RADIUS blocks of the given coordinates.
+
+    :type dim: mceditlib.worldeditor.WorldEditorDimension
+    :type x: numpy.ndarray
+    :type y: numpy.ndarray
+    :type z: numpy.ndarray
+    """
+    x = numpy.asarray(x, 'i4').ravel()
+    z = numpy.asarray(z, 'i4').ravel()
+    if not x.size:
+        return
+
+    # Chunks are wider than LIGHT_RADIUS, so these offsets find every chunk within the radius.
+    offsets = (-LIGHT_RADIUS + 1, 0, LIGHT_RADIUS - 1)
+    cPos = numpy.concatenate([numpy.unique(multi_block.chunkPosArray(x + dx, z + dz))
+                              for dx in offsets for dz in offsets])
+    chunkPositions = multi_block.decodeChunkPos(numpy.unique(cPos))
+    relightChunks(dim, [(int(cx), int(cz)) for cx, cz in chunkPositions])
+
+
+def updateLightsInSelection(dim, selection):
+    relightChunks(dim, selection.chunkPositions())
+
+
+def relightChunks(dim, chunkPositions):
+    """
+    Recompute the SkyLight, BlockLight and HeightMap of the given chunks from their blocks. Chunks that are
+    not present are skipped.
+
+    If the shared worker pool has more than one thread, tiles are lit by the pool while the calling thread
+    reads the next tiles and stores the finished ones.
+
+    :type dim: mceditlib.worldeditor.WorldEditorDimension
+    :param chunkPositions: (cx, cz) positions of the chunks to relight
+    :type chunkPositions: iterable[(int, int)]
+    """
+    if not dim.hasLights:
+        return
+
+    tiles = {}
+    for cx, cz in chunkPositions:
+        if dim.containsChunk(cx, cz):
+            tiles.setdefault((cx // TILE_CHUNKS, cz // TILE_CHUNKS), set()).add((cx, cz))
+
+    pool = None
+    if len(tiles) > 1 and workers.getWorkerCount() > 1:
+        pool = workers.getWorkerPool()
+
+    if pool is None:
+        for tileChunks in tiles.itervalues():
+            relightTile(dim, tileChunks)
+        return
+
+    # Each tile's arrays take a few dozen megabytes, so only read a few tiles ahead.
+    readAhead = 2 * workers.getWorkerCount()
+    pending = collections.deque()
+    for tileChunks in tiles.itervalues():
+        tile = LightTile(dim, tileChunks)
+        pending.append((tile, pool.apply_async(tile.solve)))
+        if len(pending) >= readAhead:
+            tile, result = pending.popleft()
+            result.get()
+            tile.store()
+
+    for tile, result in pending:
+        result.get()
+        tile.store()
+
+
+def relightTile(dim, chunkPositions):
+    """
+    Recompute the lighting of a group of nearby chunks at once. The arrays used are as large as the
+    rectangle that holds all of the chunks plus a border one chunk wide, so the chunks should be close
+    together.
+
+    :type dim: mceditlib.worldeditor.WorldEditorDimension
+    :type chunkPositions: set[(int, int)]
+    """
+    tile = LightTile(dim, chunkPositions)
+    tile.solve()
+    tile.store()
+
+
+class LightTile(object):
+    """
+    The blocks of a group of nearby chunks and the chunks around them, copied into one set of arrays.
+
+    Creating the tile and calling `store` read and change the chunks, and must be done on the thread that
+    owns the dimension. `solve` only uses the tile's own arrays, so it may be called on any thread.
+
+    :type dim: mceditlib.worldeditor.WorldEditorDimension
+    :type chunkPositions: set[(int, int)]
+    """
+    def __init__(self, dim, chunkPositions):
+        self.chunkPositions = chunkPositions
+        self.hasSkyLight = dim.hasSkyLight
+        self.opacityTable = numpy.asarray(dim.blocktypes.opacity)
+        self.brightnessTable = numpy.asarray(dim.blocktypes.brightness)
+        self.mincx = min(cx for cx, cz in chunkPositions) - 1
+        self.mincz = min(cz for cx, cz in chunkPositions) - 1
+        maxcx = max(cx for cx, cz in chunkPositions) + 1
+        maxcz = max(cz for cx, cz in chunkPositions) + 1
+
+        self.chunks = chunks = {}
+        for cx in range(self.mincx, maxcx + 1):
+            for cz in range(self.mincz, maxcz + 1):
+                if dim.containsChunk(cx, cz):
+                    chunks[cx, cz] = dim.getChunk(cx, cz)
+
+        # Leave one section of air above the highest section, so light can pass over the top of anything.
+        sectionTop = max([max(chunk.sectionPositions() or [-1]) for chunk in chunks.itervalues()])
+        self.height = min(256, (sectionTop + 2) << 4)
+        length = (maxcz - self.mincz + 1) << 4
+        width = (maxcx - self.mincx + 1) << 4
+
+        self.blocks = numpy.zeros((self.height, length, width), 'uint16')
+        self.present = numpy.zeros((length, width), bool)
+
+        for (cx, cz), chunk in chunks.iteritems():
+            zs, xs = self.area(cx, cz)
+            self.present[zs, xs] = True
+            for cy in chunk.sectionPositions():
+                section = chunk.getSection(cy)
+                if section is not None and 0 <= cy < self.height >> 4:
+                    self.blocks[cy << 4:(cy + 1) << 4, zs, xs] = section.Blocks
+
+        self.blockLight = self.skyLight = self.heights = None
+
+    def area(self, cx, cz):
+        x = (cx - self.mincx) << 4
+        z = (cz - self.mincz) << 4
+        return slice(z, z + 16), slice(x, x + 16)
+
+    def solve(self):
+        blocks = self.blocks
+        present = self.present
+        opacity = self.opacityTable[blocks]
+        effectiveOpacity = numpy.clip(opacity, 1, 15).astype('int8')
+        effectiveOpacity[:, ~present] = 15
+
+        # Only spread light through the layers it can reach or change.
+        blockLight = self.brightnessTable[blocks].astype('int8')
+        blockLight[:, ~present] = 0
+        sourceLayers = blockLight.any(axis=(1, 2)).nonzero()[0]
+        if len(sourceLayers):
+            ys = slice(max(0, sourceLayers[0] - LIGHT_RADIUS), sourceLayers[-1] + LIGHT_RADIUS)
+            spreadLight(blockLight[ys], effectiveOpacity[ys])
+        self.blockLight = blockLight
+
+        if self.hasSkyLight:
+            # A cell is covered if it or any cell above it is opaque.
+            covered = numpy.logical_or.accumulate(opacity[::-1] > 0, axis=0)[::-1]
+            heights = covered.sum(axis=0)
+            skyLight = numpy.where(covered, 0, 15).astype('int8')
+            skyLight[:, ~present] = 0
+            # Everything above the highest column is lit fully
+            presentHeights = heights[present]
+            ys = slice(max(0, presentHeights.min() - LIGHT_RADIUS), presentHeights.max() + 1)
+            spreadLight(skyLight[ys], effectiveOpacity[ys])
+            self.skyLight = skyLight
+            self.heights = heights
+
+    def store(self):
+        for cx, cz in self.chunkPositions:
+            chunk = self.chunks.get((cx, cz))
+            if chunk is None:
+                continue
+            zs, xs = self.area(cx, cz)
+            for cy in range(self.height >> 4):
+                ys = slice(cy << 4, (cy + 1) << 4)
+                section = chunk.getSection(cy)
+                if section is None:
+                    # Like with_cython, create missing sections that light spreads into or is blocked from.
+                    if not self.hasDefaultLight(ys, zs, xs):
+                        section = chunk.getSection(cy, create=True)
+                    if section is None:
+                        continue
+                section.BlockLight[:] = self.blockLight[ys, zs, xs]
+                if self.hasSkyLight:
+                    section.SkyLight[:] = self.skyLight[ys, zs, xs]
+                markChunkDirty(chunk, cy)
+
+            if self.hasSkyLight and chunk.HeightMap is not None:
+                chunk.HeightMap[:] = self.heights[zs, xs]
+
+            markChunkDirty(chunk)
+
+    def hasDefaultLight(self, ys, zs, xs):
+        """
+        Return True if the given cells have the light of a missing section: no block light, and full sky
+        light if the dimension has any.
+        """
+        if self.blockLight[ys, zs, xs].any():
+            return False
+        if self.hasSkyLight and (self.skyLight[ys, zs, xs] != 15).any():
+            return False
+        return True
+
+
+def spreadLight(light, effectiveOpacity):
+    """
+    Spread light from every cell to its neighbors until no cell gets any brighter. `light` holds the light
+    sources and is changed in place.
+
+    Each step only looks at the box around the cells that got brighter in the step before.
+
+    :param light: Light values, shaped (y, z, x)
+    :type light: numpy.ndarray
+    :param effectiveOpacity: Light lost when moving into each cell, at least 1.
+    :type effectiveOpacity: numpy.ndarray
+    """
+    shape = numpy.array(light.shape)
+    lo = numpy.zeros(3, int)
+    hi = shape.copy()
+    for i in range(LIGHT_RADIUS):
+        # Cells in lo:hi may change. Their neighbors are in the padded box around them.
+        padLo = numpy.maximum(lo - 1, 0)
+        padHi = numpy.minimum(hi + 1, shape)
+        padded = tuple(slice(l, h) for l, h in zip(padLo, padHi))
+        view = light[padded]
+
+        # Brightest light of each cell's neighbors
+        incoming = numpy.zeros_like(view)
+        for axis in range(3):
+            dest = [slice(None)] * 3
+            source = [slice(None)] * 3
+            for d in (1, -1):
+                dest[axis] = slice(1, None) if d == 1 else slice(None, -1)
+                source[axis] = slice(None, -1) if d == 1 else slice(1, None)
+                numpy.maximum(incoming[tuple(dest)], view[tuple(source)], incoming[tuple(dest)])
+        incoming -= effectiveOpacity[padded]
+
+        inner = tuple(slice(l, h) for l, h in zip(lo - padLo, hi - padLo))
+        changed = incoming[inner] > view[inner]
+        if not changed.any():
+            break
+        numpy.maximum(view[inner], incoming[inner], view[inner])
+
+        for axis in range(3):
+            others = tuple(a for a in range(3) if a != axis)
+            changedRows = changed.any(axis=others).nonzero()[0]
+            start = lo[axis]
+            lo[axis] = max(start + changedRows[0] - 1, 0)
+            hi[axis] = min(start + changedRows[-1] + 2, shape[axis])
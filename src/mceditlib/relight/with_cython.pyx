@@ -9,9 +9,11 @@ import logging
 # unordered_map was twice as slow, at least with the MSVC 2008 from Python C++ Toolkit
 from libcpp.map cimport map
 from libcpp.set cimport set
+from libcpp.vector cimport vector
 from libcpp.pair cimport pair
 from libcpp.deque cimport deque
 from libcpp cimport bool
+from libc.stdlib cimport malloc, free
 
 cimport cython
 from cython.operator cimport dereference as deref
@@ -20,36 +22,41 @@ from cpython cimport Py_INCREF, Py_DECREF
 import numpy as np
 cimport numpy as cnp
 
+from mceditlib.util import markChunkDirty
+
 log = logging.getLogger(__name__)
 
 DEF OUTPUT_STATS = False
 IF OUTPUT_STATS:
     import time
 
+ctypedef unsigned long long section_key_t
+ctypedef unsigned long long chunk_key_t
+
 cdef struct RelightSection:
-    unsigned short[:,:,:] Blocks
-    unsigned char[:,:,:] BlockLight
-    unsigned char[:,:,:] SkyLight
-    # To keep the chunk "alive" while we edit its section arrays, we INCREF it and keep it here
-    # then DECREF it when the RelightCtx dies and when it gets decached.
-    # It must be a <void *> with manual refcounting because Cython won't let me store an <object>
-    # in a struct.
-    void * chunk
+    # Pointers into the section's Blocks, BlockLight and SkyLight arrays. The arrays are kept alive
+    # by RelightCtx.sectionRefs while the section is cached.
+    unsigned short * Blocks
+    unsigned char * BlockLight
+    unsigned char * SkyLight
+    section_key_t key
     char dirty
+    # Set when the section is used, cleared when the eviction hand passes over it.
+    char used
 
 cdef struct RelightChunk:
     # This guy is a big endian array, but Cython only wants to operate on little-endians.
     # We byteswap the entire thing on read, and if we're dirty, byteswap it all out again
     # on write.
     unsigned int[:,:] HeightMap
-    # Ditto.
+    # To keep the chunk "alive" while we edit its height map, we INCREF it and keep it here
+    # then DECREF it when the RelightCtx dies and when it gets decached.
+    # It must be a <void *> with manual refcounting because Cython won't let me store an <object>
+    # in a struct.
     void * chunk
     char dirty
     
 
-ctypedef unsigned long long section_key_t
-ctypedef unsigned long long chunk_key_t
-
 cdef section_key_t section_key(int cx, int cy, int cz):
     # assume 0 < cy < 256
     return (<section_key_t>cx) << 36 | (<section_key_t>cz & 0xFFFFFFF) << 8 | (<section_key_t>cy) & 0xFF
@@ -57,13 +64,48 @@ cdef section_key_t section_key(int cx, int cy, int cz):
 cdef chunk_key_t chunk_key(int cx, int cz):
     return (<chunk_key_t>cx) << 32 | (<section_key_t>cz) & 0xFFFFFFFFLL
 
-DEF CACHE_LIMIT = 100
+cdef inline unsigned int cell_index(int x, int y, int z):
+    return (y & 0xf) << 8 | (z & 0xf) << 4 | (x & 0xf)
+
+DEF CACHE_LIMIT = 512
+DEF NO_SECTION = -1
+
+cdef int cacheLimit = CACHE_LIMIT
+
+def setCacheLimit(int limit):
+    """
+    Set the number of sections a RelightCtx keeps at once. Sections beyond this are returned to their chunks,
+    which may then be unloaded by the world editor.
+
+    :param limit: Number of sections
+    :type limit: int
+    """
+    global cacheLimit
+    if limit < 1:
+        raise ValueError("Cache limit must be at least 1.")
+    cacheLimit = limit
+
+def getCacheLimit():
+    return cacheLimit
 
 
 @cython.final
 cdef class RelightCtx(object):
     cdef:
-        map[section_key_t, RelightSection] section_cache
+        # Cached sections are stored in `sections`, which never moves, so pointers to a section stay
+        # valid until it is evicted. `sectionTable` is an open addressing hash table with linear probing
+        # that holds indexes into `sections`.
+        RelightSection * sections
+        int * sectionTable
+        unsigned int tableMask
+        int sectionLimit, sectionCount, evictionHand
+        list sectionRefs
+
+        # The most recently used section, which is usually the next one asked for.
+        section_key_t lastKey
+        RelightSection * lastSection
+        bint hasLastSection
+
         map[chunk_key_t, RelightChunk] chunk_cache
         set[section_key_t] absent_sections
         
@@ -73,9 +115,28 @@ cdef class RelightCtx(object):
         IF OUTPUT_STATS:
             unsigned int spreadCount, drawCount, fadeCount
             unsigned int raisedColumns, loweredColumns, columnUpdates
+            unsigned int sectionLoads, sectionEvictions
             object startTime
         int _useBlockLight
 
+    def __cinit__(self, dim):
+        cdef int i, tableSize = 1
+        self.sectionLimit = cacheLimit
+        # Keep the table at most one-quarter full so probe sequences stay short
+        while tableSize < self.sectionLimit * 4:
+            tableSize <<= 1
+        self.tableMask = tableSize - 1
+        self.sections = <RelightSection *>malloc(self.sectionLimit * sizeof(RelightSection))
+        self.sectionTable = <int *>malloc(tableSize * sizeof(int))
+        if self.sections is NULL or self.sectionTable is NULL:
+            raise MemoryError()
+        for i in range(tableSize):
+            self.sectionTable[i] = NO_SECTION
+        self.sectionCount = self.evictionHand = 0
+        self.sectionRefs = [None] * self.sectionLimit
+        self.lastSection = NULL
+        self.hasLastSection = False
+
     def __init__(self, dim):
         self.dimension = dim
         self.brightness = self.dimension.blocktypes.brightness
@@ -84,6 +145,7 @@ cdef class RelightCtx(object):
         IF OUTPUT_STATS:
             self.spreadCount = self.drawCount = self.fadeCount = 0
             self.raisedColumns = self.loweredColumns = self.columnUpdates = 0
+            self.sectionLoads = self.sectionEvictions = 0
             self.startTime = time.time()
 
     cdef void useBlockLight(self):
@@ -92,21 +154,40 @@ cdef class RelightCtx(object):
     cdef void useSkyLight(self):
         self._useBlockLight = 0
 
-    cdef RelightSection * getSection(self, int cx, int cy, int cz):
+    cdef inline unsigned int tableHome(self, section_key_t key):
+        return <unsigned int>((key * 0x9E3779B97F4A7C15ULL) >> 32) & self.tableMask
+
+    cdef inline RelightSection * getSection(self, int cx, int cy, int cz):
         cdef section_key_t key = section_key(cx, cy, cz)
-        cdef map[section_key_t, RelightSection].iterator i = self.section_cache.find(key)
-        cdef RelightSection * ret
-        if i == self.section_cache.end():
-            ret = self.cacheSection(cx, cy, cz)
-        else:
-            ret = &(deref(i).second)
+        if self.hasLastSection and key == self.lastKey:
+            return self.lastSection
+
+        cdef unsigned int i = self.tableHome(key)
+        cdef int index
+        cdef RelightSection * ret = NULL
+        while True:
+            index = self.sectionTable[i]
+            if index == NO_SECTION:
+                ret = self.cacheSection(cx, cy, cz)
+                break
+            if self.sections[index].key == key:
+                ret = &self.sections[index]
+                ret.used = 1
+                break
+            i = (i + 1) & self.tableMask
+
+        self.lastKey = key
+        self.lastSection = ret
+        self.hasLastSection = True
         return ret
 
     cdef RelightSection * cacheSection(self, int cx, int cy, int cz):
-        # Initializer is *required* - if memoryview fields are uninitialized, they cannot be assigned
-        # later as Cython attempts to decref the uninitialized memoryview and segfaults.
-        cdef RelightSection cachedSection = [None, None, None, NULL, 0]
-        cdef long long key = section_key(cx, cy, cz)
+        cdef section_key_t key = section_key(cx, cy, cz)
+        cdef unsigned short[:, :, ::1] Blocks
+        cdef unsigned char[:, :, ::1] BlockLight, SkyLight
+        cdef RelightSection * ret
+        cdef int index
+        cdef unsigned int i
 
         # Fast exit for absent sections
         if self.absent_sections.find(key) != self.absent_sections.end():
@@ -125,25 +206,84 @@ cdef class RelightCtx(object):
             self.absent_sections.insert(key)
             return NULL
 
-        if self.section_cache.size() > CACHE_LIMIT:
-            # xxx decache something!
-            pass
         assert section.Blocks.shape == section.BlockLight.shape == section.SkyLight.shape == (16, 16, 16)
+        Blocks = section.Blocks
+        BlockLight = section.BlockLight
+        SkyLight = section.SkyLight
 
-        cachedSection.Blocks = section.Blocks
-        cachedSection.BlockLight = section.BlockLight
-        cachedSection.SkyLight = section.SkyLight
-        cachedSection.chunk = <void *>chunk
-        Py_INCREF(chunk)
-
-        # weird hack because in Python an assignment is a statement so we cannot write
-        # `return self.section_cache[key] = cachedSection` to return a reference to the
-        # RelightSection in the cache...
-        cdef RelightSection * ret
-        ret = &self.section_cache[key]
-        ret[0] = cachedSection
+        if self.sectionCount < self.sectionLimit:
+            index = self.sectionCount
+            self.sectionCount += 1
+        else:
+            index = self.evictSection()
+        IF OUTPUT_STATS:
+            self.sectionLoads += 1
+
+        ret = &self.sections[index]
+        ret.Blocks = &Blocks[0, 0, 0]
+        ret.BlockLight = &BlockLight[0, 0, 0]
+        ret.SkyLight = &SkyLight[0, 0, 0]
+        ret.key = key
+        ret.dirty = 0
+        ret.used = 1
+        self.sectionRefs[index] = (chunk, section.Blocks, section.BlockLight, section.SkyLight)
+
+        i = self.tableHome(key)
+        while self.sectionTable[i] != NO_SECTION:
+            i = (i + 1) & self.tableMask
+        self.sectionTable[i] = index
         return ret
 
+    cdef int evictSection(self):
+        # Choose a section that was not used since the hand last passed it, return it to its chunk,
+        # and return its index so it can be reused.
+        cdef int index
+        while True:
+            index = self.evictionHand
+            self.evictionHand = (self.evictionHand + 1) % self.sectionCount
+            if self.sections[index].used:
+                self.sections[index].used = 0
+            else:
+                break
+        IF OUTPUT_STATS:
+            self.sectionEvictions += 1
+
+        self.removeFromTable(self.sections[index].key)
+        self.releaseSection(index)
+        return index
+
+    cdef void removeFromTable(self, section_key_t key):
+        cdef unsigned int i = self.tableHome(key)
+        cdef unsigned int j, home
+        while self.sections[self.sectionTable[i]].key != key:
+            i = (i + 1) & self.tableMask
+        self.sectionTable[i] = NO_SECTION
+
+        # Move later entries of the probe sequence back into the gap, so lookups
+        # do not stop early at the empty slot.
+        j = i
+        while True:
+            j = (j + 1) & self.tableMask
+            if self.sectionTable[j] == NO_SECTION:
+                break
+            home = self.tableHome(self.sections[self.sectionTable[j]].key)
+            if (j - home) & self.tableMask >= (j - i) & self.tableMask:
+                self.sectionTable[i] = self.sectionTable[j]
+                self.sectionTable[j] = NO_SECTION
+                i = j
+
+    cdef void releaseSection(self, int index):
+        cdef RelightSection * section = &self.sections[index]
+        chunk = self.sectionRefs[index][0]
+        self.sectionRefs[index] = None
+        if section == self.lastSection:
+            self.hasLastSection = False
+            self.lastSection = NULL
+        if section.dirty:
+            markChunkDirty(chunk, <signed char>(section.key & 0xFF))
+        section.Blocks = NULL
+        section.BlockLight = section.SkyLight = NULL
+
     # ---
     
 
@@ -165,9 +305,10 @@ cdef class RelightCtx(object):
         if not self.dimension.containsChunk(cx, cz):
             return NULL
         chunk = self.dimension.getChunk(cx, cz)
-        if self.chunk_cache.size() > CACHE_LIMIT:
-            # xxx decache something!
-            pass
+        if self.chunk_cache.size() >= <size_t>self.sectionLimit:
+            # Height maps are only used while updating sky light columns, so
+            # there is no need to be choosy.
+            self.releaseChunks()
 
         cachedChunk.HeightMap = np.array(chunk.HeightMap, dtype='u4')
         cachedChunk.chunk = <void *>chunk
@@ -180,37 +321,40 @@ cdef class RelightCtx(object):
         ret = &self.chunk_cache[key]
         ret[0] = cachedChunk
         return ret
+
+    cdef void releaseChunks(self):
+        cdef RelightChunk cachedChunk
+        for ckeyval in self.chunk_cache:
+            cachedChunk = ckeyval.second
+            if cachedChunk.dirty:
+                (<object>cachedChunk.chunk).HeightMap[:] = cachedChunk.HeightMap
+                markChunkDirty(<object>cachedChunk.chunk)
+            cachedChunk.HeightMap = None
+            Py_DECREF(<object>cachedChunk.chunk)
+            cachedChunk.chunk = NULL
+        self.chunk_cache.clear()
     
     # ---
     
     def __dealloc__(self):
-        cdef RelightSection cachedSection
-        cdef section_key_t key
+        cdef int index
         IF OUTPUT_STATS:
             cdef float duration = time.time() - self.startTime
             log.info("RelightCtx Finished: draw=%7d, spread=%7d, fade=%7d, sections=%d "
-                     "raisedColumns=%d loweredColumns=%d time=%f",
-                     self.drawCount, self.spreadCount, self.fadeCount, self.section_cache.size(),
+                     "loads=%d evictions=%d raisedColumns=%d loweredColumns=%d time=%f",
+                     self.drawCount, self.spreadCount, self.fadeCount, self.sectionCount,
+                     self.sectionLoads, self.sectionEvictions,
                      self.raisedColumns, self.loweredColumns, duration)
 
-        for keyval in self.section_cache:
-            key = keyval.first
-            cachedSection = keyval.second
-            cachedSection.Blocks = cachedSection.BlockLight = cachedSection.SkyLight = None
-            if cachedSection.dirty:
-                (<object>cachedSection.chunk).dirty = True
-            Py_DECREF(<object>cachedSection.chunk)
-            cachedSection.chunk = NULL
+        if self.sections is not NULL and self.sectionRefs is not None:
+            for index in range(self.sectionCount):
+                self.releaseSection(index)
+        free(self.sections)
+        free(self.sectionTable)
+        self.sections = NULL
+        self.sectionTable = NULL
 
-        for ckeyval in self.chunk_cache:
-            key = ckeyval.first
-            cachedChunk = ckeyval.second
-            if cachedChunk.dirty:
-                (<object>cachedChunk.chunk).HeightMap[:] = cachedChunk.HeightMap
-                (<object>cachedChunk.chunk).dirty = True
-            cachedChunk.HeightMap = None
-            Py_DECREF(<object>cachedChunk.chunk)
-            cachedChunk.chunk = NULL
+        self.releaseChunks()
 
     # ---
 
@@ -236,13 +380,9 @@ cdef class RelightCtx(object):
         if section is NULL:
             return 0
         if self._useBlockLight:
-            return section.BlockLight[<unsigned int>(y & 0xf),
-                                      <unsigned int>(z & 0xf),
-                                      <unsigned int>(x & 0xf)]
+            return section.BlockLight[cell_index(x, y, z)]
         else:
-            return section.SkyLight[<unsigned int>(y & 0xf),
-                                      <unsigned int>(z & 0xf),
-                                      <unsigned int>(x & 0xf)]
+            return section.SkyLight[cell_index(x, y, z)]
 
 
     cdef void setBlockLight(self, int x, int y, int z, char value):
@@ -251,13 +391,9 @@ cdef class RelightCtx(object):
             return
         section.dirty = 1
         if self._useBlockLight:
-            section.BlockLight[<unsigned int>(y & 0xf),
-                               <unsigned int>(z & 0xf),
-                               <unsigned int>(x & 0xf)] = value
+            section.BlockLight[cell_index(x, y, z)] = value
         else:
-            section.SkyLight[<unsigned int>(y & 0xf),
-                               <unsigned int>(z & 0xf),
-                               <unsigned int>(x & 0xf)] = value
+            section.SkyLight[cell_index(x, y, z)] = value
 
 
     cdef unsigned char getBlockBrightness(self, int x, int y, int z):
@@ -265,9 +401,7 @@ cdef class RelightCtx(object):
         if section is NULL:
             return 0
 
-        cdef unsigned short blockID = section.Blocks[<unsigned int>(y & 0xf),
-                                                     <unsigned int>(z & 0xf),
-                                                     <unsigned int>(x & 0xf)]
+        cdef unsigned short blockID = section.Blocks[cell_index(x, y, z)]
         cdef char value = self.brightness[blockID]
         return value
 
@@ -276,15 +410,129 @@ cdef class RelightCtx(object):
         if section is NULL:
             return 15
 
-        cdef unsigned short blockID = section.Blocks[<unsigned int>(y & 0xf),
-                                                     <unsigned int>(z & 0xf),
-                                                     <unsigned int>(x & 0xf)]
+        cdef unsigned short blockID = section.Blocks[cell_index(x, y, z)]
         return self.opacity[blockID]
 
     cdef unsigned char getBlockEffectiveOpacity(self, int x, int y, int z):
         return max(<unsigned char>1, # truncation warning
                    self.getBlockOpacity(x, y, z))
 
+cdef struct coord:
+    int x, y, z
+
+ctypedef pair[coord, int] toScan_t
+
+cdef inline coord neighbor(coord c, int i):
+    if i == 0:
+        c.x -= 1
+    elif i == 1:
+        c.x += 1
+    elif i == 2:
+        c.y -= 1
+    elif i == 3:
+        c.y += 1
+    elif i == 4:
+        c.z -= 1
+    else:
+        c.z += 1
+    return c
+
+# Batch updates run in two passes. The fade pass darkens every cell whose light may have come from a
+# cell that was darkened, starting from the changed cells, and remembers the brighter cells at the
+# edge of the darkened area. The spread pass then pushes light outward from those cells, from the
+# changed cells, and from any light sources that were darkened.
+#
+# The spread pass keeps one queue per light level and empties the brightest queue first, so each cell
+# is spread from only once, at its final light level. Queue entries whose cell has since been given
+# a different light level are skipped, which takes the place of a set of visited cells.
+
+cdef void spreadLight(RelightCtx ctx, vector[vector[coord]] & toSpread):
+    cdef int level, i
+    cdef short adjacentLight, newLight
+    cdef coord c, n
+
+    for level in range(15, 0, -1):
+        while not toSpread[level].empty():
+            c = toSpread[level].back()
+            toSpread[level].pop_back()
+            if ctx.getBlockLight(c.x, c.y, c.z) != level:
+                continue
+            IF OUTPUT_STATS:
+                ctx.spreadCount += 1
+
+            for i in range(6):
+                n = neighbor(c, i)
+                adjacentLight = ctx.getBlockLight(n.x, n.y, n.z)
+                newLight = level - ctx.getBlockEffectiveOpacity(n.x, n.y, n.z)
+                # If the adjacent cell already has the "correct" light value, stop.
+                if newLight > adjacentLight:
+                    ctx.setBlockLight(n.x, n.y, n.z, <char>newLight)
+                    toSpread[newLight].push_back(n)
+
+
+cdef void fadeLight(RelightCtx ctx, deque[toScan_t] & toFade,
+                    vector[vector[coord]] & toSpread, vector[coord] & fadedSources):
+    # Cells in `toFade` must already be darkened. Each entry holds the light the cell had before.
+    cdef int i, previousLight
+    cdef short adjacentLight
+    cdef coord c, n
+    cdef toScan_t this_toScan
+
+    while not toFade.empty():
+        this_toScan = toFade.front()
+        toFade.pop_front()
+        c = this_toScan.first
+        previousLight = this_toScan.second
+        IF OUTPUT_STATS:
+            ctx.fadeCount += 1
+
+        for i in range(6):
+            n = neighbor(c, i)
+            adjacentLight = ctx.getBlockLight(n.x, n.y, n.z)
+            if adjacentLight == 0:
+                continue
+            if adjacentLight < previousLight:
+                # Light may have come from this cell, so darken it too.
+                ctx.setBlockLight(n.x, n.y, n.z, 0)
+                toFade.push_back(toScan_t(n, adjacentLight))
+                if ctx._useBlockLight and ctx.getBlockBrightness(n.x, n.y, n.z):
+                    fadedSources.push_back(n)
+            else:
+                # Light comes from elsewhere, so spread it back into the darkened cells.
+                toSpread[adjacentLight].push_back(n)
+
+
+cdef char drawLight(RelightCtx ctx, int x, int y, int z):
+    # Return the brightest light that reaches this cell from an adjacent cell
+    cdef short opacity = ctx.getBlockEffectiveOpacity(x, y, z)
+    cdef short adjacentLight, light = 0
+    cdef coord c = [x, y, z]
+    cdef coord n
+    cdef int i
+    IF OUTPUT_STATS:
+        ctx.drawCount += 1
+    for i in range(6):
+        n = neighbor(c, i)
+        adjacentLight = ctx.getBlockLight(n.x, n.y, n.z) - opacity
+        if adjacentLight > light:
+            light = adjacentLight
+    return <char>light
+
+
+cdef void queueLight(RelightCtx ctx, vector[vector[coord]] & toSpread, coord c, char light):
+    # Set the cell's light and queue it for spreading, if `light` is brighter than it is now.
+    if light > ctx.getBlockLight(c.x, c.y, c.z):
+        ctx.setBlockLight(c.x, c.y, c.z, light)
+        toSpread[light].push_back(c)
+
+
+cdef void fadeChangedCells(RelightCtx ctx, coord c, deque[toScan_t] & toFade):
+    cdef char previousLight = ctx.getBlockLight(c.x, c.y, c.z)
+    if previousLight > 0:
+        ctx.setBlockLight(c.x, c.y, c.z, 0)
+        toFade.push_back(toScan_t(c, previousLight))
+
+
 cdef updateSkyLight(RelightCtx ctx,
                      cnp.ndarray[ndim=1, dtype=int] ax,
                      cnp.ndarray[ndim=1, dtype=int] ay,
@@ -292,12 +540,15 @@ cdef updateSkyLight(RelightCtx ctx,
     
     cdef ssize_t i, n
     cdef chunk_key_t k
-    cdef int x, y, z, y2, h, oldH, newH, oldLight
+    cdef int x, y, z, y2, h, oldH
     cdef map[chunk_key_t, int] newHeights
     cdef coord c
 
-    cdef deque[coord] litCoords
-    cdef deque[coord] dimCoords
+    cdef deque[toScan_t] toFade
+    cdef vector[vector[coord]] toSpread
+    cdef vector[coord] litCoords
+    cdef vector[coord] fadedSources
+    toSpread.resize(16)
 
     cdef pair[chunk_key_t, int] p
 
@@ -333,9 +584,11 @@ cdef updateSkyLight(RelightCtx ctx,
                     if ctx.getBlockOpacity(x, y2, z):
                         newHeights[k] = y2 + 1
                         break
+                else:
+                    newHeights[k] = 0
 
-    # Scan newHeights for columns whose height changed, and queue the appropriate
-    # lighting updates for columns that shifted up or down.
+    # Scan newHeights for columns whose height changed. Cells in columns that shifted up
+    # are darkened now, and cells in columns that shifted down are lit after fading.
     for p in newHeights:
         k = p.first
         h = p.second
@@ -348,18 +601,7 @@ cdef updateSkyLight(RelightCtx ctx,
             # Column shifted up - blocks in changed segment reduced light level
             for y2 in range(oldH, h):
                 c.y = y2
-                dimCoords.push_back(c)
-            # Translucent blocks below changed segment also reduced light level
-            for y2 in range(oldH, -1, -1):
-                c.y = y2
-                dimCoords.push_back(c)
-                if ctx.getBlockLight(c.x, c.y, c.z) == 0:
-                    break
-            # Blocks above column may be in a newly created section.
-            # This is a shitty, shitty answer. FIXME FIXME FIXME.
-            c.y = h
-            ctx.setBlockLight(c.x, c.y, c.z, 15)
-            litCoords.push_back(c)
+                fadeChangedCells(ctx, c, toFade)
             IF OUTPUT_STATS:
                 ctx.raisedColumns += 1
 
@@ -367,9 +609,7 @@ cdef updateSkyLight(RelightCtx ctx,
             # Column shifted down - blocks in changed segment increased light level
             for y2 in range(h, oldH):
                 c.y = y2
-                ctx.setBlockLight(c.x, c.y, c.z, 15)
                 litCoords.push_back(c)
-
             IF OUTPUT_STATS:
                 ctx.loweredColumns += 1
 
@@ -377,245 +617,108 @@ cdef updateSkyLight(RelightCtx ctx,
             # Update chunk height map
             ctx.setHeightMap(x, z, h)
 
-    # Find all blocks below the changed column heights that have themselves changed, and
-    # draw light from adjacent chunks.
-
+    # Blocks below the column heights that have themselves changed may have become more opaque.
     for i in range(n):
-        x = ax[i]
-        y = ay[i]
-        z = az[i]
-        k = chunk_key(x, z)
-        h = newHeights[k]
-        if y < h:  # and (x & 0xF == 0)?
-            drawLight(ctx, x, y, z)
-            spreadLight(ctx, x, y, z)
+        c.x = ax[i]
+        c.y = ay[i]
+        c.z = az[i]
+        if c.y < newHeights[chunk_key(c.x, c.z)]:
+            fadeChangedCells(ctx, c, toFade)
 
+    fadeLight(ctx, toFade, toSpread, fadedSources)
 
-    #print("Dimming %d, brightening %d" % (dimCoords.size(), litCoords.size()))
-    for c in dimCoords:
-        oldLight = ctx.getBlockLight(c.x, c.y, c.z)
-        ctx.setBlockLight(c.x, c.y, c.z, 0)
-        drawLight(ctx, c.x, c.y, c.z)
-        fadeLight(ctx, c.x, c.y, c.z, oldLight)
-
-    # lots of repeated work here
     for c in litCoords:
-        spreadLight(ctx, c.x, c.y, c.z)
-
-    ctx.useBlockLight()
-
-def updateLightsByCoord(dim, x, y, z):
-    if not dim.hasLights:
-        return
-
-    x = np.asarray(x, 'i4').ravel()
-    y = np.asarray(y, 'i4').ravel()
-    z = np.asarray(z, 'i4').ravel()
-    cdef cnp.ndarray[ndim=1, dtype=int] ax = x
-    cdef cnp.ndarray[ndim=1, dtype=int] ay = y
-    cdef cnp.ndarray[ndim=1, dtype=int] az = z
-    cdef size_t i
-
+        queueLight(ctx, toSpread, c, 15)
 
-    if not (x.shape == y.shape == z.shape):
-        raise ValueError("All coord arrays must be the same size. (No broadcasting.)")
-
-    ctx = RelightCtx(dim)
-
-    if dim.hasSkyLight:
-        updateSkyLight(ctx, ax, ay, az)
+    # Blocks above the column heights are lit by the sky, and may be in a newly created
+    # section. Blocks below draw light from adjacent blocks.
+    for i in range(n):
+        c.x = ax[i]
+        c.y = ay[i]
+        c.z = az[i]
+        if c.y >= newHeights[chunk_key(c.x, c.z)]:
+            queueLight(ctx, toSpread, c, 15)
+        else:
+            queueLight(ctx, toSpread, c, drawLight(ctx, c.x, c.y, c.z))
 
-    for i in range(<size_t>len(ax)):
-        updateLights(ctx, ax[i], ay[i], az[i])
+    spreadLight(ctx, toSpread)
 
+    ctx.useBlockLight()
 
-def updateLightsInSelection(dim, selection):
-    ctx = RelightCtx(dim)
-    for x, y, z in selection.positions:
-        updateLights(ctx, x, y, z)
 
-cdef void updateLights(RelightCtx ctx, int x, int y, int z):
-    cdef char previousLight = ctx.getBlockLight(x, y, z)
+cdef updateBlockLight(RelightCtx ctx,
+                      cnp.ndarray[ndim=1, dtype=int] ax,
+                      cnp.ndarray[ndim=1, dtype=int] ay,
+                      cnp.ndarray[ndim=1, dtype=int] az):
+    cdef ssize_t i, n = ax.shape[0]
+    cdef coord c
     cdef char light
-    ctx.setBlockLight(x, y, z, ctx.getBlockBrightness(x, y, z))
-
-    # should be able to often skip this if we can get block's previous opacity in here... bluh
-    drawLight(ctx, x, y, z)
-    light = ctx.getBlockLight(x, y, z)
-
-    if previousLight < light:
-        spreadLight(ctx, x, y, z)
 
-    if previousLight > light:
-        fadeLight(ctx, x, y, z, previousLight)
+    cdef deque[toScan_t] toFade
+    cdef vector[vector[coord]] toSpread
+    cdef vector[coord] fadedSources
+    toSpread.resize(16)
 
-cdef void drawLight(RelightCtx ctx, int x, int y, int z):
-    cdef short opacity = ctx.getBlockEffectiveOpacity(x, y, z)
-    cdef short adjacentLight
-    cdef int nx, ny, nz
-    IF OUTPUT_STATS:
-        ctx.drawCount += 1
-    cdef int i
-    for i in range(6):
-        if i == 0:
-            nx = x - 1
-        elif i == 1:
-            nx = x + 1
-        else:
-            nx = x
-        if i == 2:
-            ny = y - 1
-        elif i == 3:
-            ny = y + 1
-        else:
-            ny = y
-        if i == 4:
-            nz = z - 1
-        elif i == 5:
-            nz = z + 1
-        else:
-            nz = z
-
-        adjacentLight = ctx.getBlockLight(nx, ny, nz)
-        if adjacentLight - opacity > ctx.getBlockLight(x, y, z):
-            ctx.setBlockLight(x, y, z, adjacentLight - opacity)
-
-cdef void spreadLight(RelightCtx ctx, int x, int y, int z):
-    cdef short light = ctx.getBlockLight(x, y, z)
-    if light <= 0:
-        return
-    IF OUTPUT_STATS:
-        ctx.spreadCount += 1
-
-    cdef int nx, ny, nz
-    cdef short adjacentLight, adjacentOpacity, newLight
-
-    cdef int i
-    for i in range(6):
-        if i == 0:
-            nx = x - 1
-        elif i == 1:
-            nx = x + 1
-        else:
-            nx = x
-        if i == 2:
-            ny = y - 1
-        elif i == 3:
-            ny = y + 1
-        else:
-            ny = y
-        if i == 4:
-            nz = z - 1
-        elif i == 5:
-            nz = z + 1
-        else:
-            nz = z
+    ctx.useBlockLight()
 
-        adjacentLight = ctx.getBlockLight(nx, ny, nz)
-        adjacentOpacity = ctx.getBlockEffectiveOpacity(nx, ny, nz)
-        newLight = light - adjacentOpacity
-        # If the adjacent cell already has the "correct" light value, stop.
-        if newLight > adjacentLight:
-            ctx.setBlockLight(nx, ny, nz, <char>newLight)
-            spreadLight(ctx, nx, ny, nz)
+    # Darken all changed cells at once, so light from a changed cell is never
+    # spread into another changed cell that is then faded.
+    for i in range(n):
+        c.x = ax[i]
+        c.y = ay[i]
+        c.z = az[i]
+        fadeChangedCells(ctx, c, toFade)
 
+    fadeLight(ctx, toFade, toSpread, fadedSources)
 
-cdef void fadeLight(RelightCtx ctx, int x, int y, int z, char previousLight):
-    IF OUTPUT_STATS:
-        ctx.fadeCount += 1
-    cdef set[coord] fadedCells = findFadedCells(ctx, x, y, z, previousLight)
-    cdef coord this_coord
-    for this_coord in fadedCells:
-        ctx.setBlockLight(this_coord.x,
-                          this_coord.y,
-                          this_coord.z,
-                          ctx.getBlockBrightness(x, y, z))
-        # dim.setBlock(x, y, z, "glass")
-    for this_coord in fadedCells:
-        drawLight(ctx,
-                  this_coord.x,
-                  this_coord.y,
-                  this_coord.z,
-                  )
-    for this_coord in fadedCells:
-        spreadLight(ctx,
-                    this_coord.x,
-                    this_coord.y,
-                    this_coord.z,
-                    )
+    for c in fadedSources:
+        queueLight(ctx, toSpread, c, ctx.getBlockBrightness(c.x, c.y, c.z))
 
-cdef struct coord:
-    int x, y, z
+    for i in range(n):
+        c.x = ax[i]
+        c.y = ay[i]
+        c.z = az[i]
+        light = max(<char>ctx.getBlockBrightness(c.x, c.y, c.z), drawLight(ctx, c.x, c.y, c.z))
+        queueLight(ctx, toSpread, c, light)
 
-cdef bool coord_operator_less "operator<"(const coord & lhs, const coord & rhs):
-    # warning: forcing 'int' to 'bool'
-    # cython's temp type for BinOpNode is 'int'
-    if lhs.x < rhs.x:
-        return True
-    elif lhs.x > rhs.x:
-        return False
-    elif lhs.y < rhs.y:
-        return True
-    elif lhs.y > rhs.y:
-        return False
-    elif lhs.z < rhs.z:
-        return True
-    else:
-        return False
+    spreadLight(ctx, toSpread)
 
 
-ctypedef pair[coord, int] toScan_t
+def updateLightsByCoord(dim, x, y, z):
+    if not dim.hasLights:
+        return
 
-cdef set[coord] findFadedCells(RelightCtx ctx, int x, int y, int z, char previousLight):
-    cdef set[coord] foundCells
-    cdef deque[toScan_t] toScan
-    cdef short adjacentLight, adjacentOpacity
-    cdef int i
-    cdef coord this_coord, n_coord
-    cdef toScan_t this_toScan
-    this_coord = [x, y, z]
-    toScan.push_back(toScan_t(this_coord, previousLight))
+    x = np.asarray(x, 'i4').ravel()
+    y = np.asarray(y, 'i4').ravel()
+    z = np.asarray(z, 'i4').ravel()
 
-    while 1:
-        if toScan.empty():
-            break
+    if not (x.shape == y.shape == z.shape):
+        raise ValueError("All coord arrays must be the same size. (No broadcasting.)")
 
-        this_toScan = toScan.front()
-        toScan.pop_front()
+    ctx = RelightCtx(dim)
 
-        this_coord = this_toScan.first
-        x, y, z = this_coord.x, this_coord.y, this_coord.z
-        previousLight = this_toScan.second
+    if dim.hasSkyLight:
+        updateSkyLight(ctx, x, y, z)
 
-        for i in range(6):
-            if i == 0:
-                n_coord.x = x - 1
-            elif i == 1:
-                n_coord.x = x + 1
-            else:
-                n_coord.x = x
-            if i == 2:
-                n_coord.y = y - 1
-            elif i == 3:
-                n_coord.y = y + 1
-            else:
-                n_coord.y = y            
-            if i == 4:
-                n_coord.z = z - 1
-            elif i == 5:
-                n_coord.z = z + 1
-            else:
-                n_coord.z = z                
+    updateBlockLight(ctx, x, y, z)
 
-            adjacentLight = ctx.getBlockLight(n_coord.x, n_coord.y, n_coord.z)
-            adjacentOpacity = ctx.getBlockEffectiveOpacity(n_coord.x, n_coord.y, n_coord.z)
 
-            if previousLight - adjacentOpacity <= 0:
+def updateLightsInSelection(dim, selection):
+    # Collect the coordinates of each section's selected cells with numpy rather than
+    # iterating selection.positions one cell at a time.
+    xs, ys, zs = [], [], []
+    for cx, cz in selection.chunkPositions():
+        for cy in selection.sectionPositions(cx, cz):
+            mask = selection.section_mask(cx, cy, cz)
+            if mask is None:
                 continue
+            y, z, x = mask.nonzero()
+            xs.append((x + (cx << 4)).astype('i4'))
+            ys.append((y + (cy << 4)).astype('i4'))
+            zs.append((z + (cz << 4)).astype('i4'))
 
-            if previousLight - adjacentOpacity == adjacentLight:
-                if foundCells.count(n_coord) == 0:
-                    toScan.push_back(toScan_t(n_coord, adjacentLight))
-                    foundCells.insert(n_coord)
+    if not xs:
+        return
 
-    return foundCells
+    ctx = RelightCtx(dim)
+    updateBlockLight(ctx, np.concatenate(xs), np.concatenate(ys), np.concatenate(zs))
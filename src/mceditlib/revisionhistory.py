@@ -8,6 +8,7 @@ import logging
 import os
 import shutil
 
+from mceditlib.anvil.chunkstore import ChunkStore, ChunkStoreWorldFolder
 from mceditlib.anvil.worldfolder import AnvilWorldFolder
 from mceditlib.exceptions import ChunkNotPresent
 from mceditlib.util.progress import rescaleProgress, enumProgress
@@ -121,6 +122,11 @@ class RevisionChanges(object):
         self.chunks = collections.defaultdict(set)  # dimName -> set[(cx, cz)]
         self.files = set()  # paths
 
+        # Subsets of `chunks` that are present in the new revision but not the old one, and vice versa.
+        # Only filled in by RevisionHistory.getRevisionChanges
+        self.addedChunks = collections.defaultdict(set)  # dimName -> set[(cx, cz)]
+        self.removedChunks = collections.defaultdict(set)  # dimName -> set[(cx, cz)]
+
     def __repr__(self):
         return "RevisionChanges(chunks=%r, files=%r)" % (self.chunks, self.files)
 
@@ -177,6 +183,10 @@ class RevisionHistory(object):
                 raise UndoFolderExists("Undo folder already exists for %s" % filename)
         os.makedirs(self.tempFolder)
 
+        # Chunks written to revisions are kept here instead of in each revision's region files, so
+        # identical chunk data is only stored once.
+        self.chunkStore = ChunkStore(os.path.join(self.tempFolder, "##MCEDIT.CHUNKS##"))
+
         self.rootFolder = AnvilWorldFolder(filename)
         self.rootNode = RevisionHistoryNode(self, self.rootFolder, None)
         self.rootNode.differences = RevisionChanges()
@@ -185,6 +195,12 @@ class RevisionHistory(object):
         self.IDcounter = 0
         self.nodes = [self.rootNode]
 
+        # Maps (cx, cz, dimName) to the newest node holding that chunk in the chain of `_indexNode`,
+        # or to None if the chunk is deleted or not present. Entries are added as chunks are looked up
+        # and updated as chunks are written or deleted.
+        self._chunkIndex = {}
+        self._indexNode = None
+
     def __repr__(self):
         return "RevisionHistory(%s)" % repr(self.rootFolder)
 
@@ -198,9 +214,11 @@ class RevisionHistory(object):
         :return:
         :rtype:
         """
+        self._invalidateChunkIndex()
         for node in self.nodes:
             node.worldFolder.close()
             self.nodes = []
+        self.chunkStore.close()
         log.info("Removing undo folder %r", self.tempFolder)
         shutil.rmtree(self.tempFolder)
         self.readonly = True
@@ -210,7 +228,7 @@ class RevisionHistory(object):
         self.IDcounter += 1
 
         filename = os.path.join(self.tempFolder, ID)
-        return AnvilWorldFolder(filename, create=True)
+        return ChunkStoreWorldFolder(filename, self.chunkStore, create=True)
 
     def createRevision(self, previousRevision=None):
         """
@@ -272,6 +290,10 @@ class RevisionHistory(object):
 
         newNode = RevisionHistoryNode(self, newFolder, previousNode)
         deadNodes = self.nodes[revisionIndex+1:]
+
+        # The new node's folder is empty, so it holds the same chunks as the previous node.
+        if self._indexNode is previousNode:
+            self._indexNode = newNode
         self.nodes = self.nodes[:revisionIndex+1]
         self.nodes.append(newNode)
 
@@ -282,6 +304,37 @@ class RevisionHistory(object):
 
         return newNode
 
+    # --- Chunk index ---
+
+    def _findChunk(self, node, cx, cz, dimName):
+        """
+        Return the newest node holding the given chunk in the given node's chain, or None if the chunk is
+        deleted or not present.
+        """
+        if node is not self._indexNode:
+            self._invalidateChunkIndex()
+            self._indexNode = node
+
+        key = cx, cz, dimName
+        try:
+            return self._chunkIndex[key]
+        except KeyError:
+            found = _locateChunk(node, key)
+            self._chunkIndex[key] = found
+            return found
+
+    def _updateChunkIndex(self, node, key, found):
+        if node is self._indexNode:
+            self._chunkIndex[key] = found
+        else:
+            # The node may be an older node in the index's chain, such as a revision written in the
+            # background after it was closed. Only this chunk's entry can change, so look it up again.
+            self._chunkIndex.pop(key, None)
+
+    def _invalidateChunkIndex(self):
+        self._chunkIndex.clear()
+        self._indexNode = None
+
     def closeRevision(self):
         self.getHead().readonly = True
 
@@ -296,7 +349,8 @@ class RevisionHistory(object):
         Return all changes that happened after oldNode up to and including those in newNode.
 
         Returns a RevisionChanges object that lists the chunks that changed by dimension name, and the files that
-        changed. It does not distinguish between files/chunks that are newly created, modified or deleted.
+        changed. Chunks present in newNode but not in oldNode are also listed in `addedChunks`, and chunks present
+        in oldNode but not in newNode are listed in `removedChunks`. Files are not checked for existence.
 
         :param oldNode: Index of the node to find changes after, or the node itself.
         :type oldNode: int | RevisionHistoryNode
@@ -314,11 +368,13 @@ class RevisionHistory(object):
             newIndex = self.nodes.index(newNode)
         else:
             newIndex = newNode
+            newNode = self.nodes[newIndex]
 
         if isinstance(oldNode, RevisionHistoryNode):
             oldIndex = self.nodes.index(oldNode)
         else:
             oldIndex = oldNode
+            oldNode = self.nodes[oldIndex]
 
         if oldIndex > newIndex:
             oldIndex, newIndex = newIndex, oldIndex
@@ -329,6 +385,18 @@ class RevisionHistory(object):
                 changes.chunks[dimName].update(chunks)
             changes.files.update(nodeChanges.files)
 
+        # Only the changed chunks can have been added or removed, so check just those instead of
+        # listing every chunk in both revisions.
+        for dimName, chunks in changes.chunks.iteritems():
+            for cx, cz in chunks:
+                key = cx, cz, dimName
+                inOld = _locateChunk(oldNode, key) is not None
+                inNew = _locateChunk(newNode, key) is not None
+                if inNew and not inOld:
+                    changes.addedChunks[dimName].add((cx, cz))
+                elif inOld and not inNew:
+                    changes.removedChunks[dimName].add((cx, cz))
+
         return changes
 
     def writeAllChanges(self, requestedRevision=None):
@@ -367,6 +435,9 @@ class RevisionHistory(object):
 
         maxprogress = 100
 
+        # Nodes are replaced and chunks are copied between folders without going through the nodes.
+        self._invalidateChunkIndex()
+
         if isinstance(requestedRevision, RevisionHistoryNode):
             requestedIndex = self.nodes.index(requestedRevision)
         elif requestedRevision is None:
@@ -389,14 +460,17 @@ class RevisionHistory(object):
                 copyTask = copyToFolderIter(self.rootFolder, orphanChainNode)
                 copyTask = rescaleProgress(copyTask, progress, progress + 20./len(orphanNodes))
                 for current, _, status in copyTask:
+                    self._invalidateChunkIndex()
                     yield current, maxprogress, status
 
             # Root node now replaces the orphan chain's tail in the history.
             # (the nodes ahead and behind of the root node should now point to this node)
             self.nodes[self.orphanChainIndex] = self.rootNode
             self.orphanChainIndex = None
+            self._invalidateChunkIndex()
             
         if requestedIndex == self.rootNodeIndex:
+            self.rootFolder.flush()
             return  # nothing to do
         elif requestedIndex < self.rootNodeIndex:
             # Nodes behind the root node in the history will be re-reverted and replaced
@@ -426,6 +500,7 @@ class RevisionHistory(object):
             copyTask = copyToFolderIter(self.rootFolder, currentNode, reverseNode)
             copyTask = rescaleProgress(copyTask, progress, progress + 80. / len(indexes))
             for current, _, status in copyTask:
+                self._invalidateChunkIndex()
                 yield current, maxprogress, status
 
             # xxx look ahead one or more nodes to skip some copies
@@ -438,6 +513,7 @@ class RevisionHistory(object):
             self.nodes[currentIndex - direction] = reverseNode
             self.nodes[currentIndex] = self.rootNode
             self.rootNodeIndex = currentIndex
+            self._invalidateChunkIndex()
 
             log.info("Root node now at index %d", currentIndex)
 
@@ -446,6 +522,23 @@ class RevisionHistory(object):
             currentNode.invalid = True
             shutil.rmtree(currentNode.worldFolder.filename, ignore_errors=True)
 
+        self.rootFolder.flush()
+
+
+def _locateChunk(node, key):
+    """
+    Walk the chain starting at the given node and return the newest node holding the chunk with the
+    given key, or None if the chunk is deleted or not present.
+    """
+    cx, cz, dimName = key
+    while node:
+        if key in node.deadChunks:
+            return None
+        if node.worldFolder.containsChunk(cx, cz, dimName):
+            return node
+        node = node.parentNode
+    return None
+
 
 def copyToFolder(destFolder, sourceNode, presaveNode=None):
     for status in copyToFolderIter(destFolder, sourceNode, presaveNode):
@@ -474,7 +567,8 @@ def copyToFolderIter(destFolder, sourceNode, reversionNode=None):
 
         if destFolder.containsChunk(cx, cz, dimName):
             if reversionFolder and not reversionFolder.containsChunk(cx, cz, dimName):
-                reversionFolder.writeChunkBytes(cx, cz, dimName, destFolder.readChunkBytes(cx, cz, dimName))
+                data, fmt = destFolder.readChunkCompressed(cx, cz, dimName)
+                reversionFolder.writeChunkCompressed(cx, cz, dimName, data, fmt)
             destFolder.deleteChunk(cx, cz, dimName)
 
     # Write new and modified chunks
@@ -490,10 +584,13 @@ def copyToFolderIter(destFolder, sourceNode, reversionNode=None):
 
             if reversionFolder and not reversionFolder.containsChunk(cx, cz, dimName):
                 if destFolder.containsChunk(cx, cz, dimName):
-                    reversionFolder.writeChunkBytes(cx, cz, dimName, destFolder.readChunkBytes(cx, cz, dimName))
+                    data, fmt = destFolder.readChunkCompressed(cx, cz, dimName)
+                    reversionFolder.writeChunkCompressed(cx, cz, dimName, data, fmt)
                 else:  # new chunk
                     reversionNode.deleteChunk(cx, cz, dimName)
-            destFolder.writeChunkBytes(cx, cz, dimName, sourceFolder.readChunkBytes(cx, cz, dimName))
+            # Copy without recompressing, so the chunk data is identical and can be shared by the chunk store
+            data, fmt = sourceFolder.readChunkCompressed(cx, cz, dimName)
+            destFolder.writeChunkCompressed(cx, cz, dimName, data, fmt)
 
     # Remove deleted files
     for delProgress, path in enumProgress(sourceNode.deadFiles, 80, 10):
@@ -591,15 +688,7 @@ class RevisionHistoryNode(object):
         """
         if self.invalid:
             raise RuntimeError("Accessing invalid node: %r" % self)
-        node = self
-        while node:
-            if (cx, cz, dimName) in node.deadChunks:
-                return False
-            if node.worldFolder.containsChunk(cx, cz, dimName):
-                return True
-
-            node = node.parentNode
-        return False
+        return self.history._findChunk(self, cx, cz, dimName) is not None
 
     def chunkPositions(self, dimName):
         if self.invalid:
@@ -640,6 +729,12 @@ class RevisionHistoryNode(object):
             node = node.parentNode
         return count
 
+    def flush(self):
+        """
+        Write any pending changes to this revision's region files.
+        """
+        self.worldFolder.flush()
+
     def chunkPositionsThisRevision(self, dimName):
         if self.invalid:
             raise RuntimeError("Accessing invalid node: %r" % self)
@@ -653,13 +748,19 @@ class RevisionHistoryNode(object):
             raise RuntimeError("Accessing invalid node: %r" % self)
         if self.readonly:
             raise IOError("Storage node is read-only!")
+        key = cx, cz, dimName
         if self.worldFolder.containsChunk(cx, cz, dimName):
             self.worldFolder.deleteChunk(cx, cz, dimName)
+            # Older revisions may still hold the chunk
+            needsTombstone = _locateChunk(self.parentNode, key) is not None
         else:
+            needsTombstone = True
+        if needsTombstone:
             with open(self._deadChunksFile(), "w") as f:
                 f.write("%d, %d, %s\n" % (cx, cz, dimName))
                 f.close()
-            self.deadChunks.add((cx, cz, dimName))
+            self.deadChunks.add(key)
+        self.history._updateChunkIndex(self, key, None)
 
     def loadDeletedChunks(self):
         """
@@ -682,20 +783,22 @@ class RevisionHistoryNode(object):
     def readChunkBytes(self, cx, cz, dimName):
         if self.invalid:
             raise RuntimeError("Accessing invalid node: %r" % self)
-        node = self
-        while node:
-            # Ask RevisionHistory for most recent node containing this chunk?
-            if (cx, cz, dimName) in node.deadChunks:
-                raise ChunkNotPresent((cx, cz), "Chunk was deleted")
-            if node.worldFolder.containsChunk(cx, cz, dimName):
-                data = node.worldFolder.readChunkBytes(cx, cz, dimName)
-                return data
-            if node is self.history.rootNode:
-                break
+        node = self.history._findChunk(self, cx, cz, dimName)
+        if node is None:
+            raise ChunkNotPresent((cx, cz))
+        return node.worldFolder.readChunkBytes(cx, cz, dimName)
 
-            node = node.parentNode
-
-        raise ChunkNotPresent((cx, cz))
+    def readChunkCompressed(self, cx, cz, dimName):
+        """
+        Read a chunk's data from the most recent revision containing that chunk, without decompressing it.
+        Returns a (data, fmt) tuple as returned by RegionFile.readChunkCompressed.
+        """
+        if self.invalid:
+            raise RuntimeError("Accessing invalid node: %r" % self)
+        node = self.history._findChunk(self, cx, cz, dimName)
+        if node is None:
+            raise ChunkNotPresent((cx, cz))
+        return node.worldFolder.readChunkCompressed(cx, cz, dimName)
 
     def writeChunkBytes(self, cx, cz, dimName, data):
         if self.invalid:
@@ -703,6 +806,33 @@ class RevisionHistoryNode(object):
         if self.readonly:
             raise IOError("Storage node is read-only!")
         self.worldFolder.writeChunkBytes(cx, cz, dimName, data)
+        self._chunkWritten((cx, cz, dimName))
+
+    def _chunkWritten(self, key):
+        self.deadChunks.discard(key)
+        self.history._updateChunkIndex(self, key, self)
+
+    def writeChunkCompressed(self, cx, cz, dimName, data, fmt):
+        """
+        Write chunk data that was already compressed in the given format, as returned by
+        RegionFile.readChunkCompressed.
+        """
+        if self.invalid:
+            raise RuntimeError("Accessing invalid node: %r" % self)
+        if self.readonly:
+            raise IOError("Storage node is read-only!")
+        self.worldFolder.writeChunkCompressed(cx, cz, dimName, data, fmt)
+        self._chunkWritten((cx, cz, dimName))
+
+    def writeClosedChunkCompressed(self, cx, cz, dimName, data, fmt):
+        """
+        Like writeChunkCompressed, but may be called after the node was made read-only, to finish writing
+        chunks that were saved to this revision in the background.
+        """
+        if self.invalid:
+            raise RuntimeError("Accessing invalid node: %r" % self)
+        self.worldFolder.writeChunkCompressed(cx, cz, dimName, data, fmt)
+        self._chunkWritten((cx, cz, dimName))
 
     # --- Regular files ---
 
@@ -17,6 +17,18 @@ def notclosing(f):
 def chunk_pos(x, z):
     return int(floor(x)) >> 4, int(floor(z)) >> 4
 
+def markChunkDirty(chunk, cy=None):
+    """
+    Mark a chunk dirty after changing section `cy`, or only data outside its sections such as the HeightMap or
+    Biomes if `cy` is None. Chunks that track changes by section only encode the changed sections when saved;
+    other chunks are simply marked dirty.
+    """
+    markDirty = getattr(chunk, "markDirty", None)
+    if markDirty is None:
+        chunk.dirty = True
+    else:
+        markDirty(cy)
+
 def exhaust(_iter):
     """
     Functions named ending in "Iter" return an iterable object that does
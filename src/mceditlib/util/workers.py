@@ -0,0 +1,72 @@
+"""
+    workers
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+log = logging.getLogger(__name__)
+
+# Number of threads in the shared worker pool. None uses one thread per CPU, and 0 disables the pool.
+_workerCount = None
+
+_pool = None
+
+
+def setWorkerCount(count):
+    """
+    Set the number of threads in the shared worker pool. Pass None to use one thread per CPU, or 0 to
+    disable the pool and do all work on the calling thread.
+
+    :type count: int | None
+    """
+    global _workerCount
+    _workerCount = count
+    closeWorkerPool()
+
+
+def getWorkerCount():
+    """
+    Return the number of threads the shared worker pool has or will have, or 0 if the pool is disabled.
+
+    :rtype: int
+    """
+    if _workerCount is not None:
+        return _workerCount
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def getWorkerPool():
+    """
+    Return the worker pool shared by mceditlib, creating it if needed. Returns None if the pool is disabled.
+
+    The workers are threads, so only work that releases the GIL (such as zlib compression and decompression)
+    will run in parallel.
+
+    :rtype: multiprocessing.pool.ThreadPool | None
+    """
+    global _pool
+    if _pool is None:
+        count = getWorkerCount()
+        if count == 0:
+            return None
+
+        log.info("Starting worker pool with %d threads", count)
+        _pool = ThreadPool(count)
+
+    return _pool
+
+
+def closeWorkerPool():
+    """
+    Stop the shared worker pool after all submitted work is finished.
+    """
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool.join()
+        _pool = None
@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 import collections
+import functools
 import logging
 import time
 import weakref
@@ -10,15 +11,18 @@ import re
 from mceditlib import cachefunc
 
 from mceditlib.block_copy import copyBlocksIter
+from mceditlib.blockaccessor import BlockAccessor
+from mceditlib.entityindex import EntityIndex
 from mceditlib.blocktypes import BlockType
 from mceditlib.nbtattr import NBTListProxy
 from mceditlib.operations.block_fill import FillBlocksOperation
 from mceditlib.operations.analyze import AnalyzeOperation
 from mceditlib.selection import BoundingBox
 from mceditlib.findadapter import findAdapter
-from mceditlib.multi_block import getBlocks, setBlocks
+from mceditlib.multi_block import getBlocks, setBlocks, coords_by_chunk, bucket_indexes
+from mceditlib import relight
 from mceditlib.schematic import createSchematic
-from mceditlib.util import displayName, chunk_pos, exhaust, matchEntityTags
+from mceditlib.util import displayName, chunk_pos, exhaust, matchEntityTags, markChunkDirty
 from mceditlib.util.lazyprop import weakrefprop
 from mceditlib.blocktypes import BlockType
 
@@ -27,6 +31,22 @@ log = logging.getLogger(__name__)
 DIM_NETHER = -1
 DIM_END = 1
 
+# Maximum number of chunks WorldEditorDimension.getChunks reads ahead of the chunk it is returning
+CHUNK_PREFETCH = 64
+
+# Default memory budget for cached chunk data, in bytes
+CHUNK_CACHE_BYTES = 512 * 1024 * 1024
+
+# Size assumed for cached chunk data that cannot estimate its own size
+DEFAULT_CHUNK_BYTES = 64 * 1024
+
+
+def _chunkDataSize(chunkData):
+    estimateSize = getattr(chunkData, "estimateSize", None)
+    if estimateSize is None:
+        return DEFAULT_CHUNK_BYTES
+    return estimateSize()
+
 _zeros = {}
 
 
@@ -66,22 +86,22 @@ class EntityListProxy(collections.MutableSequence):
             tagList[key] = [v.rootTag for v in value]
         else:
             tagList[key] = value.rootTag
-        self.chunk.dirty = True
+        self.chunk.entitiesChanged(self.attrName)
 
     def __delitem__(self, key):
         del getattr(self.chunk.chunkData, self.attrName)[key]
-        self.chunk.dirty = True
+        self.chunk.entitiesChanged(self.attrName)
 
     def __len__(self):
         return len(getattr(self.chunk.chunkData, self.attrName))
 
     def insert(self, index, value):
         getattr(self.chunk.chunkData, self.attrName).insert(index, value.rootTag)
-        self.chunk.dirty = True
+        self.chunk.entitiesChanged(self.attrName)
 
     def remove(self, value):
         getattr(self.chunk.chunkData, self.attrName).remove(value.rootTag)
-        self.chunk.dirty = True
+        self.chunk.entitiesChanged(self.attrName)
 
 class WorldEditorChunk(object):
     """
@@ -101,6 +121,7 @@ class WorldEditorChunk(object):
 
         self.Entities = EntityListProxy(self, "Entities", editor.adapter.EntityRef)
         self.TileEntities = EntityListProxy(self, "TileEntities", editor.adapter.TileEntityRef)
+        self._entityIndexes = {}
         #self.Entities = [editor.adapter.EntityRef(tag, self) for tag in chunkData.Entities]
         #self.TileEntities = [editor.adapter.TileEntityRef(tag, self) for tag in chunkData.TileEntities]
 
@@ -135,6 +156,17 @@ class WorldEditorChunk(object):
     @dirty.setter
     def dirty(self, val):
         self.chunkData.dirty = val
+        if val:
+            # Entities may have been moved through their refs
+            self._entityIndexes.clear()
+
+    def markDirty(self, cy=None):
+        """
+        Mark this chunk dirty after changing section `cy`, or only data outside its sections such as the
+        HeightMap, Biomes or entities if `cy` is None. Setting `dirty` instead causes every section to be
+        encoded again when the chunk is saved.
+        """
+        markChunkDirty(self.chunkData, cy)
 
     # --- Chunk attributes ---
 
@@ -164,17 +196,60 @@ class WorldEditorChunk(object):
     def TerrainPopulated(self, val):
         self.chunkData.TerrainPopulated = val
 
+    # --- Entities ---
+
+    def getEntityIndex(self, attrName):
+        """
+        Return the EntityIndex for this chunk's Entities or TileEntities, creating it if needed. The index
+        reads the entities' tags when it is first searched.
+
+        Parameters
+        ----------
+        attrName : str
+            "Entities" or "TileEntities"
+
+        Returns
+        -------
+        index : mceditlib.entityindex.EntityIndex
+        """
+        index = self._entityIndexes.get(attrName)
+        if index is None:
+            index = self._entityIndexes[attrName] = EntityIndex(getattr(self.chunkData, attrName), attrName)
+        return index
+
+    def entitiesChanged(self, attrName):
+        """
+        Mark this chunk dirty after changing its Entities or TileEntities list, and discard the list's
+        EntityIndex.
+        """
+        self._entityIndexes.pop(attrName, None)
+        self.markDirty()
+
+    def _appendEntity(self, attrName, ref):
+        getattr(self.chunkData, attrName).append(ref.rootTag)
+        index = self._entityIndexes.get(attrName)
+        if index is not None:
+            index.append(ref.rootTag)
+        self.markDirty()
+
+    def _removeEntity(self, attrName, ref):
+        tagList = getattr(self.chunkData, attrName)
+        i = tagList.index(ref.rootTag)
+        del tagList[i]
+        index = self._entityIndexes.get(attrName)
+        if index is not None:
+            index.remove(i)
+        self.markDirty()
+
     def addEntity(self, ref):
         if ref.chunk is self:
             return
-        self.chunkData.Entities.append(ref.rootTag)
+        self._appendEntity("Entities", ref)
         ref.chunk = self
-        self.dirty = True
 
     def removeEntity(self, ref):
-        self.chunkData.Entities.remove(ref.rootTag)
+        self._removeEntity("Entities", ref)
         ref.chunk = None
-        self.dirty = True
 
     def removeEntities(self, entities):
         for ref in entities:  # xxx O(n*m)
@@ -183,17 +258,15 @@ class WorldEditorChunk(object):
     def addTileEntity(self, ref):
         if ref.chunk is self:
             return
-        self.chunkData.TileEntities.append(ref.rootTag)
+        self._appendEntity("TileEntities", ref)
         ref.chunk = self
-        self.dirty = True
 
     def removeTileEntity(self, ref):
         if ref.chunk is not self:
             return
-        self.chunkData.TileEntities.remove(ref.rootTag)
+        self._removeEntity("TileEntities", ref)
         ref.chunk = None
         ref.rootTag = None
-        self.dirty = True
 
     @property
     def TileTicks(self):
@@ -238,8 +311,14 @@ class WorldEditor(object):
         # maps (cx, cz, dimName) tuples to WorldEditorChunk
         self._loadedChunks = weakref.WeakValueDictionary()
 
-        # caches ChunkData from adapter
-        self._chunkDataCache = cachefunc.lru_cache_object(self._getChunkDataRaw, 1000)
+        # Weak references to loaded WorldEditorChunks, and the keys of chunks released since the chunk cache
+        # last measured them. Sections unpacked by editing a chunk are only counted once it is released.
+        self._loadedChunkRefs = {}
+        self._releasedChunks = set()
+
+        # caches ChunkData from adapter, limited by the estimated memory used by the cached chunks
+        self._chunkDataCache = cachefunc.lru_cache_object(self._getChunkDataRaw, None,
+                                                          maxbytes=CHUNK_CACHE_BYTES, sizeof=_chunkDataSize)
         self._chunkDataCache.should_decache = self._shouldUnloadChunkData
         self._chunkDataCache.will_decache = self._willUnloadChunkData
 
@@ -276,8 +355,38 @@ class WorldEditor(object):
     # --- Debug ---
 
     def setCacheLimit(self, size):
+        """
+        Limit the number of chunks kept in the chunk cache. Pass None to limit the cache by memory use only.
+
+        :type size: int | None
+        """
         self._chunkDataCache.setCacheLimit(size)
 
+    def setCacheByteLimit(self, maxbytes):
+        """
+        Limit the estimated memory used by the chunks kept in the chunk cache, in bytes. Pass None to limit the
+        cache by number of chunks only.
+
+        :type maxbytes: int | None
+        """
+        self._chunkDataCache.setByteLimit(maxbytes)
+
+    def getCacheStats(self):
+        """
+        Return the chunk cache's statistics as a dict with the keys "chunks", "bytes", "hits", "misses"
+        and "evictions".
+
+        :rtype: dict
+        """
+        cache = self._chunkDataCache
+        return {
+            "chunks": len(cache),
+            "bytes": cache.currentBytes,
+            "hits": cache.hits,
+            "misses": cache.misses,
+            "evictions": cache.evictions,
+        }
+
     # --- Undo/redo ---
 
     def requireRevisions(self):
@@ -320,6 +429,34 @@ class WorldEditor(object):
         self.adapter.closeRevision()
         log.info("Closed revision %d", self.currentRevision)
 
+    def commitUndoAsync(self, revisionInfo=None):
+        """
+        Like commitUndo, but returns without waiting for the modified chunks to be written. The chunks are
+        serialized and then compressed and written in the background, so editing can continue immediately and
+        beginUndo may be called to open the next revision.
+
+        Adapters without background writing do a normal commitUndo.
+
+        :param revisionInfo: May be supplied to record metadata for this undo
+        :type revisionInfo: object | None
+        """
+        if not hasattr(self.adapter, "writeChunksAsync"):
+            self.commitUndo(revisionInfo)
+            return
+
+        self.adapter.setRevisionInfo(revisionInfo)
+        self._updatePendingLights()
+        dirtyPlayers = self._savePlayers()
+        dirtyChunks = self._listDirtyChunkData()
+        for chunkData in dirtyChunks:
+            chunkData.dirty = False
+        self.adapter.writeChunksAsync(dirtyChunks)
+        self.adapter.syncToDisk()
+        log.info(u"Started saving %d chunks, saved %d players", len(dirtyChunks), dirtyPlayers)
+
+        self.adapter.closeRevision()
+        log.info("Closed revision %d", self.currentRevision)
+
     def undoRevisions(self):
         """
         Iterate through all revisions and return (index, revisionInfo) tuples. revisionInfo is the info stored with
@@ -355,8 +492,11 @@ class WorldEditor(object):
                 self._chunkDataCache.decache(cx, cz, dimName)
                 self._loadedChunks.pop((cx, cz, dimName), None)
 
-        # xxx slow, scan changes for chunks and check if they are added/removed
-        self._allChunks = None
+        if self._allChunks is not None:
+            for dimName, chunkPositions in changes.addedChunks.iteritems():
+                self._allChunks[dimName].update(chunkPositions)
+            for dimName, chunkPositions in changes.removedChunks.iteritems():
+                self._allChunks[dimName].difference_update(chunkPositions)
 
     def getRevisionChanges(self, oldIndex, newIndex):
         return self.adapter.getRevisionChanges(oldIndex, newIndex)
@@ -372,24 +512,61 @@ class WorldEditor(object):
         :return:
         :rtype:
         """
+        self._updatePendingLights()
+        dirtyPlayers = self._savePlayers()
+
+        dirtyChunkCount = 0
+        if hasattr(self.adapter, "writeChunks"):
+            dirtyChunks = self._listDirtyChunkData()
+
+            def _markClean():
+                # Chunks are marked clean before they are serialized, so changes made while
+                # the write is in progress will mark them dirty again.
+                for chunkData in dirtyChunks:
+                    chunkData.dirty = False
+                    yield chunkData
+
+            for dirtyChunkCount, _ in enumerate(self.adapter.writeChunks(_markClean()), 1):
+                yield dirtyChunkCount, len(dirtyChunks), "Writing modified chunks"
+            self._compactUnloadedChunks(dirtyChunks)
+        else:
+            for i, (cx, cz, dimName) in enumerate(self._chunkDataCache):
+                yield i, len(self._chunkDataCache), "Writing modified chunks"
+
+                chunkData = self._chunkDataCache(cx, cz, dimName)
+                if chunkData.dirty:
+                    dirtyChunkCount += 1
+                    self.adapter.writeChunk(chunkData)
+                    chunkData.dirty = False
+        self.adapter.syncToDisk()
+        log.info(u"Saved %d chunks and %d players", dirtyChunkCount, dirtyPlayers)
+
+    def _updatePendingLights(self):
+        for dim in self.dimensions.itervalues():
+            dim.updatePendingLights()
+
+    def _savePlayers(self):
         dirtyPlayers = 0
         for player in self.playerCache.itervalues():
             # xxx should be in adapter?
             if player.dirty:
                 dirtyPlayers += 1
                 player.save()
-
-        dirtyChunkCount = 0
-        for i, (cx, cz, dimName) in enumerate(self._chunkDataCache):
-            yield i, len(self._chunkDataCache), "Writing modified chunks"
-
-            chunkData = self._chunkDataCache(cx, cz, dimName)
-            if chunkData.dirty:
-                dirtyChunkCount += 1
-                self.adapter.writeChunk(chunkData)
-                chunkData.dirty = False
-        self.adapter.syncToDisk()
-        log.info(u"Saved %d chunks and %d players", dirtyChunkCount, dirtyPlayers)
+        return dirtyPlayers
+
+    def _compactUnloadedChunks(self, chunks):
+        # Sections unpacked by editing can be packed again once no WorldEditorChunk refers to them
+        for chunkData in chunks:
+            if (chunkData.cx, chunkData.cz, chunkData.dimName) in self._loadedChunks:
+                continue
+            compactSections = getattr(chunkData, "compactSections", None)
+            if compactSections is not None:
+                compactSections()
+                self._chunkDataCache.resize(chunkData.cx, chunkData.cz, chunkData.dimName)
+
+    def _listDirtyChunkData(self):
+        chunks = [self._chunkDataCache(*key) for key in list(self._chunkDataCache)]
+        return [chunkData for chunkData in chunks if chunkData.dirty]
 
     def saveChanges(self):
         exhaust(self.saveChangesIter())
@@ -403,6 +580,24 @@ class WorldEditor(object):
         for status in self.adapter.saveChangesIter():
             yield status
 
+    def compactRegionFiles(self):
+        exhaust(self.compactRegionFilesIter())
+
+    def compactRegionFilesIter(self):
+        """
+        Rewrite the world's region files to reclaim the space left unused by edits. Formats without
+        region files do nothing.
+
+        :return: Progress information as (current, max, status) tuples
+        """
+        if self.readonly:
+            raise IOError("World is opened read only.")
+        if not hasattr(self.adapter, "compactRegionFilesIter"):
+            return
+
+        for status in self.adapter.compactRegionFilesIter():
+            yield status
+
     def stealSessionLock(self):
         if hasattr(self.adapter, "stealSessionLock"):
             self.adapter.stealSessionLock()
@@ -420,6 +615,8 @@ class WorldEditor(object):
 
         self._allChunks = None
         self._loadedChunks.clear()
+        self._loadedChunkRefs.clear()
+        self._releasedChunks.clear()
         self._chunkDataCache.clear()
 
     # --- World limits ---
@@ -470,11 +667,54 @@ class WorldEditor(object):
             self.preloadChunkPositions()
         return self._allChunks[dimName].__iter__()
 
+    def prefetchChunks(self, chunkPositions, dimName):
+        """
+        Read the chunks at the given positions into the chunk cache, using the adapter's batched reader if
+        it has one. Chunks that are already cached or not present are skipped.
+
+        :param chunkPositions: Positions of chunks to read
+        :type chunkPositions: list[(int, int)]
+        :param dimName: Name of dimension
+        :type dimName: unicode
+        """
+        if not hasattr(self.adapter, "readChunks"):
+            return
+
+        chunkPositions = [(cx, cz) for cx, cz in chunkPositions
+                          if (cx, cz, dimName) not in self._chunkDataCache
+                          and self.containsChunk(cx, cz, dimName)]
+        if len(chunkPositions) < 2:
+            return
+
+        self._measureReleasedChunks()
+        for chunkData in self.adapter.readChunks(chunkPositions, dimName):
+            self._watchChunkDataSize(chunkData)
+            self._chunkDataCache.store(chunkData, chunkData.cx, chunkData.cz, dimName)
+
     def _getChunkDataRaw(self, cx, cz, dimName):
         """
         Wrapped by cachefunc.lru_cache in __init__
         """
-        return self.adapter.readChunk(cx, cz, dimName)
+        chunkData = self.adapter.readChunk(cx, cz, dimName)
+        self._watchChunkDataSize(chunkData)
+        return chunkData
+
+    def _watchChunkDataSize(self, chunkData):
+        if hasattr(chunkData, "sizeChanged"):
+            chunkData.sizeChanged = self._chunkDataSizeChanged
+
+    def _chunkDataSizeChanged(self, chunkData):
+        self._chunkDataCache.resize(chunkData.cx, chunkData.cz, chunkData.dimName)
+
+    def _chunkReleased(self, key, ref):
+        # Called during garbage collection, so the chunk is measured later by _measureReleasedChunks
+        if self._loadedChunkRefs.get(key) is ref:
+            del self._loadedChunkRefs[key]
+            self._releasedChunks.add(key)
+
+    def _measureReleasedChunks(self):
+        while self._releasedChunks:
+            self._chunkDataCache.resize(*self._releasedChunks.pop())
 
     def _shouldUnloadChunkData(self, key):
         return key not in self._loadedChunks
@@ -495,6 +735,7 @@ class WorldEditor(object):
         if chunk is not None:
             return chunk
 
+        self._measureReleasedChunks()
         startTime = time.time()
         chunkData = self._chunkDataCache(cx, cz, dimName)
         chunk = WorldEditorChunk(chunkData, self)
@@ -505,7 +746,9 @@ class WorldEditor(object):
                      (cx, cz), duration, len(chunk.Entities), len(chunk.TileEntities),
                      len(chunk.rootTag.get("TileTicks", ())))
 
-        self._loadedChunks[cx, cz, dimName] = chunk
+        key = cx, cz, dimName
+        self._loadedChunks[key] = chunk
+        self._loadedChunkRefs[key] = weakref.ref(chunk, functools.partial(self._chunkReleased, key))
 
         self.recentChunks.append(chunk)
         return chunk
@@ -555,7 +798,9 @@ class WorldEditor(object):
             if self._allChunks is not None:
                 self._allChunks[dimName].add((cx, cz))
 
+            self._measureReleasedChunks()
             chunk = self.adapter.createChunk(cx, cz, dimName)
+            self._watchChunkDataSize(chunk)
             self._chunkDataCache.store(chunk, cx, cz, dimName)
 
     def deleteChunk(self, cx, cz, dimName):
@@ -746,6 +991,9 @@ class WorldEditorDimension(object):
         self.worldEditor = worldEditor
         self.adapter = worldEditor.adapter
         self.dimName = dimName
+        self.deferLighting = False
+        # (cx, cy, cz) -> boolean array of cells in that section waiting for a lighting update
+        self._pendingLights = {}
 
     def __repr__(self):
         return "WorldEditorDimension(dimName=%r, adapter=%r)" % (self.dimName, self.adapter)
@@ -846,9 +1094,23 @@ class WorldEditorDimension(object):
         """
         if chunkPositions is None:
             chunkPositions = self.chunkPositions()
-        for cx, cz in chunkPositions:
-            if self.containsChunk(cx, cz) or create:
-                yield self.getChunk(cx, cz, create)
+
+        # Read chunks in batches no larger than half of the chunk cache, so that
+        # prefetched chunks aren't evicted before they are used
+        batchSize = CHUNK_PREFETCH
+        maxsize = self.worldEditor._chunkDataCache.maxsize
+        if maxsize is not None:
+            batchSize = max(1, min(batchSize, maxsize // 2))
+        chunkPositions = iter(chunkPositions)
+        while True:
+            batch = list(itertools.islice(chunkPositions, batchSize))
+            if not batch:
+                break
+            self.worldEditor.prefetchChunks(batch, self.dimName)
+
+            for cx, cz in batch:
+                if self.containsChunk(cx, cz) or create:
+                    yield self.getChunk(cx, cz, create)
 
     def createChunk(self, cx, cz):
         return self.worldEditor.createChunk(cx, cz, self.dimName)
@@ -882,15 +1144,18 @@ class WorldEditorDimension(object):
         entities: Iterator[EntityRef]
         
         """
-        for chunk in self.getChunks(selection.chunkPositions()):
-            for ref in chunk.Entities:
-                if ref.Position in selection:
-                    if matchEntityTags(ref, kw):
-                        yield ref
+        return self._getEntities("Entities", selection, kw)
 
     def getTileEntities(self, selection, **kw):
+        return self._getEntities("TileEntities", selection, kw)
+
+    def _getEntities(self, attrName, selection, kw):
         for chunk in self.getChunks(selection.chunkPositions()):
-            for ref in chunk.TileEntities:
+            index = chunk.getEntityIndex(attrName)
+            refList = getattr(chunk, attrName)
+            # Create the refs before yielding any, in case the caller removes entities from this chunk
+            refs = [refList[i] for i in index.indexesIn(selection, kw.get("id"))]
+            for ref in refs:
                 if ref.Position in selection:
                     if matchEntityTags(ref, kw):
                         yield ref
@@ -899,10 +1164,10 @@ class WorldEditorDimension(object):
         cx = pos[0] >> 4
         cz = pos[2] >> 4
         chunk = self.getChunk(cx, cz)
-        for ref in chunk.TileEntities:
-            if ref.Position == pos:
-                if matchEntityTags(ref, kw):
-                    return ref
+        for i in chunk.getEntityIndex("TileEntities").indexesAt(pos):
+            ref = chunk.TileEntities[i]
+            if matchEntityTags(ref, kw):
+                return ref
 
     def addEntity(self, ref):
         x, y, z = ref.Position
@@ -914,8 +1179,8 @@ class WorldEditorDimension(object):
         x, y, z = ref.Position
         cx, cz = chunk_pos(x, z)
         chunk = self.getChunk(cx, cz, create=True)
-        existing = [old for old in chunk.TileEntities
-                    if old.Position == (x, y, z)]
+        existing = [chunk.TileEntities[i]
+                    for i in chunk.getEntityIndex("TileEntities").indexesAt((x, y, z))]
         for e in existing:
             chunk.removeTileEntity(e)
 
@@ -972,6 +1237,67 @@ class WorldEditorDimension(object):
     def fillBlocks(self, box, block, blocksToReplace=(), updateLights=True):
         return exhaust(self.fillBlocksIter(box, block, blocksToReplace, updateLights))
     
+    # --- Lighting ---
+
+    def setDeferredLighting(self, deferred):
+        """
+        Turn deferred lighting on or off. While it is on, edits that update lighting only record the cells
+        they changed, and the lighting of all recorded cells is updated at once by `updatePendingLights`.
+        This happens before the world editor writes chunks, such as when it commits an undo revision or
+        saves, and before the renderer loads a chunk. Each cell is relit once no matter how many edits
+        changed it.
+
+        Turning deferred lighting off updates the recorded cells immediately.
+
+        Parameters
+        ----------
+        deferred : bool
+        """
+        self.deferLighting = deferred
+        if not deferred:
+            self.updatePendingLights()
+
+    def addPendingLights(self, x, y, z):
+        """
+        Record cells whose lighting should be updated by the next call to `updatePendingLights`.
+
+        Parameters
+        ----------
+        x, y, z : ndarray
+            Coordinates of the cells
+        """
+        maxHeight = self.worldEditor.maxHeight
+        for cx, cz, sx, sy, sz, _ in coords_by_chunk(x, y, z):
+            inWorld = (sy >= 0) & (sy < maxHeight)
+            sx, sy, sz = sx[inWorld], sy[inWorld], sz[inWorld]
+            cys, indexes = bucket_indexes(sy >> 4)
+            for cy, index in zip(cys, indexes):
+                key = int(cx), int(cy), int(cz)
+                mask = self._pendingLights.get(key)
+                if mask is None:
+                    mask = self._pendingLights[key] = numpy.zeros((16, 16, 16), bool)
+                mask[sy[index] & 0xf, sz[index], sx[index]] = True
+
+    def hasPendingLights(self):
+        return len(self._pendingLights) > 0
+
+    def updatePendingLights(self):
+        """
+        Update the lighting of all cells recorded while deferred lighting was on, in one batch.
+        """
+        if not self._pendingLights:
+            return
+        pending = self._pendingLights
+        self._pendingLights = {}
+
+        coords = []
+        for (cx, cy, cz), mask in pending.iteritems():
+            y, z, x = mask.nonzero()
+            coords.append((x + (cx << 4), y + (cy << 4), z + (cz << 4)))
+        x, y, z = [numpy.concatenate(c) for c in zip(*coords)]
+        log.info("Updating deferred lighting for %d cells in %d sections", len(x), len(pending))
+        relight.updateLightsNow(self, x, y, z)
+
     # --- Analyze ---   
 
     def analyzeIter(self, selection):
@@ -979,6 +1305,18 @@ class WorldEditorDimension(object):
 
     # --- Blocks by single coordinate ---
 
+    def getBlockAccessor(self):
+        """
+        Return a BlockAccessor for this dimension. The accessor has the same methods for getting and setting
+        single blocks and light values as the dimension, but remembers the chunk and sections it last used. Use
+        it for loops that access many nearby blocks one at a time.
+
+        Returns
+        -------
+        accessor: mceditlib.blockaccessor.BlockAccessor
+        """
+        return BlockAccessor(self)
+
     def getBlock(self, x, y, z):
         """
         Returns the block at the given position as an instance of BlockType.
@@ -1082,7 +1420,7 @@ class WorldEditorDimension(object):
                 assert array is not None
                 if array is not None:
                     array[y & 0xf, z & 0xf, x & 0xf] = value
-            chunk.dirty = True
+            chunk.markDirty(cy)
 
     def getBlockData(self, x, y, z, default=0):
         """
@@ -1136,7 +1474,7 @@ class WorldEditorDimension(object):
                 assert array is not None
                 if array is not None:
                     array[y & 0xf, z & 0xf, x & 0xf] = value
-            chunk.dirty = True
+            chunk.markDirty(cy)
 
     def getLight(self, arrayName, x, y, z, default=0):
         cx = x >> 4
@@ -1162,7 +1500,7 @@ class WorldEditorDimension(object):
                 array = getattr(sec, arrayName)
                 if array is not None:
                     array[y & 0xf, z & 0xf, x & 0xf] = value
-                chunk.dirty = True
+                chunk.markDirty(cy)
 
     def getBlockLight(self, x, y, z, default=0):
         return self.getLight("BlockLight", x, y, z, default)
@@ -1195,7 +1533,7 @@ class WorldEditorDimension(object):
             assert array is not None
             if array is not None:
                 array[z & 0xf, x & 0xf] = value
-            chunk.dirty = True
+            chunk.markDirty()
 
     # --- Blocks by coordinate arrays ---
 
@@ -1,16 +1,21 @@
 import itertools
 import os
 import shutil
+import time
+import zlib
 
 import numpy
 import pytest
 
-from mceditlib.anvil.adapter import AnvilWorldAdapter
-from mceditlib.util import exhaust
+from mceditlib.anvil.adapter import AnvilWorldAdapter, AnvilSection, PalettedAnvilSection, setPalettedSections
+from mceditlib.anvil.adapter import packNibbleArray, unpackNibbleArray, unpackNibbleArrays
+from mceditlib.util import exhaust, workers
 
 from mceditlib.worldeditor import WorldEditor
 from mceditlib import nbt
 from mceditlib.selection import BoundingBox
+from mceditlib.exceptions import LevelFormatError
+from mceditlib.pc import regionfile
 from mceditlib.pc.regionfile import RegionFile
 
 __author__ = 'Rio'
@@ -94,3 +99,444 @@ def testBigEndianIntHeightMap(tmpdir, temp_file):
 
     eq = (changedChunk["Level"]["HeightMap"].value == oldhm)
     assert eq.all()
+
+
+@pytest.mark.parametrize(['temp_file'], [('AnvilWorld/region/r.0.0.mca',)],
+                         ids=['AnvilWorld'], indirect=True)
+def testRegionFileFlush(temp_file):
+    """ Test that chunks written to a region file are present after flushing
+    and reopening the file.
+    """
+    region = RegionFile(temp_file.strpath)
+    chunk_data = region.readChunkBytes(0, 0)
+    positions = list(region.chunkPositions())
+    for cx, cz in positions:
+        region.writeChunkBytes(cx, cz, chunk_data + b"\0" * 10000)
+    region.close()
+
+    region = RegionFile(temp_file.strpath)
+    assert list(region.chunkPositions()) == positions
+    for cx, cz in positions:
+        assert region.readChunkBytes(cx, cz) == chunk_data + b"\0" * 10000
+    region.close()
+
+
+def testRegionFileOpenLimit(tmpdir, monkeypatch):
+    """ Test that region files closed for exceeding MAX_OPEN_FILES keep their changes.
+    """
+    monkeypatch.setattr(regionfile, "MAX_OPEN_FILES", 2)
+    regions = [RegionFile(tmpdir.join("r.%d.0.mca" % i).strpath) for i in range(5)]
+    for i, region in enumerate(regions):
+        region.writeChunkBytes(0, 0, b"chunk %d" % i)
+    for i, region in enumerate(regions):
+        assert region.readChunkBytes(0, 0) == b"chunk %d" % i
+        region.close()
+
+    for i in range(5):
+        region = RegionFile(tmpdir.join("r.%d.0.mca" % i).strpath)
+        assert region.readChunkBytes(0, 0) == b"chunk %d" % i
+        region.close()
+
+
+def testRegionFileMappedOpenLimit(tmpdir, monkeypatch):
+    """ Test that memory-mapped region files count toward MAX_OPEN_FILES, and are
+    mapped again when read after being closed.
+    """
+    monkeypatch.setattr(regionfile, "MAX_OPEN_FILES", 2)
+    for i in range(4):
+        region = RegionFile(tmpdir.join("r.%d.0.mca" % i).strpath)
+        region.writeChunkBytes(0, 0, b"chunk %d" % i)
+        region.close()
+
+    regions = [RegionFile(tmpdir.join("r.%d.0.mca" % i).strpath, readonly=True) for i in range(4)]
+    assert len(regionfile._openRegionFiles) == 2
+    assert [region._mapping is not None for region in regions] == [False, False, True, True]
+
+    for i, region in enumerate(regions):
+        assert region.readChunkBytes(0, 0) == b"chunk %d" % i
+        assert len(regionfile._openRegionFiles) <= 2
+    assert [region._mapping is not None for region in regions] == [False, False, True, True]
+
+    for region in regions:
+        region.close()
+    assert not regionfile._openRegionFiles
+
+
+@pytest.mark.parametrize(['temp_file'], [('AnvilWorld/region/r.0.0.mca',)],
+                         ids=['AnvilWorld'], indirect=True)
+def testRegionFileReadOnly(temp_file):
+    """ Test that a memory-mapped read-only region file reads the same chunks
+    as a writable one.
+    """
+    region = RegionFile(temp_file.strpath)
+    mappedRegion = RegionFile(temp_file.strpath, readonly=True)
+    positions = list(region.chunkPositions())
+    assert list(mappedRegion.chunkPositions()) == positions
+    for cx, cz in positions:
+        assert mappedRegion.readChunkBytes(cx, cz) == region.readChunkBytes(cx, cz)
+
+    mappedRegion.close()
+    cx, cz = positions[0]
+    assert mappedRegion.readChunkBytes(cx, cz) == region.readChunkBytes(cx, cz)
+    region.close()
+
+
+@pytest.mark.parametrize(['temp_file'], [('AnvilWorld/region/r.0.0.mca',)],
+                         ids=['AnvilWorld'], indirect=True)
+def testRegionFileReuseSectors(temp_file):
+    """ Test that sectors freed by deleting chunks are reused, and that chunks
+    never share sectors.
+    """
+    region = RegionFile(temp_file.strpath)
+    positions = list(region.chunkPositions())
+    chunk_data = region.readChunkBytes(*positions[0])
+    for cx, cz in positions[::2]:
+        region.deleteChunk(cx, cz)
+    region.flush()
+
+    sectorCount = region.sectorCount
+    for cx, cz in positions[::2]:
+        region.writeChunkBytes(cx, cz, chunk_data)
+    assert region.sectorCount == sectorCount
+
+    freeSectors, needsRepair = region._scanFreeSectors(region.sectorCount)
+    assert not needsRepair
+    assert (freeSectors == region.freeSectors).all()
+    region.close()
+
+
+def testRegionFileReleasedSectors(tmpdir):
+    """ Test that sectors released by moving a chunk are not reused until the
+    offset table has been written.
+    """
+    path = tmpdir.join("r.0.0.mca").strpath
+    region = RegionFile(path)
+    region.writeChunkBytes(0, 0, b"first chunk")
+    region.writeChunkBytes(1, 0, b"second chunk")
+    region.flush()
+    oldOffset = region._getOffset(0, 0)
+
+    # Move the first chunk by making it larger than one sector
+    region.writeChunkBytes(0, 0, os.urandom(5000))
+    assert region._getOffset(0, 0) != oldOffset
+    region.writeChunkBytes(2, 0, b"third chunk")
+    assert region._getOffset(2, 0) >> 8 != oldOffset >> 8
+
+    # An interrupted save still finds the first chunk's old data
+    region._file.flush()
+    savedRegion = RegionFile(path, readonly=True)
+    assert savedRegion.readChunkBytes(0, 0) == b"first chunk"
+    assert not savedRegion.containsChunk(2, 0)
+    savedRegion.close()
+
+    region.flush()
+    assert region.freeSectors[oldOffset >> 8]
+    region.close()
+
+
+def testCompactRegionFiles(pc_world):
+    dim = pc_world.getDimension()
+    positions = sorted(dim.chunkPositions())
+    tags = {}
+    for cx, cz in positions[::2]:
+        dim.deleteChunk(cx, cz)
+    for cx, cz in positions[1::2]:
+        tags[cx, cz] = dim.getChunk(cx, cz).buildNBTTag().save(compressed=False)
+    pc_world.saveChanges()
+
+    regionPath = os.path.join(pc_world.filename, "region", "r.0.0.mca")
+    oldSize = os.path.getsize(regionPath)
+    pc_world.compactRegionFiles()
+    assert os.path.getsize(regionPath) < oldSize
+
+    pc_world.close()
+    reopened = WorldEditor(pc_world.filename)
+    try:
+        dim = reopened.getDimension()
+        assert sorted(dim.chunkPositions()) == positions[1::2]
+        for cx, cz in positions[1::2]:
+            assert dim.getChunk(cx, cz).buildNBTTag().save(compressed=False) == tags[cx, cz]
+    finally:
+        reopened.close()
+
+
+def testReadChunks(pc_world):
+    adapter = pc_world.adapter
+    positions = list(pc_world.getDimension().chunkPositions())[::-1]
+    positions.insert(3, (1000, 1000))
+
+    chunks = list(adapter.readChunks(positions, ""))
+    assert [(c.cx, c.cz) for c in chunks] == [p for p in positions if p != (1000, 1000)]
+    for chunkData in chunks:
+        expected = adapter.readChunk(chunkData.cx, chunkData.cz, "")
+        assert chunkData.buildNBTTag().save(compressed=False) == expected.buildNBTTag().save(compressed=False)
+
+
+def testReadChunksDamaged(pc_world):
+    dim = pc_world.getDimension()
+    positions = sorted(dim.chunkPositions())
+    badPosition = positions[3]
+    pc_world.adapter.selectedRevision.writeChunkBytes(badPosition[0], badPosition[1], "", b"not a chunk")
+
+    chunks = list(pc_world.adapter.readChunks(positions, ""))
+    assert [(c.cx, c.cz) for c in chunks] == [p for p in positions if p != badPosition]
+
+    # Chunks before the damaged one are still returned by getChunks
+    chunks = dim.getChunks(positions)
+    for cx, cz in positions[:3]:
+        assert next(chunks).chunkPosition == (cx, cz)
+    with pytest.raises(LevelFormatError):
+        next(chunks)
+    with pytest.raises(LevelFormatError):
+        dim.getChunk(*badPosition)
+    assert dim.getChunk(*positions[4]).chunkPosition == positions[4]
+
+
+def testSaveCompressionLevel(pc_world):
+    dim = pc_world.getDimension()
+    tags = {}
+    for cx, cz in dim.chunkPositions():
+        chunk = dim.getChunk(cx, cz)
+        chunk.dirty = True
+        tags[cx, cz] = chunk.buildNBTTag().save(compressed=False)
+
+    oldLevel = regionfile._compressionLevel
+    workers.setWorkerCount(2)
+    regionfile.setCompressionLevel(9)
+    try:
+        pc_world.saveChanges()
+    finally:
+        regionfile.setCompressionLevel(oldLevel)
+        workers.setWorkerCount(None)
+
+    for (cx, cz), tag in tags.iteritems():
+        data, fmt = pc_world.adapter.selectedRevision.readChunkCompressed(cx, cz, "")
+        assert bytes(data) == zlib.compress(tag, 9)
+
+    pc_world.close()
+    reopened = WorldEditor(pc_world.filename)
+    try:
+        dim = reopened.getDimension()
+        assert sorted(dim.chunkPositions()) == sorted(tags)
+        for (cx, cz), tag in tags.iteritems():
+            assert dim.getChunk(cx, cz).buildNBTTag().save(compressed=False) == tag
+    finally:
+        reopened.close()
+
+
+def testSectionDecodedClean(pc_world):
+    dim = pc_world.getDimension()
+    cx, cz = [pos for pos in dim.chunkPositions() if len(dim.getChunk(*pos).Entities)][0]
+    chunk = dim.getChunk(cx, cz)
+    sections = [chunk.getSection(cy) for cy in chunk.sectionPositions()]
+    assert len(sections) > 1
+
+    # Sections that were only read are saved with the tags they were loaded from
+    assert not any(section.dirty for section in sections)
+    encodedTags = [section.encodedTag for section in sections]
+    assert None not in encodedTags
+
+    # Changing an entity only marks the chunk dirty
+    entity = chunk.Entities[0]
+    entity.Position = entity.Position + (1, 0, 0)
+    assert chunk.dirty
+    assert not any(section.dirty for section in sections)
+
+    levelTag = chunk.buildNBTTag()["Level"]
+    assert all(any(tag is encodedTag for tag in levelTag["Sections"]) for encodedTag in encodedTags)
+
+    blocks = [numpy.array(section.Blocks) for section in sections]
+    position = entity.Position
+    pc_world.saveChanges()
+    pc_world.close()
+
+    reopened = WorldEditor(pc_world.filename)
+    try:
+        chunk = reopened.getDimension().getChunk(cx, cz)
+        for section, sectionBlocks in zip(sections, blocks):
+            assert (chunk.getSection(section.Y).Blocks == sectionBlocks).all()
+        assert chunk.Entities[0].Position == position
+    finally:
+        reopened.close()
+
+
+def testCommitUndoAsync(pc_world):
+    dim = pc_world.getDimension()
+    cx, cz = iter(dim.chunkPositions()).next()
+    chunk = dim.getChunk(cx, cz)
+    original = numpy.array(chunk.getSection(0).Blocks)
+
+    pc_world.beginUndo()
+    chunk.getSection(0).Blocks[:] = 6
+    chunk.dirty = True
+    pc_world.commitUndoAsync()
+
+    # Changes made after the commit are not part of the committed revision
+    pc_world.beginUndo()
+    chunk.getSection(0).Blocks[:] = 7
+    chunk.dirty = True
+
+    chunkData = pc_world.adapter.readChunk(cx, cz, "")
+    assert (chunkData.getSection(0).Blocks == 6).all()
+
+    pc_world.commitUndoAsync()
+    pc_world.undo()
+    assert (dim.getChunk(cx, cz).getSection(0).Blocks == 6).all()
+    pc_world.undo()
+    assert (dim.getChunk(cx, cz).getSection(0).Blocks == original).all()
+    pc_world.redo()
+    pc_world.redo()
+    assert (dim.getChunk(cx, cz).getSection(0).Blocks == 7).all()
+
+
+def testCommitUndoAsyncBackground(pc_world):
+    """ Test that chunks committed with commitUndoAsync are written without
+    waiting for the adapter to be used again, and that writing them keeps the
+    chunk index.
+    """
+    workers.setWorkerCount(2)
+    try:
+        dim = pc_world.getDimension()
+        positions = sorted(dim.chunkPositions())[:4]
+        history = pc_world.adapter.revisionHistory
+        for cx, cz in positions:
+            pc_world.adapter.readChunk(cx, cz, "")
+
+        pc_world.beginUndo()
+        revision = pc_world.adapter.selectedRevision
+        cx, cz = positions[0]
+        chunk = dim.getChunk(cx, cz)
+        chunk.getSection(0).Blocks[:] = 6
+        chunk.dirty = True
+        pc_world.commitUndoAsync()
+        pc_world.beginUndo()
+
+        for i in range(500):
+            if not pc_world.adapter._pendingWrites:
+                break
+            time.sleep(0.01)
+        assert not pc_world.adapter._pendingWrites
+        assert revision.worldFolder.containsChunk(cx, cz, "")
+        assert all((ox, oz, "") in history._chunkIndex for ox, oz in positions[1:])
+
+        chunkData = pc_world.adapter.readChunk(cx, cz, "")
+        assert (chunkData.getSection(0).Blocks == 6).all()
+    finally:
+        workers.setWorkerCount(None)
+
+
+def testNibbleArrays():
+    unpacked = numpy.random.randint(0, 16, (4, 16, 16, 16)).astype('uint8')
+    packed = [packNibbleArray(a) for a in unpacked]
+    assert packed[0].shape == (16, 16, 8)
+    # Low nibble first
+    assert ((packed[0] & 0xf) == unpacked[0][..., ::2]).all()
+    assert ((packed[0] >> 4) == unpacked[0][..., 1::2]).all()
+
+    assert (unpackNibbleArrays(packed) == unpacked).all()
+    for unpackedData, packedData in zip(unpacked, packed):
+        assert (unpackNibbleArray(packedData) == unpackedData).all()
+
+        out = numpy.empty((16, 16, 8), 'uint8')
+        assert packNibbleArray(unpackedData, out) is out
+        assert (out == packedData).all()
+
+        out = numpy.empty((16, 16, 16), 'uint8')
+        assert unpackNibbleArray(packedData, out) is out
+        assert (out == unpackedData).all()
+
+
+def testSectionAddArray():
+    section = AnvilSection()
+    section.Blocks[:] = numpy.random.randint(0, 4096, (16, 16, 16))
+    section.Data[:] = numpy.random.randint(0, 16, (16, 16, 16))
+    tag = section.buildNBTTag()
+    assert "Add" in tag
+
+    loaded = AnvilSection(tag.copy())
+    for name in "Blocks", "Data", "SkyLight", "BlockLight":
+        assert (getattr(loaded, name) == getattr(section, name)).all()
+
+
+def testPalettedSections(pc_world):
+    adapter = pc_world.adapter
+    cx, cz = iter(pc_world.getDimension().chunkPositions()).next()
+    dense = adapter.readChunk(cx, cz, "")
+
+    setPalettedSections(True)
+    try:
+        paletted = adapter.readChunk(cx, cz, "")
+    finally:
+        setPalettedSections(False)
+
+    def tagBytes(chunkData):
+        return chunkData.buildNBTTag().save(compressed=False)
+
+    for chunkData in paletted, dense:
+        for cy in chunkData.sectionPositions():
+            chunkData.getSection(cy)
+    assert tagBytes(paletted) == tagBytes(dense)
+    assert paletted.estimateSize() < dense.estimateSize()
+
+    section = paletted.getSection(0)
+    assert isinstance(section, PalettedAnvilSection)
+    for name in "Blocks", "Data", "SkyLight", "BlockLight":
+        assert (getattr(section, name) == getattr(dense.getSection(0), name)).all()
+
+    section.Blocks[0, 0, 0] = 1
+    dense.getSection(0).Blocks[0, 0, 0] = 1
+    paletted.compactSections()
+    assert section.nbytes < dense.getSection(0).nbytes
+    assert tagBytes(paletted) == tagBytes(dense)
+
+
+def testLazySections(pc_world):
+    adapter = pc_world.adapter
+    cx, cz = iter(pc_world.getDimension().chunkPositions()).next()
+    chunkData = adapter.readChunk(cx, cz, "")
+    decoded = adapter.readChunk(cx, cz, "")
+    positions = sorted(decoded.sectionPositions())
+    for cy in positions:
+        assert decoded.getSection(cy) is not None
+
+    assert not chunkData._sections
+    assert sorted(chunkData.sectionPositions()) == positions
+    assert len(chunkData.Entities) == len(decoded.Entities)
+
+    def sectionTags(chunk):
+        return {tag["Y"].value: tag for tag in chunk.buildNBTTag()["Level"]["Sections"]}
+
+    lazyTags = sectionTags(chunkData)
+    decodedTags = sectionTags(decoded)
+    assert sorted(lazyTags) == sorted(decodedTags)
+    for y, tag in lazyTags.iteritems():
+        assert sorted(tag.keys()) == sorted(decodedTags[y].keys())
+        for name in "Blocks", "Data", "SkyLight", "BlockLight":
+            assert (tag[name].value.ravel() == decodedTags[y][name].value.ravel()).all()
+
+
+def testSectionDirty(pc_world):
+    dim = pc_world.getDimension()
+    cx, cz = iter(dim.chunkPositions()).next()
+    chunk = dim.getChunk(cx, cz)
+    chunkData = chunk.chunkData
+    sections = [chunk.getSection(cy) for cy in chunk.sectionPositions()]
+    assert len(sections) > 1
+
+    chunk.buildNBTTag()
+    assert not any(section.dirty for section in sections)
+    encodedTags = [section.encodedTag for section in sections]
+
+    dim.setBlocks(cx << 4, 0, cz << 4, 1, updateLights=False)
+    assert chunk.dirty
+    assert chunk.getSection(0).dirty
+    assert [section.dirty for section in sections if section.Y != 0] == [False] * (len(sections) - 1)
+
+    levelTag = chunk.buildNBTTag()["Level"]
+    assert all(tag is section.encodedTag for tag, section in zip(encodedTags, sections) if section.Y != 0)
+    section0 = [tag for tag in levelTag["Sections"] if tag["Y"].value == 0][0]
+    assert section0["Blocks"].value.ravel()[0] == 1
+
+    chunkData.dirty = False
+    chunk.dirty = True
+    assert all(section.dirty for section in sections)
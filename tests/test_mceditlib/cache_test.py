@@ -3,8 +3,12 @@
 """
 from __future__ import absolute_import, division, print_function
 from collections import deque
+import gc
 import logging
 
+from mceditlib.cachefunc import lru_cache_object
+from mceditlib.worldeditor import _chunkDataSize
+
 
 def testThrashing(pc_world):
     if not hasattr(pc_world, '_chunkDataCache'):
@@ -27,6 +31,81 @@ def testThrashing(pc_world):
         recent.append((cx, cz, ""))
 
 
+def testLRUOrder():
+    evicted = []
+    cache = lru_cache_object(lambda x: x * 2, 3)
+    cache.will_decache = evicted.append
+    cache(1)
+    cache(2)
+    cache(3)
+    cache(1)
+    cache(4)
+    assert evicted == [4]  # 2 * 2
+    assert sorted(cache) == [(1,), (3,), (4,)]
+
+    cache.decache(3)
+    cache.store(10, 5)
+    assert (3,) not in cache and cache(5) == 10
+    assert cache.hits == 2 and cache.misses == 4
+
+    cache.should_decache = lambda key: key != (1,)
+    cache(6)
+    cache(7)
+    assert (1,) in cache and (7,) in cache and len(cache) == 3
+
+
+def testByteLimit():
+    cache = lru_cache_object(lambda x: "x" * x, None, maxbytes=100, sizeof=len)
+    for i in range(1, 30):
+        cache(i)
+        assert cache.currentBytes <= 100
+    assert cache.currentBytes == sum(len(cache(*key)) for key in cache)
+    assert cache.misses == 29
+    assert cache.evictions == 29 - len(cache)
+
+    cache.should_decache = lambda key: key != (29,)
+    cache(60)
+    cache(61)
+    assert (29,) in cache and (61,) in cache
+    assert cache.currentBytes == 90
+
+
+def testChunkCacheByteLimit(pc_world):
+    pc_world.setCacheByteLimit(1024 * 1024)
+    dim = pc_world.getDimension()
+    for cx, cz in dim.chunkPositions():
+        dim.getChunk(cx, cz)
+
+    stats = pc_world.getCacheStats()
+    assert stats["bytes"] <= 1024 * 1024
+    assert stats["evictions"] > 0
+    assert stats["misses"] == stats["chunks"] + stats["evictions"]
+
+
+def testChunkCacheResize(pc_world):
+    cache = pc_world._chunkDataCache
+    dim = pc_world.getDimension()
+    positions = list(dim.chunkPositions())
+    chunks = [dim.getChunk(cx, cz) for cx, cz in positions[:20]]
+
+    # Sections decoded after the chunks were cached are counted
+    oldBytes = cache.currentBytes
+    for chunk in chunks:
+        for cy in chunk.sectionPositions():
+            chunk.getSection(cy)
+    assert cache.currentBytes > oldBytes
+    assert cache.currentBytes == sum(_chunkDataSize(cache(*key)) for key in cache)
+
+    # Released chunks are measured and evicted before the next chunk is cached
+    pc_world.setCacheByteLimit(cache.currentBytes // 2)
+    pc_world.recentChunks.clear()
+    del chunk, chunks
+    gc.collect()
+    dim.getChunk(*positions[20])
+    assert cache.currentBytes <= cache.maxbytes
+    assert cache.currentBytes == sum(_chunkDataSize(cache(*key)) for key in cache)
+
+
 def testOldThrashing(pc_world):
     if not hasattr(pc_world, '_loadedChunkData'):
         return
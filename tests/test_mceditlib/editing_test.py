@@ -3,6 +3,7 @@ import pytest
 
 from mceditlib.blocktypes import blocktypeConverter
 from mceditlib.export import extractSchematicFrom
+from mceditlib.multi_block import coords_by_chunk
 from mceditlib.selection import BoundingBox
 from mceditlib.worldeditor import WorldEditor
 
@@ -115,3 +116,57 @@ def testExportImport(any_world):
 
 if __name__ == "__main__":
     pytest.main()
+
+
+def testCoordsByChunk():
+    x = numpy.array([[5, 40], [-3, 17]])
+    y = numpy.array([[1, 20], [70, 3]])
+    z = numpy.array([[0, 0], [33, 2]])
+
+    buckets = list(coords_by_chunk(x, y, z))
+    assert sorted((cx, cz) for cx, cz, _, _, _, _ in buckets) == [(-1, 2), (0, 0), (1, 0), (2, 0)]
+    for cx, cz, bx, by, bz, mask in buckets:
+        assert ((x[mask] >> 4) == cx).all() and ((z[mask] >> 4) == cz).all()
+        assert (bx == x[mask] & 0xf).all() and (by == y[mask]).all() and (bz == z[mask] & 0xf).all()
+
+
+def testGetSetBlocks(any_world):
+    dim = any_world.getDimension()
+    bounds = dim.bounds
+    x = numpy.arange(bounds.minx, bounds.minx + 40)
+    y = numpy.arange(bounds.miny, bounds.miny + 40)
+    z = numpy.arange(bounds.minz, bounds.minz + 40)
+    dim.setBlocks(x, y, z, Blocks=numpy.arange(40) % 5 + 1, updateLights=False)
+
+    expected = [dim.getBlockID(*pos) for pos in zip(x, y, z)]
+    assert list(dim.getBlocks(x, y, z).Blocks) == expected
+
+
+def testBlockAccessor(any_world):
+    dim = any_world.getDimension()
+    accessor = dim.getBlockAccessor()
+    bounds = dim.bounds
+    positions = [(bounds.minx + i, bounds.miny + i, bounds.minz + i // 2) for i in range(40)]
+    for i, pos in enumerate(positions):
+        accessor.setBlock(*pos, blocktype=(i % 5 + 1, 0))
+        accessor.setBlockLight(*pos, value=i % 16)
+
+    for i, pos in enumerate(positions):
+        assert accessor.getBlockID(*pos) == dim.getBlockID(*pos) == i % 5 + 1
+        assert accessor.getBlock(*pos) == dim.getBlock(*pos)
+        assert accessor.getBlockLight(*pos) == dim.getBlockLight(*pos) == i % 16
+
+    assert accessor.getBlockID(bounds.maxx + 1000, 0, 0, default=-1) == -1
+
+
+def testBlockAccessorMissingLight(pc_world):
+    dim = pc_world.getDimension()
+    accessor = dim.getBlockAccessor()
+    cx, cz = iter(dim.chunkPositions()).next()
+    chunk = dim.getChunk(cx, cz)
+    chunk.getSection(0).SkyLight = None
+    x, z = cx << 4, cz << 4
+
+    assert accessor.getSkyLight(x, 0, z, default=7) == dim.getSkyLight(x, 0, z, default=7) == 7
+    accessor.setSkyLight(x, 0, z, 3)
+    assert chunk.getSection(0).SkyLight is None
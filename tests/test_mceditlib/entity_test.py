@@ -1,3 +1,63 @@
 
 __author__ = 'Rio'
 
+
+from mceditlib.selection import BoundingBox
+
+
+def testEntityIndex(pc_world):
+    dim = pc_world.getDimension()
+    bounds = dim.bounds
+    allEntities = [ref for chunk in dim.getChunks() for ref in chunk.Entities]
+    assert len(allEntities)
+    assert len(list(dim.getEntities(bounds))) == len(allEntities)
+
+    entity = allEntities[0]
+    entityID = entity.id
+    sameID = [ref for ref in allEntities if ref.id == entityID]
+    assert len(list(dim.getEntities(bounds, id=entityID))) == len(sameID)
+
+    # Index is kept up to date when adding and removing entities
+    newEntity = entity.copy()
+    x, y, z = entity.Position
+    newEntity.Position = (x, y + 1, z)
+    dim.addEntity(newEntity)
+    box = BoundingBox(newEntity.Position.intfloor(), (1, 1, 1))
+    found = list(dim.getEntities(box, id=entityID))
+    assert [ref.Position for ref in found] == [newEntity.Position]
+
+    dim.removeEntity(found[0])
+    assert not list(dim.getEntities(box, id=entityID))
+    assert len(list(dim.getEntities(bounds, id=entityID))) == len(sameID)
+
+    # Moving an entity through its ref updates the index
+    entity.Position = (x, y + 2, z)
+    box = BoundingBox(entity.Position.intfloor(), (1, 1, 1))
+    assert len(list(dim.getEntities(box, id=entityID))) == 1
+
+
+def testTileEntityIndex(pc_world):
+    dim = pc_world.getDimension()
+    tileEntities = [ref for chunk in dim.getChunks() for ref in chunk.TileEntities]
+    assert len(tileEntities)
+    for ref in tileEntities:
+        assert dim.getTileEntity(ref.Position).rootTag is ref.rootTag
+
+    ref = tileEntities[0]
+    replacement = ref.copy()
+    dim.addTileEntity(replacement)
+    assert dim.getTileEntity(ref.Position).rootTag is not ref.rootTag
+    assert len(list(dim.getTileEntities(BoundingBox(ref.Position, (1, 1, 1))))) == 1
+
+
+def testEntityIndexLazy(pc_world):
+    dim = pc_world.getDimension()
+    chunk = next(chunk for chunk in dim.getChunks() if len(chunk.Entities))
+    index = chunk.getEntityIndex("Entities")
+    assert not index.built
+
+    # Built from the tags on the first search
+    list(dim.getEntities(chunk.bounds))
+    assert index.built
+    assert [tuple(p) for p in index.positions] == [tuple(ref.Position) for ref in chunk.Entities]
+    assert list(index.ids) == [ref.id for ref in chunk.Entities]
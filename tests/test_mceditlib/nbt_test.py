@@ -158,3 +158,20 @@ def testErrors(created_nbt):
     with pytest.raises(KeyError):
         del level["DEADBEEF"]
 
+
+
+def testLazyLoad(created_nbt):
+    data = created_nbt.save(compressed=False)
+    level = nbt.load(buf=data, lazy=True)
+
+    # Untouched tags are saved unchanged
+    assert level.save(compressed=False) == data
+    assert level == nbt.load(buf=data)
+    assert level.copy().save(compressed=False) == data
+
+    level["Map"]["Spawn"].append(nbt.TAG_Short(1))
+    created_nbt["Map"]["Spawn"].append(nbt.TAG_Short(1))
+    assert level.save(compressed=False) == created_nbt.save(compressed=False)
+
+    with pytest.raises(nbt.NBTFormatError):
+        nbt.load(buf=data[:-20], lazy=True)
@@ -7,11 +7,13 @@ import logging
 
 log = logging.getLogger(__name__)
 
-from .conftest import copy_temp_file
+from tests.conftest import copy_temp_file
 
 import pytest
 
 from mceditlib import nbt
+from mceditlib.anvil.chunkstore import ChunkStore
+from mceditlib.pc.regionfile import RegionFile, deflate
 
 
 @pytest.fixture
@@ -124,3 +126,135 @@ def testRevision(history):
     history.close()
 
 
+
+
+def testChunkIndex(history):
+    revA = history.createRevision()
+    cx, cz = iter(revA.chunkPositions("")).next()
+    chunk = readChunkTag(revA, cx, cz)
+    chunk["Level"]["test"] = nbt.TAG_String("revA")
+    writeChunkTag(revA, cx, cz, chunk)
+
+    revB = history.createRevision()
+    assert readChunkTag(revB, cx, cz)["Level"]["test"].value == "revA"
+
+    # Delete a chunk modified in this revision - the older versions must stay hidden.
+    chunk["Level"]["test"] = nbt.TAG_String("revB")
+    writeChunkTag(revB, cx, cz, chunk)
+    revB.deleteChunk(cx, cz, "")
+    assert not revB.containsChunk(cx, cz, "")
+
+    # Recreate it in the same revision
+    writeChunkTag(revB, cx, cz, chunk)
+    assert revB.containsChunk(cx, cz, "")
+    assert readChunkTag(revB, cx, cz)["Level"]["test"].value == "revB"
+
+    # Reading from an older node must not see newer versions
+    assert readChunkTag(revA, cx, cz)["Level"]["test"].value == "revA"
+    assert "test" not in readChunkTag(history.rootNode, cx, cz)["Level"]
+
+    revC = history.createRevision()
+    assert readChunkTag(revC, cx, cz)["Level"]["test"].value == "revB"
+
+    history.writeAllChanges(revC)
+    assert readChunkTag(history.rootNode, cx, cz)["Level"]["test"].value == "revB"
+    assert readChunkTag(history.getRevision(1), cx, cz)["Level"]["test"].value == "revA"
+    assert "test" not in readChunkTag(history.getRevision(0), cx, cz)["Level"]
+
+
+def testChunkIndexClosedWrite(history):
+    revA = history.createRevision()
+    positions = list(revA.chunkPositions(""))[:4]
+    for cx, cz in positions:
+        assert revA.containsChunk(cx, cz, "")
+    revB = history.createRevision()
+
+    # Finishing a background write to the closed revision only changes that chunk's entry
+    cx, cz = positions[0]
+    chunk = readChunkTag(revB, cx, cz)
+    chunk["Level"]["test"] = nbt.TAG_String("revA")
+    revA.writeClosedChunkCompressed(cx, cz, "", deflate(chunk.save(compressed=False)), RegionFile.VERSION_DEFLATE)
+    assert history._indexNode is revB
+    assert all((ox, oz, "") in history._chunkIndex for ox, oz in positions[1:])
+    assert readChunkTag(revB, cx, cz)["Level"]["test"].value == "revA"
+
+
+def testWriteNewChunk(history):
+    revA = history.createRevision()
+    cx, cz = iter(revA.chunkPositions("")).next()
+    chunk = readChunkTag(revA, cx, cz)
+    writeChunkTag(revA, 1000, 1000, chunk)
+
+    history.writeAllChanges()
+    assert history.rootNode.containsChunk(1000, 1000, "")
+    # The chunk was new, so the revision before the write must not contain it
+    assert not history.getRevision(0).containsChunk(1000, 1000, "")
+
+
+def testRevisionChangesAddedRemoved(history):
+    revA = history.createRevision()
+    positions = iter(revA.chunkPositions(""))
+    cx, cz = positions.next()
+    dx, dz = positions.next()
+    chunk = readChunkTag(revA, cx, cz)
+
+    revA.deleteChunk(cx, cz, "")
+    writeChunkTag(revA, 1000, 1000, chunk)
+    writeChunkTag(revA, dx, dz, readChunkTag(revA, dx, dz))
+
+    changes = history.getRevisionChanges(0, 1)
+    assert changes.chunks[""] == {(cx, cz), (dx, dz), (1000, 1000)}
+    assert changes.addedChunks[""] == {(1000, 1000)}
+    assert changes.removedChunks[""] == {(cx, cz)}
+
+    changes = history.getRevisionChanges(1, 0)
+    assert changes.addedChunks[""] == {(cx, cz)}
+    assert changes.removedChunks[""] == {(1000, 1000)}
+
+
+def testChunkStoreSharesData(history):
+    revA = history.createRevision()
+    cx, cz = iter(revA.chunkPositions("")).next()
+    chunk = readChunkTag(revA, cx, cz)
+    chunk["Level"]["test"] = nbt.TAG_String("test string")
+    writeChunkTag(revA, cx, cz, chunk)
+    assert len(history.chunkStore) == 1
+
+    # Saving the same chunk again in a later revision does not store it again
+    revB = history.createRevision()
+    writeChunkTag(revB, cx, cz, chunk)
+    writeChunkTag(revB, cx+1, cz, chunk)
+    assert len(history.chunkStore) == 1
+    assert readChunkTag(revB, cx+1, cz)["Level"]["test"].value == "test string"
+
+    # Discarding revisions releases their chunks
+    history.createRevision(0)
+    assert len(history.chunkStore) == 0
+    assert history.chunkStore.storedBytes == 0
+
+    history.writeAllChanges()
+    assert "test" not in readChunkTag(history.rootNode, cx, cz)["Level"]
+
+
+def testChunkStoreMergesFreeSpace(tmpdir):
+    store = ChunkStore(tmpdir.join("chunks.dat").strpath)
+    keys = [store.store(b"%d" % i * 100, RegionFile.VERSION_DEFLATE) for i in range(5)]
+
+    # Free space next to other free space is merged, so a larger payload fits in it
+    store.release(keys[1])
+    store.release(keys[3])
+    store.release(keys[2])
+    assert store._freeExtents == [(300, 100)]
+    key = store.store(b"x" * 300, RegionFile.VERSION_DEFLATE)
+    assert store._entries[key][0] == 100
+    assert store._fileSize == 500
+
+    # Free space reaching the end of the file is truncated
+    store.release(key)
+    store.release(keys[4])
+    assert store._freeExtents == []
+    assert store._fileSize == 100
+    store.flush()
+    assert tmpdir.join("chunks.dat").size() == 100
+    assert store.read(keys[0])[0] == b"0" * 100
+    store.close()